@@ -0,0 +1,150 @@
+# ====================================================
+# 🧪 問答流程量測 (classic vs single)
+# 以固定題組對 HumanLikeBrain 逐題提問，比較兩種回答流程：
+#   classic：AI 擴展關鍵字 → 檢索 → AI 回答 (最多兩次呼叫)
+#   single ：本地檢索 → 一次結構化呼叫 (必要時補搜一次)
+# 輸出每題延遲、LLM 呼叫次數與「預期詞命中率」(回答是否提到該題的關鍵事實)
+# 需要 GEMINI_API_KEY；用法：python bench_bot.py [--modes classic,single] [--report bench_bot_report.json]
+# 壓力測試 (不需 API key，LLM 以固定延遲模擬)：python bench_bot.py --stress 200
+#   經由正式的排程器 (RequestScheduler.submit) 同時送出大量相同問題，
+#   比較開關請求合併 (single-flight) 時的 LLM 呼叫次數與降級回覆數
+# ====================================================
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+from types import SimpleNamespace
+from request_scheduler import RequestScheduler
+
+# (問題, 回答中應出現的詞，任一命中即算答對)
+BENCH_QUERIES = [
+    ("泡麵在哪裡買？", ["員生社", "合作社"]),
+    ("想轉學要找哪個單位？", ["註冊組", "教務處"]),
+    ("這學期什麼時候開學？", ["開學"]),
+    ("段考是幾號？", ["段考", "期中考", "期末考"]),
+    ("學費可以申請減免嗎？", ["減免", "補助"]),
+    ("有哪些獎學金可以申請？", ["獎學金", "獎助學金"]),
+    ("學生要怎麼請假？", ["請假", "生輔組"]),
+    ("社團活動要找誰？", ["社團", "課外活動組"]),
+    ("統測相關資訊在哪裡？", ["統測", "升學"]),
+    ("畢業典禮是哪一天？", ["畢業"]),
+]
+
+
+def run_mode(brain, mode, queries):
+    brain.pipeline = mode
+    rows = []
+    for question, expected in queries:
+        calls_before = brain.llm_calls
+        t0 = time.perf_counter()
+        answer = brain.ask(question)
+        rows.append({
+            "question": question,
+            "latency_sec": round(time.perf_counter() - t0, 3),
+            "llm_calls": brain.llm_calls - calls_before,
+            "hit": any(term in answer for term in expected),
+            "answer": answer,
+        })
+    latencies = [r["latency_sec"] for r in rows]
+    return {
+        "mode": mode,
+        "queries": len(rows),
+        "mean_latency_sec": round(statistics.mean(latencies), 3),
+        "p90_latency_sec": round(sorted(latencies)[int(len(latencies) * 0.9) - 1], 3),
+        "llm_calls": sum(r["llm_calls"] for r in rows),
+        "hit_rate": round(sum(r["hit"] for r in rows) / len(rows), 3),
+        "rows": rows,
+    }
+
+
+def stress(brain, concurrency, question, llm_latency, keywords=("颱風", "停課")):
+    """ concurrency 位使用者同時問同一題 (措辭略有不同)，走正式的排程器，回傳 {合併開/關: 統計} """
+    def fake_generate(prompt, config, purpose="answer"):
+        time.sleep(llm_latency)
+        with brain.stats_lock:
+            brain.llm_calls += 1
+        if config.get("response_mime_type") == "application/json":
+            return SimpleNamespace(text=json.dumps({"action": "answer", "answer": "模擬回答"}, ensure_ascii=False))
+        return SimpleNamespace(text=json.dumps(list(keywords), ensure_ascii=False) if "檢索專家" in prompt else "模擬回答")
+
+    variants = [question, question.rstrip("？?") + "?", " " + question, question.rstrip("？?")]
+    brain._generate = fake_generate
+    coalesce_setting = brain.coalesce
+    results = {}
+    for coalesce in (False, True):
+        brain.coalesce = coalesce
+        brain.expansion_cache.clear()   # 兩輪都從沒有擴展快取開始
+        # 每輪一個全新的排程器 (正式設定的 worker 數與佇列上限)，統計互不影響
+        scheduler = RequestScheduler(brain)
+        calls_before = brain.llm_calls
+        barrier = threading.Barrier(concurrency)
+
+        def one(i):
+            barrier.wait()
+            scheduler.submit(f"stress-{i}", variants[i % len(variants)])
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=one, args=(i,)) for i in range(concurrency)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        sched = scheduler.stats()
+        results["on" if coalesce else "off"] = {
+            "requests": concurrency,
+            "llm_calls": brain.llm_calls - calls_before,
+            "coalesced": sched["coalesced"],
+            "degraded": sched["rejected_full"] + sched["timed_out"],
+            "elapsed_sec": round(time.perf_counter() - t0, 3),
+        }
+    del brain._generate
+    brain.coalesce = coalesce_setting
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 classic 與 single 回答流程的延遲與 LLM 呼叫次數")
+    parser.add_argument("--modes", default="classic,single")
+    parser.add_argument("--limit", type=int, default=0, help="只跑前 N 題")
+    parser.add_argument("--report", default="bench_bot_report.json")
+    parser.add_argument("--stress", type=int, default=0, help="同時送出 N 個相同問題 (模擬 LLM)")
+    parser.add_argument("--stress-question", default="明天颱風有停課嗎？")
+    parser.add_argument("--stress-keywords", default="颱風,停課", help="模擬的 AI 擴展關鍵字 (需能檢索到資料才會呼叫回答)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="壓力測試中模擬的 LLM 延遲 (秒)")
+    args = parser.parse_args()
+
+    if args.stress:
+        from bot_v5_sqlite_fts import get_brain
+        brain = get_brain()
+        result = stress(brain, args.stress, args.stress_question, args.llm_latency,
+                        [k.strip() for k in args.stress_keywords.split(",") if k.strip()])
+        for key in ("off", "on"):
+            r = result[key]
+            print(f"🌀 合併{'開啟' if key == 'on' else '關閉'}：{r['requests']} 個請求 → LLM 呼叫 {r['llm_calls']} 次，"
+                  f"合併 {r['coalesced']} 個、降級回覆 {r['degraded']} 個，耗時 {r['elapsed_sec']:.2f}s")
+        return
+
+    if not os.environ.get("GEMINI_API_KEY"):
+        print("⚠️ 未設定 GEMINI_API_KEY，無法量測。")
+        return
+
+    # bot 模組在 import 時於背景載入資料庫，這裡等待載入完成
+    from bot_v5_sqlite_fts import get_brain
+    brain = get_brain()
+
+    queries = BENCH_QUERIES[:args.limit] if args.limit else BENCH_QUERIES
+    results = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        result = run_mode(brain, mode, queries)
+        results.append(result)
+        print(f"🧪 {mode:<8} 平均 {result['mean_latency_sec']:.2f}s | P90 {result['p90_latency_sec']:.2f}s | "
+              f"LLM 呼叫 {result['llm_calls']} 次 ({result['llm_calls'] / len(queries):.1f}/題) | "
+              f"預期詞命中 {result['hit_rate']:.0%}")
+
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"📄 報告已寫入 {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# ====================================================
+# 🧪 靜態爬蟲吞吐量量測 (本機測試站)
+# 以 nihs_static_data_v43.json 重建一個 START_PAGES 樹狀結構的本機網站，
+# 讓 static_crawler_v43_recursive.py 對它爬取並輸出吞吐量與每頁耗時。
+# 用法：python bench_static_crawl.py [--workers 4] [--latency-ms 150] [--cache-mode offline]
+# ====================================================
+import argparse
+import asyncio
+import html
+import json
+import os
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+SOURCE_FILE = "nihs_static_data_v43.json"
+SITE_HOST = "www.nihs.tp.edu.tw"
+
+
+def build_fixture_site(records):
+    """ 依標題階層 (父標題-子名稱) 重建頁面與左側導航列，回傳 {路徑: HTML} """
+    by_title = {}
+    for item in records:
+        parts = urlsplit(item.get("url", ""))
+        if parts.hostname != SITE_HOST: continue
+        path = parts.path + (f"?{parts.query}" if parts.query else "")
+        by_title[item["title"]] = (path, item)
+
+    children = {}
+    for title in by_title:
+        parent = title.rsplit("-", 1)[0]
+        if parent != title and parent in by_title:
+            children.setdefault(parent, []).append(title)
+
+    pages = {}
+    for title, (path, item) in by_title.items():
+        nav = "".join(
+            f'<a href="{html.escape(by_title[c][0])}">{html.escape(c[len(title) + 1:])}</a>'
+            for c in children.get(title, [])
+        )
+        body = "".join(f"<p>{html.escape(line)}</p>" for line in item.get("content", "").split("\n"))
+        pages[path] = f'<html><body><div class="nav-Vertical">{nav}</div><div class="htmldisplay">{body}</div></body></html>'
+    return pages
+
+
+def serve(pages, latency, port=0):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            page = pages.get(self.path) or pages.get(self.path.rstrip("/"))
+            payload = (page or "<html><body>not found</body></html>").encode("utf-8")
+            self.send_response(200 if page else 404)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="對本機測試站量測靜態爬蟲吞吐量")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=150, help="模擬伺服器回應延遲")
+    parser.add_argument("--host-interval", type=float, default=0.0)
+    # 快取鍵包含主機與埠號，固定埠號才能讓離線重播命中
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-mode", default="off", choices=["off", "revalidate", "offline"],
+                        help="crawl_profile 快取模式；offline 可重播上一次 revalidate 的結果")
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "nihs_bench_cache"))
+    args = parser.parse_args()
+
+    with open(SOURCE_FILE, "r", encoding="utf-8") as f:
+        pages = build_fixture_site(json.load(f))
+    server = serve(pages, args.latency_ms / 1000, args.port)
+    print(f"🧪 本機測試站: {len(pages)} 頁 @ http://127.0.0.1:{server.server_port}")
+
+    # 爬蟲在 import 時讀取設定，因此先設定環境變數
+    os.environ["STATIC_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/nss/p/"
+    os.environ["CRAWL_CONCURRENCY"] = str(args.workers)
+    os.environ["CRAWL_HOST_INTERVAL"] = str(args.host_interval)
+    os.environ["CRAWL_CACHE_MODE"] = args.cache_mode
+    os.environ["CRAWL_CACHE_DIR"] = args.cache_dir
+    import static_crawler_v43_recursive as crawler
+
+    with tempfile.TemporaryDirectory() as tmp:
+        crawler.OUTPUT_FILENAME = os.path.join(tmp, "bench_static.json")
+        asyncio.run(crawler.main())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
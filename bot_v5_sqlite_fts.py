@@ -1,13 +1,22 @@
+import time
+_MODULE_STARTED = time.perf_counter()
 import os
 import re
+import ast
 import json
 import sqlite3
-import google.generativeai as genai
-from flask import Flask, request, abort
-from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
+import threading
+from collections import OrderedDict
+from types import SimpleNamespace
+from flask import Flask, request, abort, jsonify, g, has_request_context
 from datetime import datetime
+import query_trace
+from knowledge_model import load_records, attachment_list, record_id, knowledge_version
+from thesaurus import Thesaurus, MIN_CONFIDENCE as THESAURUS_MIN_CONFIDENCE, normalize_query
+from webhook_dedup import EventDeduplicator, event_identity
+from request_scheduler import RequestScheduler
+from request_profiler import RequestProfiler, PROFILE_LOAD_DATA
+from query_log import QueryLogWriter, record_from_trace
 
 # ==========================================
 # 🔑 核心設定
@@ -19,17 +28,125 @@ GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 LINE_CHANNEL_ACCESS_TOKEN = os.environ.get("LINE_CHANNEL_ACCESS_TOKEN")
 LINE_CHANNEL_SECRET = os.environ.get("LINE_CHANNEL_SECRET")
 
-# 設定 Gemini
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-
-# 設定 Line Bot
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
-handler = WebhookHandler(LINE_CHANNEL_SECRET)
-
 app = Flask(__name__)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# 啟動時間紀錄 (startup_report.py 讀取)：冷啟動時 SDK import 與 load_data 佔大部分時間
+STARTUP = {}
+# 按需剖析：抽樣 (PROFILE_SAMPLE_RATE) 或管理請求指定 (X-Profile + X-Admin-Token)
+profiler = RequestProfiler()
+
+# ==========================================
+# 💤 延遲載入重量級 SDK (第一次用到才 import)
+# ==========================================
+_sdk_lock = threading.Lock()
+_genai = None
+_line = None
+
+def get_genai():
+    """ 第一次呼叫 Gemini 時才 import google.generativeai 並設定金鑰 """
+    global _genai
+    if _genai is None:
+        with _sdk_lock:
+            if _genai is None:
+                started = time.perf_counter()
+                import google.generativeai as genai
+                if GEMINI_API_KEY:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                STARTUP["genai_import_sec"] = round(time.perf_counter() - started, 3)
+                _genai = genai
+    return _genai
+
+def get_line():
+    """ 第一次收到 webhook 時才 import LINE SDK、建立 API 與 handler 並註冊訊息處理 """
+    global _line
+    if _line is None:
+        with _sdk_lock:
+            if _line is None:
+                started = time.perf_counter()
+                from linebot import LineBotApi, WebhookHandler
+                from linebot.exceptions import InvalidSignatureError, LineBotApiError
+                from linebot.models import MessageEvent, TextMessage, TextSendMessage
+                handler = WebhookHandler(LINE_CHANNEL_SECRET)
+                handler.add(MessageEvent, message=TextMessage)(handle_message)
+                STARTUP["line_import_sec"] = round(time.perf_counter() - started, 3)
+                _line = {
+                    "api": LineBotApi(LINE_CHANNEL_ACCESS_TOKEN), "handler": handler,
+                    "LineBotApiError": LineBotApiError,
+                    "InvalidSignatureError": InvalidSignatureError, "TextSendMessage": TextSendMessage,
+                }
+    return _line
+
+# 回答流程：classic = 先請 AI 擴展關鍵字再回答 (兩次呼叫)；single = 先檢索、一次結構化呼叫
+BOT_PIPELINE = os.environ.get("BOT_PIPELINE", "classic")
+# 相同問題同時湧入時 (例如颱風假公告)，只計算一次並共用答案
+BOT_COALESCE = os.environ.get("BOT_COALESCE", "1") != "0"
+# LLM 關鍵字擴展結果的 LRU 快取筆數 (以正規化問題 + 資料版本為鍵)
+EXPANSION_CACHE_SIZE = int(os.environ.get("EXPANSION_CACHE_SIZE", "512"))
+# /explain 列出的候選資料列數
+EXPLAIN_CANDIDATES = 30
+# 問答紀錄 (背景批次寫入 JSONL)；QUERY_LOG=0 關閉
+QUERY_LOG_ENABLED = os.environ.get("QUERY_LOG", "1") != "0"
+# 熱門問題的預先生成答案 (precompute_answers.py 每日產生)
+PRECOMPUTED_FILE = 'nihs_precomputed_answers.json'
+# 答案表格式版本：2 起以不含「今天日期」的 prompt 生成，舊版 (含日期) 的答案表不採用
+PRECOMPUTED_VERSION = 2
+STUB_ANSWER = "（LLM 已模擬，未實際生成回答）"
+
+NOT_FOUND_REPLY = "抱歉，我在學校公告中找不到相關資訊。建議您直接聯繫學校處室詢問，或換個關鍵字試試看！"
+BUSY_REPLY = "校務小幫手目前線路忙碌，請稍後再試。"
+
+# 單次往返模式的結構化輸出格式
+PLAN_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "action": {"type": "STRING", "enum": ["answer", "search"]},
+        "answer": {"type": "STRING"},
+        "keywords": {"type": "ARRAY", "items": {"type": "STRING"}},
+    },
+    "required": ["action"],
+}
+PLAN_INSTRUCTIONS = """
+【輸出格式】：請只輸出 JSON。
+- 若【檢索資料庫內容】足以回答：{"action": "answer", "answer": "完整回答"}
+- 若資料不足或不相關：{"action": "search", "keywords": ["3-5 個精確的搜尋關鍵字"], "answer": ""}
+  關鍵字請聯想同義詞與處室 (例如 泡麵 -> 員生社、轉學 -> 註冊組)。
+"""
+
+def parse_keyword_list(text):
+    """ 安全解析 AI 回傳的關鍵字清單 (JSON 或 Python list 字面值)，不使用 eval """
+    text = text.strip().replace("```python", "").replace("```json", "").replace("```", "")
+    match = re.search(r"\[.*\]", text, re.S)
+    if not match:
+        return None
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            value = parse(match.group(0))
+        except (ValueError, SyntaxError):
+            continue
+        if isinstance(value, list):
+            return [str(v).strip() for v in value if str(v).strip()]
+    return None
+
+# 「本月行事曆」這類只要列出行事曆的問題，直接用模板回覆 (不呼叫 LLM)
+CALENDAR_TEMPLATE_PATTERN = re.compile(r'^(請問)?(本月|這個月|這個月份|\d{1,2}月)?(份)?的?行事曆[?？]?$')
+
+def split_query_terms(query):
+    """ 詞庫沒有命中時，把問題以標點切開當作關鍵字 """
+    parts = [p for p in re.split(r"[\s，。？！、,.?!]+", query) if len(p) >= 2]
+    return parts or [query]
+
+class _Flight:
+    """ 計算中的問題 (請求合併)：計算者完成後設定 done，其餘呼叫者共用 result """
+    __slots__ = ("key", "done", "result", "error", "waiters")
+
+    def __init__(self, key):
+        self.key = key
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 1
+
 # ==========================================
 # 🧠 高度類人化 AI 大腦 (Human-Like Brain)
 # ==========================================
@@ -39,9 +156,28 @@ class HumanLikeBrain:
         self.db_path = ':memory:'
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.cursor = self.conn.cursor()
+        # 排程器以多個 worker 執行緒共用同一條連線，查詢時以鎖保護共用 cursor
+        self.db_lock = threading.Lock()
         self.faq_data = {} 
+        self.pipeline = BOT_PIPELINE
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.stats_lock = threading.Lock()
+        self.coalesce = BOT_COALESCE
+        self.flights = {}           # 合併 key → 計算中的問題 (ask 與排程器共用)
+        self.flight_lock = threading.Lock()
+        self.expansion_cache = OrderedDict()
+        self.expansion_lock = threading.Lock()
+        self.query_log = QueryLogWriter() if QUERY_LOG_ENABLED else None
+        self.precomputed = {}
+        # 預先生成答案時關閉：prompt 不帶今天日期、要求寫絕對日期 (答案會重複使用多天)
+        self.dated_prompt = True
+        self.knowledge_version = ''
+        # 本地查詢擴展詞庫 (thesaurus.py 離線建置)，信心足夠時不必呼叫 LLM
+        self.thesaurus = Thesaurus.load(os.path.join(BASE_DIR, 'nihs_thesaurus.json'))
         self.init_db()
-        self.load_data()
+        with profiler.profile("load_data", enabled=PROFILE_LOAD_DATA or profiler.sampled()):
+            self.load_data()
 
     def init_db(self):
         """ 初始化資料庫結構 """
@@ -54,7 +190,8 @@ class HumanLikeBrain:
                 date TEXT,
                 unit TEXT,
                 url TEXT,
-                attachments TEXT
+                attachments TEXT,
+                parent_id INTEGER
             )
         ''')
         self.conn.commit()
@@ -62,8 +199,10 @@ class HumanLikeBrain:
     def load_data(self):
         """ 載入並索引所有校園資料 (支援 AI 增強欄位) """
         # 我們現在主要依賴 merge_data.py 產出的全知資料庫
-        files = ['nihs_knowledge_full.json', 'nihs_faq.json', 'nihs_calendar.json']
+        files = ['nihs_knowledge_full.json', 'nihs_attachment_text.json', 'nihs_faq.json', 'nihs_calendar.json']
+        self.knowledge_version = knowledge_version([os.path.join(BASE_DIR, f) for f in files])
         count = 0
+        parent_rows = {} # 公告 record_id -> 資料列 id，附件子資料列以 parent_id 連回公告
         try:
             for filename in files:
                 file_path = os.path.join(BASE_DIR, filename)
@@ -72,7 +211,8 @@ class HumanLikeBrain:
                     continue
                 
                 with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
+                    # 全知資料庫以精簡資料模型逐筆讀取，不先建出整份 dict 清單
+                    data = load_records(file_path) if filename == 'nihs_knowledge_full.json' else json.load(f)
                     
                     # 1. 處理 FAQ (標準答案)
                     if filename == 'nihs_faq.json':
@@ -109,15 +249,29 @@ class HumanLikeBrain:
                             date = item.get('date', '')
                             url = item.get('url', 'https://www.nihs.tp.edu.tw')
                             
-                            atts = item.get('attachments', [])
-                            att_str = "\n".join([f"{a.get('title')}: {a.get('url')}" for a in atts]) if atts else "無"
+                            # 附件可能是 list 或 JSON 字串 (靜態頁面)，統一轉成 list
+                            atts = attachment_list(item.get('attachments'))
+                            att_str = "\n".join([f"{a.get('name', a.get('title'))}: {a.get('url')}" for a in atts]) if atts else "無"
                             
                             self.cursor.execute("INSERT INTO knowledge (title, content, category, date, unit, url, attachments) VALUES (?, ?, ?, ?, ?, ?, ?)", 
                                               (title, content, category, date, unit, url, att_str))
+                            parent_rows[record_id(item)] = self.cursor.lastrowid
                             count += 1
+
+                    # 4. 處理附件全文 (extract_attachments.py)：每個段落一列，parent_id 指向所屬公告
+                    elif filename == 'nihs_attachment_text.json':
+                        files_by_sha = data.get('files', {})
+                        for child in data.get('children', []):
+                            segments = files_by_sha.get(child.get('sha256'), {}).get('segments', [])
+                            for seg in segments:
+                                self.cursor.execute("INSERT INTO knowledge (title, content, category, date, unit, url, attachments, parent_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                                  (f"{child.get('parent_title')}（附件：{child.get('name')}）", seg, "附件", child.get('date', ''),
+                                                   child.get('unit', ''), child.get('url'), "無", parent_rows.get(child.get('parent_id'))))
+                                count += 1
             
             self.conn.commit()
-            print(f"✅ 大腦載入完畢，共 {count} 筆記憶 (含 AI 增強標籤)。")
+            print(f"✅ 大腦載入完畢，共 {count} 筆記憶 (含 AI 增強標籤)，資料版本 {self.knowledge_version}。")
+            self.precomputed = self.load_precomputed(os.path.join(BASE_DIR, PRECOMPUTED_FILE))
         except Exception as e:
             print(f"❌ 載入失敗: {e}")
 
@@ -126,9 +280,24 @@ class HumanLikeBrain:
         """
         讓 AI 擔任「翻譯官」，把使用者的口語（如：那個補助）
         翻譯成資料庫懂的語言（如：['學費補助', '清寒', '申請']）。
+        先查本地詞庫 (微秒級)，涵蓋率夠高就直接用，只有信心不足時才呼叫 LLM。
         """
+        local_keywords, confidence = self.thesaurus.expand(user_query)
+        query_trace.note(thesaurus_confidence=confidence)
+        if confidence >= THESAURUS_MIN_CONFIDENCE:
+            query_trace.note(expansion_source="thesaurus")
+            return local_keywords
+
+        # 同一問題 (同一資料版本) 的 LLM 擴展結果直接沿用
+        cache_key = (normalize_query(user_query), self.knowledge_version)
+        with self.expansion_lock:
+            cached = self.expansion_cache.get(cache_key)
+            if cached is not None:
+                self.expansion_cache.move_to_end(cache_key)
+        if cached is not None:
+            query_trace.note(expansion_source="cache")
+            return list(cached)
         try:
-            model = genai.GenerativeModel(MODEL_NAME)
             prompt = f"""
             角色：你是一個精通校務資料庫的檢索專家。
             任務：將使用者的口語問題轉換為 3-5 個精確的「搜尋關鍵字」。
@@ -140,18 +309,47 @@ class HumanLikeBrain:
             
             使用者問題：『{user_query}』
             
-            請直接回傳 Python List 格式，例如：['詞1', '詞2', '詞3']
+            請直接回傳 JSON 陣列格式，例如：["詞1", "詞2", "詞3"]
             """
-            response = model.generate_content(prompt, generation_config={"temperature": 0.1})
-            text = response.text.strip().replace("```python", "").replace("```", "")
-            keywords = eval(text)
-            return keywords if isinstance(keywords, list) else [user_query]
-        except:
-            # 如果 AI 思考失敗，回退到原始問題
-            return [user_query]
+            response = self._generate(prompt, {"temperature": 0.1}, purpose="expansion")
+            keywords = parse_keyword_list(response.text)
+        except Exception:
+            keywords = None
+        if not keywords:
+            # 如果 AI 思考失敗，回退到本地詞庫的結果 (沒有命中時就是原始問題)
+            query_trace.note(expansion_source="thesaurus")
+            return local_keywords
+        trace = query_trace.current()
+        if not (trace and trace.stub_llm):
+            with self.expansion_lock:
+                self.expansion_cache[cache_key] = tuple(keywords)
+                if len(self.expansion_cache) > EXPANSION_CACHE_SIZE:
+                    self.expansion_cache.popitem(last=False)
+        query_trace.note(expansion_source="llm")
+        return keywords
 
-    def search_db(self, keywords, top_n=8):
-        """ 執行多維度模糊搜尋 """
+    def load_precomputed(self, path):
+        """ 讀取預先生成的答案表；資料版本與目前載入的不同就整份不用 (答案可能過時) """
+        if not os.path.exists(path): return {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                table = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 預先生成答案讀取失敗: {e}")
+            return {}
+        if table.get('version') != PRECOMPUTED_VERSION:
+            print(f"⚠️ 預先生成答案表版本 ({table.get('version')}) 不符，不採用。")
+            return {}
+        if table.get('knowledge_version') != self.knowledge_version:
+            print(f"⚠️ 預先生成答案的資料版本 ({table.get('knowledge_version')}) 與目前不同，不採用。")
+            return {}
+        answers = {k: v for k, v in table.get('answers', {}).items()
+                   if v.get('knowledge_version') == self.knowledge_version and v.get('answer')}
+        print(f"🌙 載入 {len(answers)} 題預先生成答案。")
+        return answers
+
+    def search_rows(self, keywords, top_n=8):
+        """ 執行多維度模糊搜尋，回傳 (date, unit, title, url, content, attachments, id) 資料列 """
         conditions = []
         params = []
         for k in keywords:
@@ -161,10 +359,36 @@ class HumanLikeBrain:
         
         where_clause = " OR ".join(conditions)
         # 優先回傳日期較新的資料
-        sql = f"SELECT date, unit, title, url, content, attachments FROM knowledge WHERE {where_clause} ORDER BY date DESC LIMIT {top_n}"
-        self.cursor.execute(sql, tuple(params))
-        rows = self.cursor.fetchall()
-        
+        sql = f"SELECT date, unit, title, url, content, attachments, id FROM knowledge WHERE {where_clause} ORDER BY date DESC LIMIT {top_n}"
+        with self.db_lock:
+            self.cursor.execute(sql, tuple(params))
+            return self.cursor.fetchall()
+
+    def score_candidates(self, keywords, top_n=8, limit=EXPLAIN_CANDIDATES):
+        """ /explain 用：列出候選資料列、排名 (與 search_rows 相同排序) 與關鍵字命中分數 """
+        where_clause = " OR ".join(["(title LIKE ? OR content LIKE ? OR category LIKE ?)"] * len(keywords))
+        params = [f'%{k}%' for k in keywords for _ in range(3)]
+        with self.db_lock:
+            self.cursor.execute(f"SELECT id, date, category, title, url, content FROM knowledge WHERE {where_clause} ORDER BY date DESC LIMIT {limit}", params)
+            rows = self.cursor.fetchall()
+        candidates = []
+        for rank, (rid, date, category, title, url, content) in enumerate(rows, 1):
+            # 標題命中 3 分、內文 1 分、類別 1 分
+            matched = [k for k in keywords if k in (title or '') or k in (content or '') or k in (category or '')]
+            score = sum(3 * (k in (title or '')) + (k in (content or '')) + (k in (category or '')) for k in keywords)
+            candidates.append({"rank": rank, "selected": rank <= top_n, "score": score, "matched": matched,
+                               "id": rid, "date": date, "category": category, "title": title, "url": url})
+        return candidates
+
+    def search_db(self, keywords, top_n=8):
+        """ 執行多維度模糊搜尋，整理成給 AI 閱讀的資料區塊 """
+        with query_trace.stage("retrieval"):
+            rows = self.search_rows(keywords, top_n)
+        trace = query_trace.current()
+        if trace is not None:
+            trace.info.setdefault("retrievals", []).append({"keywords": list(keywords), "rows": len(rows), "ids": [r[6] for r in rows]})
+            if trace.detail:
+                trace.info["retrievals"][-1]["candidates"] = self.score_candidates(keywords, top_n)
         res = ""
         for i, r in enumerate(rows):
             # r[4] 是內容，如果有 AI 摘要，這裡顯示會很漂亮
@@ -183,47 +407,192 @@ class HumanLikeBrain:
         query_date_slash = f"%/{target_month:02d}/%" # 匹配 2026/02/xx
         query_date_dash = f"%-{target_month:02d}-%"  # 匹配 2026-02-xx
         
-        self.cursor.execute("SELECT date, content FROM knowledge WHERE category='行事曆' AND (date LIKE ? OR date LIKE ?) ORDER BY date ASC", (query_date_slash, query_date_dash))
-        rows = self.cursor.fetchall()
-        
-        # 抓 PDF 原始連結
-        self.cursor.execute("SELECT url FROM knowledge WHERE title LIKE '%行事曆%' LIMIT 1")
-        url_row = self.cursor.fetchone()
+        with self.db_lock:
+            self.cursor.execute("SELECT date, content FROM knowledge WHERE category='行事曆' AND (date LIKE ? OR date LIKE ?) ORDER BY date ASC", (query_date_slash, query_date_dash))
+            rows = self.cursor.fetchall()
+
+            # 抓 PDF 原始連結
+            self.cursor.execute("SELECT url FROM knowledge WHERE title LIKE '%行事曆%' LIMIT 1")
+            url_row = self.cursor.fetchone()
         source_url = url_row[0] if url_row else "https://www.nihs.tp.edu.tw/nss/p/calendar"
         
         data_str = "\n".join([f"{r[0]} | {r[1]}" for r in rows])
         return data_str, target_month, source_url
 
     # 🔥 策略三：人設生成 (Human-Like Generation)
-    def ask(self, user_query):
-        # 1. 基礎規則直通車 (處理絕對標準答案，節省 Token)
+    def _generate(self, prompt, config, purpose="answer"):
+        """
+        所有 Gemini 呼叫的共同入口 (統計呼叫次數與耗時，供 bench_bot.py 比較)
+        LLM 耗時另記在 llm_ms (不另開階段)：擴展的呼叫已在 expansion 階段內，巢狀計時會重複計算
+        """
+        trace = query_trace.current()
+        call = None
+        if trace is not None:
+            call = {"purpose": purpose, "prompt_tokens": query_trace.estimate_tokens(prompt)}
+            trace.info.setdefault("llm", []).append(call)
+            if trace.stub_llm:
+                return self._stub_response(trace.query, config, purpose)
+        started = time.perf_counter()
+        try:
+            model = get_genai().GenerativeModel(MODEL_NAME)
+            return model.generate_content(prompt, generation_config=config)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.stats_lock:
+                self.llm_calls += 1
+                self.llm_seconds += elapsed
+            if call is not None:
+                call["ms"] = round(elapsed * 1000, 3)
+                trace.info["llm_ms"] = trace.info.get("llm_ms", 0.0) + elapsed * 1000
+
+    @staticmethod
+    def _stub_response(user_query, config, purpose):
+        """ /explain 預設不呼叫 Gemini：擴展用問題本身切詞，回答用固定文字 """
+        if purpose == "expansion":
+            text = json.dumps(split_query_terms(user_query), ensure_ascii=False)
+        elif config.get("response_mime_type") == "application/json":
+            text = json.dumps({"action": "answer", "answer": STUB_ANSWER}, ensure_ascii=False)
+        else:
+            text = STUB_ANSWER
+        return SimpleNamespace(text=text)
+
+    def faq_answer(self, user_query):
+        """ 基礎規則直通車 (處理絕對標準答案，節省 Token)；不符合時回傳 None """
         q = user_query.lower()
         if any(k in q for k in ['交通', '地址', '捷運', '公車', '怎麼去']):
              t = self.faq_data.get('traffic', {})
              return f"🏫 **內湖高工交通資訊**\n📍 地址：{t.get('address')}\n🚇 捷運：{t.get('mrt')}\n🚌 公車：{t.get('bus')}"
         if any(k in q for k in ['電話', '分機', '聯絡', '總機']):
              return "📞 **常用電話表**\n" + "\n".join([f"🔸 {c.get('title')}: {c.get('phone')}" for c in self.faq_data.get('contacts', [])])
+        return None
 
-        # 2. 啟動「意圖擴展」思考
-        keywords = self.generate_search_strategy(user_query)
-        
-        # 3. 執行檢索
-        retrieved_data = self.search_db(keywords)
+    def fast_answer(self, user_query):
+        """ 不需 LLM 的快速回覆 (交通、電話、行事曆模板、預先生成的答案)；排程器據此讓請求免排隊 """
+        fast = self.faq_answer(user_query)
+        if fast: return fast
+        if CALENDAR_TEMPLATE_PATTERN.match(user_query.strip()):
+            cal_bg, month, s_url = self.get_monthly_calendar(user_query)
+            if cal_bg:
+                return f"📅 **{month}月行事曆**\n{cal_bg}\n\n💡 完整行事曆：{s_url}"
+        if self.precomputed:
+            entry = self.precomputed.get(normalize_query(user_query))
+            # 參考了行事曆的答案只在生成當月有效 (月份一變，注入的行事曆就不同)
+            if entry and not (entry.get('calendar') and not entry.get('generated_at', '').startswith(datetime.now().strftime("%Y-%m"))):
+                query_trace.note(route="precomputed")
+                return entry['answer']
+        return None
+
+    def try_fast_path(self, user_query):
+        """ 排程器用：只走快速路徑 (命中時寫入問答紀錄)；需要 LLM 時回傳 None """
+        trace = query_trace.Trace(user_query)
+        with query_trace.activate(trace):
+            with trace.stage("fast_path"):
+                fast = self.fast_answer(user_query)
+        if fast:
+            trace.info.setdefault("route", "fast_path")
+            self.log_trace(trace)
+        return fast
+
+    def degraded_answer(self, user_query, top_n=3):
+        """ 系統忙碌時的降級回覆：只用本地檢索列出最相關的公告連結 """
+        trace = query_trace.Trace(user_query)
+        trace.note(route="degraded")
+        with query_trace.activate(trace):
+            keywords, _confidence = self.thesaurus.expand(user_query)
+            if keywords == [user_query]:
+                keywords = split_query_terms(user_query)
+            with trace.stage("retrieval"):
+                rows = self.search_rows(keywords, top_n)
+            trace.info["retrievals"] = [{"keywords": keywords, "rows": len(rows), "ids": [r[6] for r in rows]}]
+        self.log_trace(trace)
+        if not rows:
+            return BUSY_REPLY
+        links = "\n".join(f"🔸 {r[2]}\n{r[3]}" for r in rows)
+        return f"⏳ 目前詢問人數較多，先提供最相關的公告連結：\n{links}"
+
+    def coalesce_key(self, user_query):
+        """ 請求合併用：同一資料版本下，正規化後相同的問題只計算一次 """
+        if not self.coalesce: return None
+        return (normalize_query(user_query), self.knowledge_version)
+
+    def open_flight(self, user_query):
+        """
+        加入相同問題的計算：回傳 (flight, leader)。
+        leader 為 True 時由呼叫者計算並 finish_flight；否則等 flight.done 取用結果。
+        關閉合併或 /explain 模擬模式 (答案不是真的) 回傳 (None, True)
+        """
+        key = self.coalesce_key(user_query)
+        trace = query_trace.current()
+        if key is None or (trace is not None and trace.stub_llm):
+            return None, True
+        with self.flight_lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.waiters += 1
+                return flight, False
+            flight = self.flights[key] = _Flight(key)
+            return flight, True
+
+    def leave_flight(self, flight):
+        """ 等待者放棄 (逾時) """
+        with self.flight_lock:
+            flight.waiters -= 1
+
+    def abandon_flight(self, flight):
+        """ 還沒開始計算時呼叫：已沒有人在等就撤銷 (回傳 True)，之後的相同問題會重新計算 """
+        with self.flight_lock:
+            if flight.waiters > 0:
+                return False
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+        flight.done.set()
+        return True
 
-        # 4. 背景注入 (Context Injection) - 自動補全時序背景
-        source_url_ref = "https://www.nihs.tp.edu.tw"
+    def finish_flight(self, flight, result=None, error=None):
+        if flight is None: return
+        with self.flight_lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+        flight.result, flight.error = result, error
+        flight.done.set()
+
+    def log_coalesced(self, user_query, started):
+        """ 合併到其他請求的問題沒有自己的檢索與生成，只記錄等待時間 """
+        trace = query_trace.Trace(user_query)
+        trace.started = started
+        trace.note(route="coalesced")
+        self.log_trace(trace)
+
+    def log_trace(self, trace):
+        """ 問答紀錄 (只丟進佇列，不阻塞)；/explain 的調校請求不記錄 """
+        if self.query_log is not None and not trace.detail:
+            self.query_log.log(record_from_trace(trace, pipeline=self.pipeline, version=self.knowledge_version))
+
+    def add_calendar_context(self, user_query, retrieved_data):
+        """ 背景注入 (Context Injection) - 自動補全時序背景 """
         if any(k in user_query for k in ['行事曆', '何時', '幾號', '開學', '放假', '段考', '考試', '下週', '本週']):
-            cal_bg, month, s_url = self.get_monthly_calendar(user_query)
-            source_url_ref = s_url
+            with query_trace.stage("calendar"):
+                cal_bg, month, s_url = self.get_monthly_calendar(user_query)
+            # 該月沒有活動也要記下「查過」，預先生成的答案才會在新增活動時失效
+            query_trace.note(calendar_checked=True)
             if cal_bg:
                 retrieved_data = f"【參考背景：{month}月行事曆】:\n{cal_bg}\n\n" + retrieved_data
+                trace = query_trace.current()
+                if trace is not None:
+                    rows = cal_bg.split("\n")
+                    trace.note(calendar_month=month, calendar_rows=rows if trace.detail else len(rows))
+        return retrieved_data
 
-        if not retrieved_data:
-            return "抱歉，我在學校公告中找不到相關資訊。建議您直接聯繫學校處室詢問，或換個關鍵字試試看！"
-
-        # 5. 最終生成 (Persona Prompt)
+    def build_answer_prompt(self, user_query, retrieved_data):
         now = datetime.now()
-        prompt = f"""
+        if self.dated_prompt:
+            date_rule = f"請清楚列出，並提醒「今天是 {now.strftime('%Y/%m/%d')}」"
+            today = f"【當下時間】：{now.strftime('%Y/%m/%d')}\n"
+        else:
+            # 預先生成：同一份答案會在之後幾天重複回覆，不能出現「今天」或相對日期
+            date_rule = "請寫出完整日期 (年/月/日)，不要提到今天的日期，也不要用「今天、明天、本週、下週」等相對時間"
+            today = ""
+        return f"""
 SYSTEM: 你現在是內湖高工的「AI 校務秘書」。
 你的語氣：親切、專業、有禮貌，像是一位有經驗的老師。
 
@@ -237,53 +606,257 @@ SYSTEM: 你現在是內湖高工的「AI 校務秘書」。
    
 2. **精確性與時效**：
    - 資料中若有【標籤】或【摘要】，請優先參考。
-   - 若資料中有明確日期（如開學日、截止日），請清楚列出，並提醒「今天是 {now.strftime("%Y/%m/%d")}」。
+   - 若資料中有明確日期（如開學日、截止日），{date_rule}。
    - 若資料庫中真的找不到細節，請誠實說：「目前公告中未詳列細節」，並建議聯繫相關處室。
 
 3. **引用規範**：
    - 請在回答的最後，加上「💡 參考來源」並附上最相關的公告連結或附件。
 
-【當下時間】：{now.strftime("%Y/%m/%d")}
-【使用者問題】：{user_query}
+{today}【使用者問題】：{user_query}
 
 【檢索資料庫內容】：
 {retrieved_data}
 """
+
+    def ask(self, user_query, trace=None, flight=None, fast_path=True):
+        """
+        flight：排程器已代為 open_flight (本次呼叫是計算者)
+        fast_path=False：呼叫端已檢查過快速路徑 (排程器的 try_fast_path)，不再重跑
+        """
+        trace = trace or query_trace.Trace(user_query)
+        # /explain 由路由決定是否剖析；一般請求依抽樣比例
+        sampled = not trace.detail and profiler.sampled()
+        with profiler.profile("ask", enabled=sampled, query=user_query), query_trace.activate(trace):
+            answer = self._ask(user_query, trace, flight, fast_path)
+        self.log_trace(trace)
+        return answer
+
+    def _ask(self, user_query, trace, flight=None, fast_path=True):
+        # 1. 基礎規則直通車
+        if fast_path:
+            with trace.stage("fast_path"):
+                fast = self.fast_answer(user_query)
+            if fast:
+                trace.info.setdefault("route", "fast_path")
+                return fast
+
+        # 2. 請求合併：相同問題正在計算中就等它的結果 (排程器、/explain、預先生成與直接呼叫共用)
+        if flight is None:
+            flight, leader = self.open_flight(user_query)
+            if not leader:
+                with trace.stage("coalesced"):
+                    flight.done.wait()
+                trace.note(route="coalesced")
+                if flight.error is not None: raise flight.error
+                return flight.result
+
+        # 3. 檢索 + 生成
+        try:
+            answer = self.answer(user_query)
+        except Exception as e:
+            self.finish_flight(flight, error=e)
+            raise
+        self.finish_flight(flight, answer)
+        return answer
+
+    def explain(self, user_query, live_llm=False):
+        """ 完整走一次 ask 流程並回傳追蹤資料 (預設以模擬回應代替 Gemini) """
+        trace = query_trace.Trace(user_query, detail=True, stub_llm=not live_llm)
+        answer = self.ask(user_query, trace=trace)
+        result = trace.to_dict()
+        result.update(answer=answer, llm_mode="live" if live_llm else "stub",
+                      pipeline=self.pipeline, knowledge_version=self.knowledge_version)
+        return result
+
+    def answer(self, user_query):
+        """ 檢索 + 生成 (不含快速路徑與請求合併) """
+        query_trace.note(route=self.pipeline)
+        # 單次往返模式：先檢索再讓模型決定直接回答或補搜一次
+        if self.pipeline == 'single':
+            return self.ask_single(user_query)
+
+        # 3. 啟動「意圖擴展」思考
+        with query_trace.stage("expansion"):
+            keywords = self.generate_search_strategy(user_query)
+        
+        # 4. 執行檢索
+        retrieved_data = self.search_db(keywords)
+
+        # 5. 背景注入 (Context Injection) - 自動補全時序背景
+        retrieved_data = self.add_calendar_context(user_query, retrieved_data)
+
+        if not retrieved_data:
+            return NOT_FOUND_REPLY
+
+        # 6. 最終生成 (Persona Prompt)
+        with query_trace.stage("prompt"):
+            prompt = self.build_answer_prompt(user_query, retrieved_data)
         try:
-            model = genai.GenerativeModel(MODEL_NAME)
             # Temperature 設為 0.3，讓回答自然但不過度發散
-            response = model.generate_content(prompt, generation_config={"temperature": 0.3})
+            with query_trace.stage("generation"):
+                response = self._generate(prompt, {"temperature": 0.3})
             return response.text
         except Exception as e:
             print(f"Gemini Error: {e}")
-            return "校務小幫手目前線路忙碌，請稍後再試。"
+            return BUSY_REPLY
+
+    # 🔥 單次往返模式 (BOT_PIPELINE=single)
+    def ask_single(self, user_query):
+        """
+        1. 以本地詞庫 / 原始問題直接檢索 (不呼叫 LLM)
+        2. 一次結構化輸出呼叫 (JSON schema)：資料足夠就直接回答，
+           不夠就回傳更精確的關鍵字，最多再檢索一次後作答
+        """
+        with query_trace.stage("expansion"):
+            keywords, confidence = self.thesaurus.expand(user_query)
+            source = "thesaurus"
+            if keywords == [user_query]:
+                keywords, source = split_query_terms(user_query), "query"
+        query_trace.note(expansion_source=source, thesaurus_confidence=confidence)
+        retrieved_data = self.add_calendar_context(user_query, self.search_db(keywords))
+
+        with query_trace.stage("prompt"):
+            prompt = self.build_answer_prompt(user_query, retrieved_data or "（目前沒有檢索到資料）") + PLAN_INSTRUCTIONS
+        try:
+            with query_trace.stage("generation"):
+                response = self._generate(prompt, {
+                    "temperature": 0.3,
+                    "response_mime_type": "application/json",
+                    "response_schema": PLAN_SCHEMA,
+                }, purpose="plan")
+            plan = json.loads(response.text)
+        except Exception as e:
+            print(f"Gemini Error: {e}")
+            return BUSY_REPLY
+
+        query_trace.note(plan_action=plan.get("action"))
+        if plan.get("action") != "search" and plan.get("answer"):
+            return plan["answer"]
+
+        # 補搜一次 (有界：只會發生一次)，再以一般模式作答
+        refined = [k for k in plan.get("keywords") or [] if isinstance(k, str) and k.strip()][:5]
+        extra = self.search_db(refined) if refined else ""
+        combined = "\n".join(part for part in (retrieved_data, extra) if part)
+        if not combined:
+            return plan.get("answer") or NOT_FOUND_REPLY
+        try:
+            with query_trace.stage("generation"):
+                response = self._generate(self.build_answer_prompt(user_query, combined), {"temperature": 0.3})
+            return response.text
+        except Exception as e:
+            print(f"Gemini Error: {e}")
+            return plan.get("answer") or BUSY_REPLY
 
 # ==========================================
 # 🌐 Flask 路由與訊息處理
 # ==========================================
-brain = HumanLikeBrain()
+# 大腦在背景執行緒建立，import 本模組 (gunicorn 啟動 worker) 不必等 load_data 跑完；
+# 平台以 /ready 判斷何時開始導流，/ 只代表行程還活著
+brain = None
+scheduler = None
+_brain_ready = threading.Event()
+# 重送去重 (SQLite 檔，所有 gunicorn worker 共用)
+dedup = EventDeduplicator()
+BRAIN_WAIT_TIMEOUT = float(os.environ.get("BRAIN_WAIT_TIMEOUT", "20"))
+STARTING_REPLY = "校務小幫手正在啟動中，請稍後再問一次。"
 
-@app.route("/debug")
-def debug():
-    # Debug 頁面：測試 AI 的聯想能力
+def _build_brain():
+    global brain, scheduler
+    started = time.perf_counter()
+    try:
+        brain = HumanLikeBrain()
+        # 快速路徑免排隊、LLM 請求進優先佇列 (每位使用者有額度)、過載時回覆降級答案
+        scheduler = RequestScheduler(brain)
+    finally:
+        STARTUP["brain_load_sec"] = round(time.perf_counter() - started, 3)
+        STARTUP["ready_sec"] = round(time.perf_counter() - _MODULE_STARTED, 3)
+        _brain_ready.set()
+
+def get_brain(timeout=None):
+    """ 等待背景載入完成；逾時或載入失敗回傳 None """
+    _brain_ready.wait(timeout)
+    return brain
+
+threading.Thread(target=_build_brain, name="brain-loader", daemon=True).start()
+STARTUP["module_import_sec"] = round(time.perf_counter() - _MODULE_STARTED, 3)
+
+@app.route("/explain")
+def explain():
+    # 檢索調校用：完整走一次 ask 流程，回傳擴展來源、候選資料列分數與排名、行事曆注入、
+    # prompt token 數與各階段耗時；預設以模擬回應代替 Gemini (?llm=live 才實際呼叫)
+    live_llm = request.args.get('llm') == 'live'
+    # 實際呼叫 Gemini 會消耗 API 額度：必須帶正確的 X-Admin-Token (同剖析的管理請求)
+    if live_llm and not profiler.authorized(request.headers):
+        return jsonify(error="llm=live requires a valid X-Admin-Token"), 403
+    brain = get_brain(BRAIN_WAIT_TIMEOUT)
+    if brain is None: return jsonify(ready=False), 503
     test_q = request.args.get('q', '校長是誰')
-    keywords = brain.generate_search_strategy(test_q)
-    return f"<h1>🧠 AI Brain Debug</h1><p>測試問題：{test_q}</p><p>AI 聯想關鍵字：{keywords}</p><p>資料庫筆數：{brain.cursor.execute('SELECT COUNT(*) FROM knowledge').fetchone()[0]}</p>"
+    # 管理請求 (X-Profile: 1 + X-Admin-Token) 會同時存一份 cProfile / tracemalloc 剖析
+    with profiler.profile("explain", enabled=profiler.requested(request.headers), query=test_q) as session:
+        result = brain.explain(test_q, live_llm=live_llm)
+    if session is not None:
+        result["profile"] = {k: session[k] for k in ("wall_ms", "peak_kb", "top_functions") if k in session}
+    return jsonify(result)
 
 @app.route("/", methods=['GET'])
 def index(): 
     return "Neihu High School Bot (Hybrid Mode with Filter Active)", 200
 
+@app.route("/ready", methods=['GET'])
+def ready():
+    # 就緒探針：索引載入完成才回 200
+    if not _brain_ready.is_set() or brain is None:
+        return jsonify(ready=False, startup=STARTUP), 503
+    return jsonify(ready=True, knowledge_version=brain.knowledge_version, startup=STARTUP), 200
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    # Prometheus 文字格式
+    stats = dedup.stats()
+    tracked = stats.pop("tracked_events")
+    lines = [f"nihs_webhook_{name}_total {value}" for name, value in stats.items()]
+    lines.append(f"nihs_webhook_tracked_events {tracked}")
+    sched = scheduler.stats() if scheduler else {"queue_depth": 0, "in_flight": 0, "coalescing": 0}
+    for name in ("queue_depth", "in_flight", "coalescing"):
+        lines.append(f"nihs_scheduler_{name} {sched.pop(name)}")
+    lines += [f"nihs_scheduler_{name}_total {value}" for name, value in sched.items()]
+    lines += [f"nihs_profiler_{name}_total {value}" for name, value in profiler.counters.items()]
+    lines.append(f"nihs_ready {int(brain is not None)}")
+    lines += [f"nihs_startup_{name} {value}" for name, value in STARTUP.items()]
+    if brain is None:
+        return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4"}
+    if brain.query_log is not None:
+        lines += [f"nihs_query_log_{name}_total {value}" for name, value in brain.query_log.counters.items()]
+    lines.append(f"nihs_llm_calls_total {brain.llm_calls}")
+    lines.append(f"nihs_llm_seconds_total {brain.llm_seconds:.3f}")
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4"}
+
 @app.route("/callback", methods=['POST'])
 def callback():
     signature = request.headers.get('X-Line-Signature')
     body = request.get_data(as_text=True)
-    try: handler.handle(body, signature)
-    except InvalidSignatureError: abort(400)
+    line = get_line()
+    # 管理請求 (X-Profile: 1 + X-Admin-Token，例如重放一則已簽章的事件) 剖析整個 webhook 處理；
+    # cProfile 只看得到本執行緒，剖析時 LLM 流程改在本執行緒同步完成
+    with profiler.profile("callback", enabled=profiler.requested(request.headers)) as session:
+        g.profile_sync = session is not None
+        try: line["handler"].handle(body, signature)
+        except line["InvalidSignatureError"]: abort(400)
+    if session is not None:
+        return 'OK', 200, {"X-Profile-Wall-Ms": str(session["wall_ms"]), "X-Profile-Peak-Kb": str(session["peak_kb"])}
     return 'OK'
 
-@handler.add(MessageEvent, message=TextMessage)
+# 由 get_line() 註冊到 WebhookHandler (MessageEvent + TextMessage)
 def handle_message(event):
+    # ==========================================
+    # 🔁 第零關：重送去重
+    # ==========================================
+    # LINE 在 /callback 回應太慢時會重送同一事件，已處理過的直接略過 (仍回 200)
+    event_id, is_redelivery = event_identity(event)
+    if not dedup.claim(event_id, is_redelivery):
+        print(f"🔁 重複的 webhook 事件，略過: {event_id}")
+        return
+
     user_msg = event.message.text.strip()
 
     # ==========================================
@@ -306,8 +879,31 @@ def handle_message(event):
     # ==========================================
     # 🧠 第三關：進入 AI 大腦
     # ==========================================
-    reply = brain.ask(user_msg)
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+    line = get_line()
+    user_id = getattr(event.source, 'user_id', None)
+
+    def deliver(reply):
+        message = line["TextSendMessage"](text=reply)
+        try:
+            line["api"].reply_message(event.reply_token, message)
+        except line["LineBotApiError"] as e:
+            # 背景回覆時 reply token 可能已失效：改用 push 訊息送達
+            if not user_id: raise
+            print(f"⚠️ reply 失敗 ({e.status_code})，改用 push 訊息")
+            line["api"].push_message(user_id, message)
+
+    try:
+        if get_brain(BRAIN_WAIT_TIMEOUT) is None:
+            deliver(STARTING_REPLY)
+        elif has_request_context() and g.get("profile_sync"):
+            deliver(scheduler.submit(user_id or 'anonymous', user_msg))
+        else:
+            # 快速路徑當場回覆；需要 LLM 的問題在背景等結果後再回覆，webhook 不必等 LLM
+            scheduler.submit_async(user_id or 'anonymous', user_msg, deliver)
+    except Exception:
+        # 沒有成功交付：移除紀錄，讓 LINE 的重送可以再處理一次
+        dedup.release(event_id)
+        raise
 
 if __name__ == "__main__":
     app.run(port=10000)
@@ -0,0 +1,259 @@
+# ====================================================
+# 🧩 知識分段建置 (Chunk Builder) + 分段庫 (ChunkStore)
+# 取代來路不明的 nihs_chunks.pkl：
+# 1. 在 merge_data.py 之後執行，把每筆知識切成有重疊的分段
+# 2. 每個分段保留 來源 id、內文起訖位置、日期與網址
+# 3. 輸出為二進位檔 (偏移表 + 字串區塊)，以 mmap 開啟，毫秒級載入、不需反序列化
+# 4. 增量重建：內文沒變的資料直接沿用上一版的分段
+# ⚠️ bot 目前仍以 SQLite FTS 檢索整筆資料，尚未讀取分段庫；輸出檔只留在本機，不隨每日排程 commit
+# 用法：python build_chunks.py [--full] [--inspect 5]
+# ====================================================
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from knowledge_model import load_records, record_id
+
+SOURCE_FILE = "nihs_knowledge_full.json"
+OUTPUT_FILE = "nihs_chunks.bin"
+
+CHUNK_CHARS = int(os.environ.get("CHUNK_CHARS", "400"))
+CHUNK_OVERLAP = int(os.environ.get("CHUNK_OVERLAP", "80"))
+# 切點優先順序：段落 > 句尾 > 子句
+BREAK_CHARS = ["\n\n", "\n", "。", "！", "？", "；", "，", " "]
+
+# ==========================================
+# 📦 檔案格式 (小端序)
+# [標頭 48 bytes]
+#   magic "NIHSCHK1" | version u32 | 分段數 u32 | 來源數 u32 | 保留 u32
+#   meta_offset u64 | meta_length u64 | blob_offset u64
+# [偏移表] u64 x (分段數 + 1)：每個分段在字串區塊中的 byte 起點 (最後一個是結尾)
+# [分段表] u32 x 分段數 x 3：來源索引、內文起點、內文終點 (字元位置)
+# [來源表] JSON：[{id, title, url, date, content_hash}]
+# [字串區塊] 所有分段文字 (UTF-8) 依序串接
+# ==========================================
+MAGIC = b"NIHSCHK1"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIQQQ")
+
+
+def content_hash(text):
+    # 增量判斷必須比對原始內文 (偏移量以原始內文計算，不能忽略空白變動)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def split_with_overlap(text, size=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """
+    切成約 size 字的分段，相鄰分段重疊約 overlap 字。
+    切點盡量落在段落或句尾；回傳 [(start, end)] 字元位置。
+    """
+    n = len(text)
+    if n <= size:
+        return [(0, n)] if text.strip() else []
+    spans, start = [], 0
+    while start < n:
+        end = min(start + size, n)
+        if end < n:
+            # 在分段後半段找最後一個切點
+            floor = start + size // 2
+            for mark in BREAK_CHARS:
+                pos = text.rfind(mark, floor, end)
+                if pos != -1:
+                    end = pos + len(mark)
+                    break
+        spans.append((start, end))
+        if end >= n:
+            break
+        # 下一段往回退 overlap 字，並對齊到切點之後，避免從句子中間開始
+        next_start = max(end - overlap, start + 1)
+        for mark in BREAK_CHARS:
+            pos = text.find(mark, next_start, end)
+            if pos != -1 and pos + len(mark) < end:
+                next_start = pos + len(mark)
+                break
+        start = next_start
+    return spans
+
+
+class ChunkStore:
+    """
+    以 mmap 開啟的唯讀分段庫。
+    用法：
+        store = ChunkStore.open("nihs_chunks.bin")
+        for i in range(len(store)):
+            chunk = store[i]   # {"text", "record_id", "title", "url", "date", "start", "end"}
+    """
+
+    def __init__(self, buf, records, offsets, table, blob_offset, fh=None):
+        self._buf = buf
+        self._fh = fh
+        self.records = records
+        self.offsets = offsets
+        self.table = table
+        self.blob_offset = blob_offset
+
+    @classmethod
+    def open(cls, path=OUTPUT_FILE):
+        fh = open(path, "rb")
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_chunks, _n_records, _, meta_offset, meta_length, blob_offset = HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != VERSION:
+            buf.close(); fh.close()
+            raise ValueError(f"{path} 不是支援的分段庫格式 (magic={magic!r}, version={version})")
+
+        pos = HEADER.size
+        offsets = array("Q"); offsets.frombytes(buf[pos:pos + (n_chunks + 1) * 8])
+        pos += (n_chunks + 1) * 8
+        table = array("I"); table.frombytes(buf[pos:pos + n_chunks * 12])
+        if sys.byteorder == "big":
+            offsets.byteswap(); table.byteswap()
+        records = json.loads(buf[meta_offset:meta_offset + meta_length].decode("utf-8"))
+        return cls(buf, records, offsets, table, blob_offset, fh)
+
+    def close(self):
+        self._buf.close()
+        if self._fh: self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def text(self, i):
+        """ 只解碼單一分段的文字 """
+        a, b = self.offsets[i], self.offsets[i + 1]
+        return self._buf[self.blob_offset + a:self.blob_offset + b].decode("utf-8")
+
+    def __getitem__(self, i):
+        if not 0 <= i < len(self): raise IndexError(i)
+        rec = self.records[self.table[i * 3]]
+        return {
+            "text": self.text(i),
+            "record_id": rec["id"], "title": rec["title"], "url": rec["url"], "date": rec["date"],
+            "start": self.table[i * 3 + 1], "end": self.table[i * 3 + 2],
+        }
+
+    def chunks_of(self, rid):
+        """ 回傳某筆來源資料的所有分段索引 """
+        idx = next((k for k, r in enumerate(self.records) if r["id"] == rid), None)
+        if idx is None: return []
+        return [i for i in range(len(self)) if self.table[i * 3] == idx]
+
+
+def write_store(path, records, chunks):
+    """
+    records: [{id, title, url, date, content_hash}]
+    chunks: [(來源索引, start, end, text)]
+    先寫暫存檔再替換，讀取端永遠不會看到寫一半的檔案
+    """
+    blob = bytearray()
+    offsets = array("Q", [0])
+    table = array("I")
+    for rec_idx, start, end, text in chunks:
+        blob += text.encode("utf-8")
+        offsets.append(len(blob))
+        table.extend((rec_idx, start, end))
+    if sys.byteorder == "big":
+        offsets.byteswap(); table.byteswap()
+
+    meta = json.dumps(records, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    meta_offset = HEADER.size + len(offsets) * 8 + len(table) * 4
+    blob_offset = meta_offset + len(meta)
+    header = HEADER.pack(MAGIC, VERSION, len(chunks), len(records), 0, meta_offset, len(meta), blob_offset)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(offsets.tobytes())
+        f.write(table.tobytes())
+        f.write(meta)
+        f.write(blob)
+    os.replace(tmp, path)
+    return blob_offset + len(blob)
+
+
+def load_previous(path):
+    """ 讀取上一版分段庫，回傳 {(id, content_hash): [(start, end, text)]} """
+    if not os.path.exists(path): return {}
+    try:
+        with ChunkStore.open(path) as store:
+            previous = {}
+            for i in range(len(store)):
+                rec = store.records[store.table[i * 3]]
+                previous.setdefault((rec["id"], rec["content_hash"]), []).append(
+                    (store.table[i * 3 + 1], store.table[i * 3 + 2], store.text(i)))
+            return previous
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 無法讀取舊分段庫 ({e})，改為全量重建。")
+        return {}
+
+
+def build_chunks(source=SOURCE_FILE, output=OUTPUT_FILE, full=False):
+    start_time = time.time()
+    data = load_records(source)
+    previous = {} if full else load_previous(output)
+
+    records, chunks, seen = [], [], set()
+    reused = rebuilt = 0
+    for item in data:
+        content = str(item.get("content") or "")
+        rid = record_id(item)
+        if rid in seen or not content.strip():
+            continue
+        seen.add(rid)
+        chash = content_hash(content)
+        rec_idx = len(records)
+        records.append({
+            "id": rid, "title": item.get("title", ""), "url": item.get("url", ""),
+            "date": item.get("date", ""), "content_hash": chash,
+        })
+
+        cached = previous.get((rid, chash))
+        if cached is not None:
+            reused += 1
+            chunks.extend((rec_idx, s, e, text) for s, e, text in cached)
+        else:
+            rebuilt += 1
+            chunks.extend((rec_idx, s, e, content[s:e]) for s, e in split_with_overlap(content))
+
+    size = write_store(output, records, chunks)
+    print(f"🧩 分段完成：{len(records)} 筆資料 → {len(chunks)} 段 ({size / 1024:.0f} KB)")
+    print(f"   ♻️ 沿用 {reused} 筆 | 🔨 重新切分 {rebuilt} 筆 | 耗時 {time.time() - start_time:.2f} 秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="將全知資料庫切成分段並寫入 mmap 分段庫")
+    parser.add_argument("--source", default=SOURCE_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--full", action="store_true", help="忽略上一版，全量重建")
+    parser.add_argument("--inspect", type=int, default=0, help="只載入並顯示前 N 段 (量測載入時間)")
+    args = parser.parse_args()
+
+    if args.inspect:
+        t0 = time.perf_counter()
+        with ChunkStore.open(args.output) as store:
+            load_ms = (time.perf_counter() - t0) * 1000
+            print(f"📂 {args.output}: {len(store)} 段 / {len(store.records)} 筆資料，載入 {load_ms:.2f} ms")
+            for i in range(min(args.inspect, len(store))):
+                c = store[i]
+                print(f"   [{i}] {c['record_id']} {c['date']} {c['title'][:20]} ({c['start']}-{c['end']}): {c['text'][:40]!r}")
+        return
+
+    if not os.path.exists(args.source):
+        print(f"⚠️ 找不到 {args.source}，略過分段。")
+        return
+    build_chunks(args.source, args.output, full=args.full)
+
+
+if __name__ == "__main__":
+    main()
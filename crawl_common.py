@@ -0,0 +1,154 @@
+# ====================================================
+# 🧰 爬蟲共用工具 (Crawl Common)
+# 給 ultimate_bot_builder_v40_printHere.py 與 static_crawler_v43_recursive.py 共用：
+# 1. HostRateLimiter：全域併發上限 + 每個主機的最小請求間隔 (禮貌爬取)
+# 2. CrawlStats：統計總耗時、請求數與每秒請求數
+# 3. is_attachment_link / absolute_url：附件判斷規則 (Playwright 與 HTTP 模式共用)
+# 4. canonicalize_url：網址正規化 (去重用)
+# 5. content_fingerprint：頁面內容指紋 (判斷頁面是否真的有變動)
+# ====================================================
+import asyncio
+import hashlib
+import re
+import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+SITE_ROOT = "https://www.nihs.tp.edu.tw"
+ATTACHMENT_EXTS = ['.pdf', '.doc', '.xls', '.ppt', '.zip', '.jpg', '.png']
+
+
+def absolute_url(href):
+    """ 站內相對路徑補上網域 """
+    if href.startswith("/"): return SITE_ROOT + href
+    return href
+
+
+def is_attachment_link(href, text):
+    """ 判斷連結是否為附件檔案 (feeder 下載點或常見副檔名，排除 mailto 與無文字連結) """
+    if not href or not text: return False
+    href_lower = href.lower()
+    if "mailto:" in href_lower: return False
+    # 特徵 A: 包含 feeder；特徵 B: 副檔名
+    return "feeder" in href_lower or any(ext in href_lower for ext in ATTACHMENT_EXTS)
+
+
+def canonicalize_url(url):
+    """
+    網址正規化，讓同一頁面的不同寫法得到相同的比對鍵：
+    scheme/host 轉小寫、去除預設埠號、去除片段 (#...)、查詢參數排序、去除結尾斜線
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parts.path or "/"
+    if len(path) > 1: path = path.rstrip("/") or "/"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+def content_fingerprint(item):
+    """ 以正規化後的內文 (壓縮空白) 加上附件網址計算指紋，排版或空白變動不算變更 """
+    text = re.sub(r"\s+", " ", str(item.get("content", ""))).strip()
+    atts = sorted(a.get("url", "") for a in item.get("attachments", []) or [])
+    raw = text + "\n" + "\n".join(atts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class HostRateLimiter:
+    """
+    全域併發上限 + 每個主機 (host) 的最小請求間隔。
+    用法：
+        async with limiter.slot(url):
+            await page.goto(url)
+    """
+
+    def __init__(self, max_concurrency=4, min_interval=0.3):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.min_interval = min_interval
+        self._host_locks = {}
+        self._host_last = {}
+
+    def _host(self, url):
+        return urlsplit(url).netloc.lower() or "_"
+
+    async def wait_turn(self, url):
+        """ 依主機排隊，確保同一主機兩次請求之間至少間隔 min_interval 秒 """
+        host = self._host(url)
+        lock = self._host_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            wait = self._host_last.get(host, 0) + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._host_last[host] = time.monotonic()
+
+    def slot(self, url):
+        return _LimiterSlot(self, url)
+
+
+class _LimiterSlot:
+    def __init__(self, limiter, url):
+        self.limiter = limiter
+        self.url = url
+
+    async def __aenter__(self):
+        await self.limiter.semaphore.acquire()
+        try:
+            await self.limiter.wait_turn(self.url)
+        except BaseException:
+            self.limiter.semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc):
+        self.limiter.semaphore.release()
+        return False
+
+
+class CrawlStats:
+    """ 統計爬取耗時與請求數 (透過 page.on('request') 計數) """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.items = 0
+        self.skipped = 0
+        self.blocked = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.page_times = []
+
+    def record_page(self, url, seconds):
+        self.page_times.append((seconds, url))
+
+    def attach(self, page):
+        page.on("request", self._on_request)
+
+    def _on_request(self, _request):
+        self.requests += 1
+
+    def report(self, label="爬取"):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rps = self.requests / elapsed
+        print(f"⏱️ {label}總耗時: {elapsed:.1f} 秒 | 請求數: {self.requests} | 每秒請求: {rps:.2f} req/s | 資料: {self.items} 筆")
+        result = {"elapsed_sec": round(elapsed, 3), "requests": self.requests, "rps": round(rps, 3), "items": self.items}
+        if self.blocked or self.cache_hits or self.cache_misses:
+            result.update({"blocked": self.blocked, "cache_hits": self.cache_hits, "cache_misses": self.cache_misses})
+            print(f"   🛡️ 攔截非必要資源: {self.blocked} | 快取命中 (含 304): {self.cache_hits} | 實際下載: {self.cache_misses}")
+        if self.page_times:
+            times = sorted(t for t, _ in self.page_times)
+            n = len(times)
+            result.update({
+                "pages": n,
+                "pages_per_sec": round(n / elapsed, 3),
+                "page_avg_sec": round(sum(times) / n, 3),
+                "page_p50_sec": round(times[n // 2], 3),
+                "page_p95_sec": round(times[min(n - 1, int(n * 0.95))], 3),
+                "page_max_sec": round(times[-1], 3),
+            })
+            print(f"   📄 頁面: {n} 頁 ({result['pages_per_sec']:.2f} 頁/秒) | 平均 {result['page_avg_sec']:.2f}s | p50 {result['page_p50_sec']:.2f}s | p95 {result['page_p95_sec']:.2f}s | 最慢 {result['page_max_sec']:.2f}s")
+            for t, url in sorted(self.page_times, reverse=True)[:5]:
+                print(f"      🐢 {t:.2f}s {url}")
+        return result
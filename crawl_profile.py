@@ -0,0 +1,139 @@
+# ====================================================
+# 🛡️ 爬蟲共用瀏覽器設定檔 (Crawl Profile)
+# 給兩支 Playwright 爬蟲共用：
+# 1. 以 context.route 攔截請求，擋掉圖片、字型、影音與分析追蹤腳本
+# 2. 磁碟回應快取 (以網址為鍵)，用 ETag / Last-Modified 重新驗證，沒變的頁面不重新下載
+# 3. 離線重播模式：完全只用快取回應，供爬蟲測試與效能量測取得可重現的結果
+# 模式由 CRAWL_CACHE_MODE 控制：off / revalidate (預設) / offline
+# ====================================================
+import hashlib
+import json
+import os
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from crawl_common import canonicalize_url
+
+CACHE_DIR = os.environ.get("CRAWL_CACHE_DIR", ".crawl_cache")
+CACHE_MODE = os.environ.get("CRAWL_CACHE_MODE", "revalidate")
+
+# 非必要資源：直接中止。樣式表保留 (互動視窗與 :visible 判斷仰賴 CSS)，但會進快取
+BLOCKED_RESOURCE_TYPES = {"image", "media", "font", "beacon"}
+BLOCKED_HOST_KEYWORDS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "facebook.net", "connect.facebook", "hotjar", "clarity.ms",
+]
+CACHEABLE_RESOURCE_TYPES = {"document", "stylesheet", "script", "xhr", "fetch"}
+
+# 快取鍵忽略的防快取參數 (例如 jQuery 的 ?_=時間戳)
+CACHE_BUSTER_PARAMS = {"_", "t", "ts", "timestamp"}
+
+# 重播快取回應時不能沿用的標頭 (內容已被解壓縮、長度可能改變)
+DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+def cache_key(method, url, post_data=None):
+    """ 以 方法 + 正規化網址 (+ POST 內容) 產生快取鍵 """
+    parts = urlsplit(canonicalize_url(url))
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in CACHE_BUSTER_PARAMS])
+    url = urlunsplit((parts.scheme, parts.netloc, parts.path, query, ""))
+    raw = f"{method.upper()} {url}\n{post_data or ''}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """ 磁碟回應快取：<dir>/<鍵前兩碼>/<鍵>.json (狀態與標頭) + .bin (內容) """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _paths(self, key):
+        folder = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(folder, f"{key}.json"), os.path.join(folder, f"{key}.bin")
+
+    def get(self, key):
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                return meta, f.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def put(self, key, url, status, headers, body):
+        meta_path, body_path = self._paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        headers = {k.lower(): v for k, v in headers.items() if k.lower() not in DROP_HEADERS}
+        meta = {"url": url, "status": status, "headers": headers}
+        # 先寫內容再寫 meta，確保 meta 存在時內容一定完整
+        tmp = body_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, body_path)
+        with open(meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        return meta
+
+
+def _is_blocked(request):
+    if request.resource_type in BLOCKED_RESOURCE_TYPES: return True
+    host = urlsplit(request.url).netloc.lower()
+    return any(k in host for k in BLOCKED_HOST_KEYWORDS)
+
+
+async def apply_crawl_profile(context, stats=None, mode=CACHE_MODE, cache=None):
+    """
+    為 browser context 掛上攔截規則與快取。
+    stats: CrawlStats，會累計 blocked / cache_hits / cache_misses
+    """
+    cache = cache or ResponseCache()
+
+    def count(field):
+        if stats is not None: setattr(stats, field, getattr(stats, field) + 1)
+
+    async def handle(route):
+        request = route.request
+        if _is_blocked(request):
+            count("blocked")
+            return await route.abort()
+
+        if mode == "off" or request.resource_type not in CACHEABLE_RESOURCE_TYPES or request.method not in ("GET", "POST"):
+            return await route.continue_()
+
+        key = cache_key(request.method, request.url, request.post_data)
+        meta, body = cache.get(key)
+
+        # 離線重播：只用快取，沒有就當作斷線
+        if mode == "offline":
+            if meta is None:
+                count("cache_misses")
+                return await route.abort("internetdisconnected")
+            count("cache_hits")
+            return await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+
+        # 重新驗證：帶上 ETag / Last-Modified，伺服器回 304 就用快取內容
+        headers = dict(request.headers)
+        if meta is not None and request.method == "GET":
+            if meta["headers"].get("etag"): headers["if-none-match"] = meta["headers"]["etag"]
+            if meta["headers"].get("last-modified"): headers["if-modified-since"] = meta["headers"]["last-modified"]
+        try:
+            response = await route.fetch(headers=headers)
+        except Exception:
+            # 網路錯誤時若有快取就先用快取
+            if meta is not None:
+                count("cache_hits")
+                return await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+            return await route.abort()
+
+        if response.status == 304 and meta is not None:
+            count("cache_hits")
+            return await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+
+        count("cache_misses")
+        body = await response.body()
+        if response.status == 200:
+            meta = cache.put(key, request.url, response.status, response.headers, body)
+            return await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+        return await route.fulfill(response=response, body=body)
+
+    await context.route("**/*", handle)
+    return cache
@@ -0,0 +1,250 @@
+# ====================================================
+# 🪞 近似重複偵測 (MinHash / LSH Near-Duplicate Detection)
+# 同一則公告常同時出現在靜態頁面、多個公告頁籤 (例如「重要訊息」與處室頁籤) 與行事曆，
+# 每份複本都會變成 knowledge 表的一列，浪費索引空間與 prompt token。
+# 1. 以字元 shingle 計算 MinHash 簽章 (單次雜湊分箱，純 Python、不需 numpy)
+# 2. LSH 分帶找出候選配對，再以簽章估計 Jaccard 相似度確認
+# 3. Union-Find 分群，每群保留一筆代表資料，合併附件與分類，其餘記錄在 duplicates
+# 由 merge_data.py 呼叫；單獨執行 python dedup.py --bench 可量測語料放大時的耗時
+# ====================================================
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+from datetime import datetime
+from knowledge_model import attachment_list, is_record, load_records
+
+SHINGLE_SIZE = 5
+NUM_BINS = 64                      # 簽章長度
+BANDS, ROWS = 16, 4                # LSH：16 帶 x 4 列 (候選門檻約 0.5)
+SIM_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.85"))
+MIN_CHARS = 30                     # 太短的文字 (行事曆單行活動) 不參與比對
+DATE_WINDOW_DAYS = 31              # 兩則公告日期相差超過此天數視為不同期的例行公告
+STATIC_CATEGORY = "校園靜態資訊"     # 靜態頁面的日期是爬取日，不套用日期限制
+
+_BIN_SHIFT = 64 - (NUM_BINS.bit_length() - 1)
+_VALUE_MASK = (1 << _BIN_SHIFT) - 1
+
+
+def _normalize(text):
+    return "".join(str(text).split())
+
+
+def record_text(item):
+    """ 比對用文字：標題 + 內文 (行事曆資料用 event) """
+    body = item.get("content") or item.get("event") or ""
+    return _normalize(item.get("title", "")) + _normalize(body)
+
+
+def shingles(text, k=SHINGLE_SIZE):
+    if len(text) <= k: return {text}
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def minhash(shingle_set):
+    """
+    單次雜湊分箱 MinHash (one-permutation hashing + 旋轉補值)：
+    每個 shingle 只算一次 64-bit 雜湊，最高位元決定分箱、其餘位元取最小值。
+    比傳統 k 次雜湊快約 k 倍，估計的 Jaccard 品質相近。
+    """
+    sig = [None] * NUM_BINS
+    for s in shingle_set:
+        h = int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big")
+        b, v = h >> _BIN_SHIFT, h & _VALUE_MASK
+        if sig[b] is None or v < sig[b]:
+            sig[b] = v
+    # 空箱向右借用最近的非空箱 (加上距離偏移，避免不同箱誤判相等)
+    filled = [i for i, v in enumerate(sig) if v is not None]
+    if not filled: return tuple([0] * NUM_BINS)
+    for i in range(NUM_BINS):
+        if sig[i] is None:
+            j = next((f for f in filled if f > i), filled[0] + NUM_BINS)
+            sig[i] = sig[j % NUM_BINS] + (j - i) * (_VALUE_MASK + 1)
+    return tuple(sig)
+
+
+def similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_BINS
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(str(value)[:10], "%Y/%m/%d")
+    except ValueError:
+        return None
+
+
+def _dates_compatible(a, b):
+    if STATIC_CATEGORY in (a.get("category"), b.get("category")): return True
+    da, db = _parse_date(a.get("date")), _parse_date(b.get("date"))
+    if da is None or db is None: return True
+    return abs((da - db).days) <= DATE_WINDOW_DAYS
+
+
+def find_clusters(items):
+    """ 回傳 [[索引, ...]]，每群至少兩筆 """
+    sigs = {}
+    for i, item in enumerate(items):
+        if not is_record(item): continue
+        text = record_text(item)
+        if len(text) >= MIN_CHARS:
+            sigs[i] = minhash(shingles(text))
+
+    buckets = {}
+    for i, sig in sigs.items():
+        for band in range(BANDS):
+            key = (band, sig[band * ROWS:(band + 1) * ROWS])
+            buckets.setdefault(key, []).append(i)
+
+    parent = {i: i for i in sigs}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    checked = set()
+    for members in buckets.values():
+        if len(members) < 2: continue
+        for ai in range(len(members)):
+            for bi in range(ai + 1, len(members)):
+                a, b = members[ai], members[bi]
+                if (a, b) in checked: continue
+                checked.add((a, b))
+                if find(a) == find(b): continue
+                if similarity(sigs[a], sigs[b]) >= SIM_THRESHOLD and _dates_compatible(items[a], items[b]):
+                    parent[find(a)] = find(b)
+
+    groups = {}
+    for i in sigs:
+        groups.setdefault(find(i), []).append(i)
+    return [sorted(g) for g in groups.values() if len(g) > 1]
+
+
+# ==========================================
+# 🔗 合併同一群的資料
+# ==========================================
+def _set_attachments(item, atts):
+    item["attachments"] = json.dumps(atts, ensure_ascii=False) if isinstance(item.get("attachments"), str) else atts
+
+
+def item_key(item):
+    """ 與 merge_data.py 相同的主鍵 """
+    return item.get("url", item.get("title"))
+
+
+def _canonical_rank(item):
+    # 已是代表資料者優先 (結果穩定)，其次保留有 AI 標籤、內文較長、日期較新者
+    body = item.get("content") or item.get("event") or ""
+    return (bool(item.get("duplicates")), bool(item.get("tags")), len(str(body)), str(item.get("date", "")))
+
+
+def _duplicate_entry(item):
+    return {
+        "key": item_key(item), "title": item.get("title", ""), "unit": item.get("unit", ""),
+        "category": item.get("category", ""), "date": item.get("date", ""),
+        "attachments": attachment_list(item.get("attachments")),
+    }
+
+
+def absorb(canonical, duplicates):
+    """ 將重複資料的附件與分類併入代表資料；duplicates 以 key 去重，重複呼叫結果不變 """
+    entries = {d["key"]: d for d in canonical.get("duplicates", [])}
+    for d in duplicates:
+        if d["key"] != item_key(canonical): entries[d["key"]] = d
+    if not entries: return canonical
+    canonical["duplicates"] = sorted(entries.values(), key=lambda d: str(d["key"]))
+
+    atts, seen = [], set()
+    for a in attachment_list(canonical.get("attachments")) + [a for d in canonical["duplicates"] for a in d["attachments"]]:
+        if a.get("url") not in seen:
+            atts.append(a)
+            seen.add(a.get("url"))
+    _set_attachments(canonical, atts)
+
+    cats = {canonical.get("category", "")} | {d["category"] for d in canonical["duplicates"]}
+    canonical["categories"] = sorted(c for c in cats if c)
+    return canonical
+
+
+def carry_over(new_item, existing_item):
+    """ 新版資料覆蓋舊的代表資料時，沿用舊的 duplicates (附件與分類重新合併) """
+    if existing_item.get("duplicates"):
+        new_item["duplicates"] = []
+        absorb(new_item, existing_item["duplicates"])
+    return new_item
+
+
+def deduplicate(items):
+    """ 回傳 (去重後清單, 統計)；清單順序維持原本順序 """
+    start = time.perf_counter()
+    clusters = find_clusters(items)
+    dropped = set()
+    for group in clusters:
+        members = [items[i] for i in group]
+        canonical = max(members, key=_canonical_rank)
+        others = [m for m in members if m is not canonical]
+        absorb(canonical, [_duplicate_entry(m) for m in others])
+        for m in others:
+            # 被併入的資料若本身也是代表資料，它的 duplicates 一併轉移
+            if m.get("duplicates"): absorb(canonical, m["duplicates"])
+        dropped.update(i for i in group if items[i] is not canonical)
+
+    result = [item for i, item in enumerate(items) if i not in dropped]
+    stats = {
+        "input": len(items), "output": len(result), "clusters": len(clusters), "removed": len(dropped),
+        "ratio": round(len(dropped) / len(items), 4) if items else 0.0,
+        "elapsed_sec": round(time.perf_counter() - start, 3),
+    }
+    return result, stats
+
+
+# ==========================================
+# 📈 語料放大量測
+# ==========================================
+def synthetic_corpus(items, factor, seed=42):
+    """ 複製語料 factor 倍，每份複本隨機改動少量字元並換網址，模擬跨頁籤的近似重複 """
+    rng = random.Random(seed)
+    out = list(items)
+    for n in range(1, factor):
+        for item in items:
+            copy = dict(item)
+            body = str(copy.get("content") or "")
+            if body and rng.random() < 0.5:
+                pos = rng.randrange(len(body))
+                body = body[:pos] + "。" + body[pos + 1:]
+            else:
+                # 另一半改成不同內容 (不應被視為重複)
+                body = body[::-1] + str(n)
+            copy["content"] = body
+            copy["url"] = f"{copy.get('url', '')}#copy{n}"
+            out.append(copy)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="近似重複偵測")
+    parser.add_argument("files", nargs="*", default=["nihs_knowledge_full.json"])
+    parser.add_argument("--bench", action="store_true", help="以 1/2/4/8 倍合成語料量測耗時")
+    args = parser.parse_args()
+
+    items = []
+    for path in args.files:
+        items.extend(load_records(path))
+    if not items:
+        print("⚠️ 沒有可比對的資料。")
+        return
+
+    factors = [1, 2, 4, 8] if args.bench else [1]
+    for factor in factors:
+        corpus = synthetic_corpus(items, factor) if factor > 1 else items
+        _, stats = deduplicate([dict(i) for i in corpus])
+        print(f"🪞 {stats['input']:>6} 筆 → {stats['output']:>6} 筆 | 群組 {stats['clusters']:>5} | "
+              f"去重率 {stats['ratio']:.1%} | 耗時 {stats['elapsed_sec']:.2f} 秒")
+
+
+if __name__ == "__main__":
+    main()
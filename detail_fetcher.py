@@ -0,0 +1,183 @@
+# ====================================================
+# 🌐 公告內文直連抓取器 (Direct HTTP Detail Fetcher)
+# 目標：
+# 1. 不點擊視窗，直接用公告的 Permalink 以 HTTP 取回頁面
+#    Permalink 由公告列上的屬性 (href / onclick / data-*) 推導：完整網址直接用，
+#    只有公告 id 時套用主資料庫中同頁籤公告的網址前綴
+# 2. 以 BeautifulSoup 解析 #printHere / .htmldisplay，規則與 extract_details 一致
+# 3. 使用連線池化的 aiohttp，同時抓取多篇；傳入 HostRateLimiter 時每個請求都遵守主機間隔
+# 單獨執行：python detail_fetcher.py <url> [<url> ...]
+# ====================================================
+import asyncio
+import json
+import re
+import sys
+from collections import Counter
+import aiohttp
+from bs4 import BeautifulSoup
+from crawl_common import is_attachment_link, absolute_url
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+FETCH_CONCURRENCY = 8
+FETCH_TIMEOUT = 15
+
+# 公告 Permalink：/nss/main/freeze/<網站 id>/<模組 id>/<公告 id>?vector=private&static=false
+PERMALINK_PATTERN = re.compile(r"(/nss/main/freeze/[0-9a-f]{24}/[\w-]+/)([0-9a-f]{24})")
+ANNOUNCEMENT_ID = re.compile(r"(?<![0-9a-zA-Z])[0-9a-f]{24}(?![0-9a-zA-Z])")
+PERMALINK_QUERY = "?vector=private&static=false"
+
+
+def _text(el):
+    """ 近似 inner_text：以換行分隔區塊並去除空白行 """
+    lines = [line.strip() for line in el.get_text("\n").split("\n")]
+    return "\n".join(line for line in lines if line)
+
+
+def parse_detail_html(html, page_url=""):
+    """
+    解析公告頁 HTML，回傳與 extract_details 相同結構：
+    {"body": str, "attachments": [{"name", "url"}], "real_url": str}
+    """
+    data = {"body": "", "attachments": [], "real_url": page_url or "無法取得"}
+    soup = BeautifulSoup(html, "html.parser")
+
+    # 1. Permalink (mailto 分享連結內含真實網址)
+    mailto = soup.select_one("a[href^='mailto:']")
+    if mailto:
+        match = re.search(r'(https?://[^\s&]+)', mailto.get("href", ""))
+        if match: data["real_url"] = match.group(1).replace("&amp;", "&")
+
+    # 2. 內文：優先 #printHere .htmldisplay，其次 #printHere，最後通用選擇器
+    print_here = soup.select_one("#printHere")
+    if print_here:
+        html_display = print_here.select(".htmldisplay")
+        if html_display:
+            data["body"] = "\n".join(_text(el) for el in html_display)
+        else:
+            data["body"] = _text(print_here)
+    else:
+        fallback = soup.select_one(".modal-body, .module-detail")
+        if fallback: data["body"] = _text(fallback)
+
+    # 3. 附件：掃描 #printHere 與 modal 區塊
+    candidates = [el for el in (print_here, soup.select_one(".modal-content, div[role='dialog']")) if el]
+    seen_urls = set()
+    for container in candidates:
+        for link in container.select("a"):
+            href = link.get("href")
+            text = link.get_text().strip()
+            if is_attachment_link(href, text):
+                href = absolute_url(href)
+                if href not in seen_urls:
+                    data["attachments"].append({"name": text, "url": href})
+                    seen_urls.add(href)
+
+    return data
+
+
+def permalink_prefixes(records):
+    """ 從主資料庫的公告網址整理出 {頁籤: 網址前綴}，"" 為全部頁籤最常見的前綴 """
+    counts = {}
+    for item in records:
+        match = PERMALINK_PATTERN.search(str(item.get("url", "")))
+        if match:
+            counts.setdefault(item.get("category", ""), Counter())[match.group(1)] += 1
+            counts.setdefault("", Counter())[match.group(1)] += 1
+    return {category: c.most_common(1)[0][0] for category, c in counts.items()}
+
+
+def derive_permalink(attr_values, prefix=None):
+    """
+    由公告列上的屬性值推導 Permalink：
+    1. 屬性中已有 freeze 網址 (完整或站內相對路徑) → 直接使用
+    2. 只有公告 id (24 碼十六進位) 且已知網址前綴 → 組出網址
+    推導不出回傳 None (呼叫端回退點擊視窗)
+    """
+    text = " ".join(v for v in attr_values if v)
+    match = PERMALINK_PATTERN.search(text)
+    if match:
+        return absolute_url(match.group(1) + match.group(2)) + PERMALINK_QUERY
+    ids = ANNOUNCEMENT_ID.findall(text)
+    if prefix and ids:
+        return absolute_url(prefix + ids[-1]) + PERMALINK_QUERY
+    return None
+
+
+class DetailFetcher:
+    """
+    連線池化的公告抓取器。
+    用法：
+        async with DetailFetcher(limiter=limiter, prefixes=permalink_prefixes(records)) as fetcher:
+            results = await fetcher.fetch_many(urls)
+    limiter: crawl_common.HostRateLimiter，與瀏覽器共用同一份主機間隔與併發上限
+    """
+
+    def __init__(self, concurrency=FETCH_CONCURRENCY, timeout=FETCH_TIMEOUT, limiter=None, prefixes=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limiter = limiter
+        self.prefixes = prefixes or {}
+        self.session = None
+        self.requests = 0
+        self.derived = 0
+        self.fallbacks = 0
+
+    def permalink_for(self, category, attr_values):
+        """ 推導公告列的 Permalink，並統計推導成功 / 回退視窗的筆數 """
+        url = derive_permalink(attr_values, self.prefixes.get(category) or self.prefixes.get(""))
+        if url: self.derived += 1
+        else: self.fallbacks += 1
+        return url
+
+    async def __aenter__(self):
+        # ssl=False 處理學校網站可能的 SSL 問題 (與 generate_calendar 的 verify=False 一致)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency, ssl=False)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers={"User-Agent": USER_AGENT},
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+        return False
+
+    async def fetch(self, url):
+        """ 抓取並解析單篇公告；失敗時回傳 None (呼叫端可改走視窗模式) """
+        try:
+            if self.limiter is not None:
+                async with self.limiter.slot(url):
+                    html = await self._get(url)
+            else:
+                html = await self._get(url)
+            return parse_detail_html(html, url) if html is not None else None
+        except Exception as e:
+            print(f"      ⚠️ HTTP 抓取失敗 {url}: {e}")
+            return None
+
+    async def _get(self, url):
+        self.requests += 1
+        async with self.session.get(url) as response:
+            if response.status != 200:
+                return None
+            return await response.text(errors="replace")
+
+    async def fetch_many(self, urls):
+        """ 同時抓取多篇，回傳 {url: data 或 None} """
+        urls = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*[self.fetch(u) for u in urls])
+        return dict(zip(urls, results))
+
+
+async def _main(urls):
+    async with DetailFetcher() as fetcher:
+        results = await fetcher.fetch_many(urls)
+    print(json.dumps(results, ensure_ascii=False, indent=4))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法：python detail_fetcher.py <url> [<url> ...]")
+        sys.exit(1)
+    asyncio.run(_main(sys.argv[1:]))
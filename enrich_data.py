@@ -2,6 +2,7 @@ import json
 import os
 import time
 import google.generativeai as genai
+from knowledge_model import load_records, dump_records
 
 # ==========================================
 # 🔑 設定區
@@ -49,8 +50,7 @@ def enrich_json_data():
         return
 
     print(f"📖 讀取 {TARGET_FILE}...")
-    with open(TARGET_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    data = load_records(TARGET_FILE)
 
     # 為了節省時間與 API 配額，我們只處理「最新的 20 筆」或「尚未標記」的資料
     # 在實際 production 中，您可以設計邏輯只處理 new data
@@ -88,8 +88,7 @@ def enrich_json_data():
 
     # 存檔
     if process_count > 0:
-        with open(TARGET_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
+        dump_records(data, TARGET_FILE)
         print(f"✅ 更新完成！共增強了 {process_count} 筆資料。")
     else:
         print("🎉 所有資料皆已標記，無需更新。")
@@ -0,0 +1,359 @@
+# ====================================================
+# 📎 附件文字抽取 (Attachment Text Extraction)
+# 公告常只寫「詳如附件」，真正的答案在附檔 PDF / Word 裡。
+# 1. 以連線池化的 aiohttp 下載附件 (沿用 HostRateLimiter 禮貌限速)
+# 2. 快取：網址 → SHA-256 (含 ETag / Last-Modified)，檔案內容以 SHA-256 存放
+# 3. 在行程池中抽出文字：PDF 用 pdfplumber，docx / xlsx / pptx 直接讀 zip 內的 XML，
+#    舊版 OLE 格式：.xls 用 xlrd，.doc 以 olefile 讀出 WordDocument 串流後依片段表 (piece table) 取文字
+#    (.ppt 等其他 OLE 檔仍記為 unsupported)
+# 4. 增量：已處理過的網址不再下載，同一份檔案 (相同雜湊) 只解析一次
+# 輸出 nihs_attachment_text.json，bot 以子資料列 (parent_id 指向公告) 建入索引
+# 用法：python extract_attachments.py [--revalidate] [--limit 100]
+# ====================================================
+import argparse
+import asyncio
+import hashlib
+import html
+import json
+import os
+import re
+import struct
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import aiohttp
+import olefile
+import pdfplumber
+import xlrd
+from crawl_common import HostRateLimiter
+from knowledge_model import load_records, attachment_list, record_id
+
+SOURCE_FILE = "nihs_knowledge_full.json"
+OUTPUT_FILE = "nihs_attachment_text.json"
+CACHE_DIR = os.environ.get("ATTACHMENT_CACHE_DIR", ".attachment_cache")
+
+# 抽取規則改變時遞增，舊版結果會重新解析
+EXTRACTOR_VERSION = 2
+FETCH_CONCURRENCY = int(os.environ.get("ATTACHMENT_CONCURRENCY", "6"))
+HOST_MIN_INTERVAL = float(os.environ.get("ATTACHMENT_HOST_INTERVAL", "0.2"))
+FETCH_TIMEOUT = 60
+MAX_BYTES = 30 * 1024 * 1024
+MAX_RETRIES = 3
+SEGMENT_CHARS = 1500               # 每個子資料列的長度上限 (搜尋摘要才不會只看到開頭)
+MAX_CHARS = 60000                  # 單一附件保留的文字上限
+SKIP_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".zip", ".rar", ".7z", ".mp4")
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+
+
+# ==========================================
+# 🔍 檔案類型判斷與文字抽取 (在子行程執行)
+# ==========================================
+def sniff_kind(path):
+    """ 依檔頭判斷類型 (feeder 下載點沒有副檔名)；OLE 檔再依內部串流分出 doc / xls """
+    with open(path, "rb") as f:
+        head = f.read(8)
+    if head.startswith(b"%PDF"): return "pdf"
+    if head.startswith(b"\xd0\xcf\x11\xe0"):
+        try:
+            with olefile.OleFileIO(path) as ole:
+                if ole.exists("WordDocument"): return "doc"
+                if ole.exists("Workbook") or ole.exists("Book"): return "xls"
+        except OSError:
+            return "unknown"
+        return "ole"
+    if head.startswith(b"PK"):
+        try:
+            with zipfile.ZipFile(path) as z:
+                names = set(z.namelist())
+        except zipfile.BadZipFile:
+            return "unknown"
+        if "word/document.xml" in names: return "docx"
+        if "xl/sharedStrings.xml" in names: return "xlsx"
+        if any(n.startswith("ppt/slides/") for n in names): return "pptx"
+    return "unknown"
+
+
+def _xml_paragraphs(xml, para_end, text_tag):
+    """ 以正規表達式從 OOXML 取出段落文字 (比完整 XML 解析快，也不需額外套件) """
+    paragraphs = []
+    for block in xml.split(para_end):
+        parts = re.findall(rf"<{text_tag}(?:\s[^>]*)?>([^<]*)</{text_tag}>", block)
+        text = html.unescape("".join(parts)).strip()
+        if text: paragraphs.append(text)
+    return paragraphs
+
+
+def _slide_number(name):
+    match = re.search(r"(\d+)\.xml$", name)
+    return int(match.group(1)) if match else 0
+
+
+def _doc_paragraphs(path):
+    """
+    Word 97-2003 (.doc)：FIB 的 fcClx 指向 Table 串流中的片段表，
+    每個片段記錄一段文字在 WordDocument 串流中的位置與編碼 (壓縮 = cp1252，否則 UTF-16LE)
+    """
+    with olefile.OleFileIO(path) as ole:
+        word = ole.openstream("WordDocument").read()
+        flags, = struct.unpack_from("<H", word, 0x0A)
+        if flags & 0x0100:
+            raise ValueError("encrypted document")
+        table = ole.openstream("1Table" if flags & 0x0200 else "0Table").read()
+    fc_clx, lcb_clx = struct.unpack_from("<II", word, 0x01A2)
+    clx, pos = table[fc_clx:fc_clx + lcb_clx], 0
+    while pos < len(clx) and clx[pos] == 0x01:          # 略過 Prc (格式修改)
+        pos += 3 + struct.unpack_from("<H", clx, pos + 1)[0]
+    if pos >= len(clx) or clx[pos] != 0x02:
+        raise ValueError("piece table not found")
+    lcb, = struct.unpack_from("<I", clx, pos + 1)
+    plc = clx[pos + 5:pos + 5 + lcb]
+    n = (lcb - 4) // 12
+    cps = struct.unpack_from(f"<{n + 1}I", plc, 0)
+    parts = []
+    for i in range(n):
+        fc, = struct.unpack_from("<I", plc, (n + 1) * 4 + i * 8 + 2)
+        length = cps[i + 1] - cps[i]
+        if fc & 0x40000000:
+            start = (fc & 0x3FFFFFFF) // 2
+            parts.append(word[start:start + length].decode("cp1252", "replace"))
+        else:
+            parts.append(word[fc:fc + length * 2].decode("utf-16-le", "replace"))
+    text = re.sub(r"\x13[^\x14\x15]*\x14?", "", "".join(parts))  # 功能變數只留顯示結果
+    text = re.sub(r"[\x00-\x08\x0e-\x1f]", "", text.replace("\x07", "\t").replace("\x0b", "\n"))
+    return [p.strip() for p in re.split(r"[\r\x0c]", text) if p.strip()]
+
+
+def _cell_text(value):
+    # xlrd 的數字一律是 float：整數不要顯示成 "301.0"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _xls_sheets(path):
+    """ Excel 97-2003 (.xls)：每個工作表一頁，每列以 tab 串接非空白儲存格 """
+    book = xlrd.open_workbook(path, on_demand=True)
+    try:
+        pages = []
+        for sheet in book.sheets():
+            rows = ["\t".join(t for t in map(_cell_text, sheet.row_values(r)) if t) for r in range(sheet.nrows)]
+            pages.append("\n".join(r for r in rows if r))
+        return pages
+    finally:
+        book.release_resources()
+
+
+def extract_file(args):
+    """ (子行程) 回傳 {"kind", "pages": [str], "error"} ；pages 是原始分頁 / 投影片 / 段落 """
+    path, kind = args
+    pages = []
+    try:
+        if kind == "pdf":
+            with pdfplumber.open(path) as pdf:
+                pages = [page.extract_text() or "" for page in pdf.pages]
+        elif kind in ("docx", "xlsx", "pptx"):
+            with zipfile.ZipFile(path) as z:
+                if kind == "docx":
+                    pages = _xml_paragraphs(z.read("word/document.xml").decode("utf-8", "replace"), "</w:p>", "w:t")
+                elif kind == "xlsx":
+                    pages = _xml_paragraphs(z.read("xl/sharedStrings.xml").decode("utf-8", "replace"), "</si>", "t")
+                else:
+                    slides = sorted((n for n in z.namelist() if re.match(r"ppt/slides/slide\d+\.xml$", n)), key=_slide_number)
+                    pages = [" ".join(_xml_paragraphs(z.read(n).decode("utf-8", "replace"), "</a:p>", "a:t")) for n in slides]
+        elif kind == "doc":
+            pages = _doc_paragraphs(path)
+        elif kind == "xls":
+            pages = _xls_sheets(path)
+        return {"kind": kind, "pages": pages, "error": None}
+    except Exception as e:
+        return {"kind": kind, "pages": [], "error": str(e)[:200]}
+
+
+def to_segments(pages, limit=SEGMENT_CHARS, max_chars=MAX_CHARS):
+    """ 把分頁 / 段落合併成不超過 limit 字的段落組，總長度不超過 max_chars """
+    segments, buf, total = [], "", 0
+    for page in pages:
+        page = re.sub(r"[ \t]+", " ", page).strip()[:max_chars - total]
+        total += len(page)
+        # 過長的頁面先切成 limit 字的片段，再與前後片段合併
+        for i in range(0, len(page), limit):
+            piece = page[i:i + limit]
+            if buf and len(buf) + 1 + len(piece) > limit:
+                segments.append(buf)
+                buf = piece
+            else:
+                buf = f"{buf}\n{piece}" if buf else piece
+        if total >= max_chars: break
+    if buf: segments.append(buf)
+    return segments
+
+
+# ==========================================
+# 🌐 下載 (連線池 + 快取)
+# ==========================================
+def cache_path(sha):
+    return os.path.join(CACHE_DIR, sha[:2], f"{sha}.bin")
+
+
+async def fetch_one(session, limiter, url, previous):
+    """ 串流下載並計算 SHA-256；有舊紀錄就帶條件請求。回傳新的 link 紀錄 """
+    link = {"status": "error", "sha256": None, "etag": None, "last_modified": None,
+            "attempts": (previous or {}).get("attempts", 0) + 1,
+            "checked_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    headers, tmp = {}, None
+    if previous and previous.get("sha256") and os.path.exists(cache_path(previous["sha256"])):
+        if previous.get("etag"): headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"): headers["If-Modified-Since"] = previous["last_modified"]
+    try:
+        async with limiter.slot(url):
+            async with session.get(url, headers=headers) as response:
+                link["etag"] = response.headers.get("ETag")
+                link["last_modified"] = response.headers.get("Last-Modified")
+                if response.status == 304 and previous:
+                    link.update(status="ok", sha256=previous["sha256"], attempts=0)
+                    return link
+                if response.status != 200:
+                    link["error"] = f"HTTP {response.status}"
+                    return link
+                digest, size = hashlib.sha256(), 0
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".part")
+                with os.fdopen(fd, "wb") as f:
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        size += len(chunk)
+                        if size > MAX_BYTES:
+                            break
+                        f.write(chunk)
+                        digest.update(chunk)
+                if size > MAX_BYTES:
+                    os.remove(tmp)
+                    link.update(status="too_large", attempts=0)
+                    return link
+        sha = digest.hexdigest()
+        os.makedirs(os.path.dirname(cache_path(sha)), exist_ok=True)
+        os.replace(tmp, cache_path(sha))
+        link.update(status="ok", sha256=sha, size=size, attempts=0)
+    except Exception as e:
+        link["error"] = str(e)[:200]
+        if tmp and os.path.exists(tmp): os.remove(tmp)
+    return link
+
+
+async def fetch_all(urls, links):
+    limiter = HostRateLimiter(max_concurrency=FETCH_CONCURRENCY, min_interval=HOST_MIN_INTERVAL)
+    # ssl=False 處理學校網站可能的 SSL 問題 (與 detail_fetcher 一致)
+    connector = aiohttp.TCPConnector(limit=FETCH_CONCURRENCY, ssl=False)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT),
+                                     headers={"User-Agent": USER_AGENT}) as session:
+        results = await asyncio.gather(*[fetch_one(session, limiter, u, links.get(u)) for u in urls])
+    return dict(zip(urls, results))
+
+
+# ==========================================
+# 🏭 主流程
+# ==========================================
+def load_output(path=OUTPUT_FILE):
+    if not os.path.exists(path):
+        return {"extractor_version": EXTRACTOR_VERSION, "files": {}, "links": {}, "children": []}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def collect_children(records):
+    """ 從全知資料庫列出所有 (公告, 附件) 配對 """
+    children, seen = [], set()
+    for item in records:
+        for att in attachment_list(item.get("attachments")):
+            url = att.get("url", "")
+            if not url.startswith("http") or url.lower().split("?")[0].endswith(SKIP_EXTS):
+                continue
+            key = (record_id(item), url)
+            if key in seen: continue
+            seen.add(key)
+            children.append({
+                "parent_id": key[0], "parent_title": item.get("title", ""), "parent_url": item.get("url", ""),
+                "unit": item.get("unit", ""), "date": item.get("date", ""),
+                "name": att.get("name") or att.get("title") or "", "url": url,
+            })
+    return children
+
+
+def extract_attachments(revalidate=False, limit=0):
+    start = time.time()
+    if not os.path.exists(SOURCE_FILE):
+        print(f"⚠️ 找不到 {SOURCE_FILE}，略過附件抽取。")
+        return
+    output = load_output()
+    links, files = output.get("links", {}), output.get("files", {})
+    children = collect_children(load_records(SOURCE_FILE))
+    urls = list(dict.fromkeys(c["url"] for c in children))
+
+    # 1. 決定要下載的網址：新網址、重試中的失敗網址；--revalidate 時全部以條件請求重新驗證
+    def needs_fetch(url):
+        link = links.get(url)
+        if link is None or revalidate: return True
+        return link["status"] == "error" and link.get("attempts", 0) < MAX_RETRIES
+    to_fetch = [u for u in urls if needs_fetch(u)]
+    if limit: to_fetch = to_fetch[:limit]
+    print(f"📎 附件 {len(urls)} 個 (公告附件配對 {len(children)} 筆)，需下載 {len(to_fetch)} 個")
+    if to_fetch:
+        t0 = time.time()
+        links.update(asyncio.run(fetch_all(to_fetch, links)))
+        ok = sum(1 for u in to_fetch if links[u]["status"] == "ok")
+        print(f"   🌐 下載完成 {ok}/{len(to_fetch)}，耗時 {time.time() - t0:.1f} 秒")
+
+    # 2. 需要解析的檔案：有下載到、且尚未以目前版本解析過的雜湊
+    pending = {}
+    for u in urls:
+        sha = (links.get(u) or {}).get("sha256")
+        if not sha or sha in pending: continue
+        done = files.get(sha)
+        if done and done.get("version") == EXTRACTOR_VERSION: continue
+        if os.path.exists(cache_path(sha)):
+            pending[sha] = (cache_path(sha), sniff_kind(cache_path(sha)))
+    parseable = {sha: job for sha, job in pending.items() if job[1] not in ("ole", "unknown")}
+    for sha, (_, kind) in pending.items():
+        if sha not in parseable:
+            files[sha] = {"version": EXTRACTOR_VERSION, "kind": kind, "segments": [], "error": "unsupported"}
+
+    if parseable:
+        t0 = time.time()
+        shas = list(parseable)
+        with ProcessPoolExecutor(max_workers=min(4, len(shas))) as pool:
+            for sha, result in zip(shas, pool.map(extract_file, [parseable[s] for s in shas])):
+                files[sha] = {"version": EXTRACTOR_VERSION, "kind": result["kind"],
+                              "segments": to_segments(result["pages"]), "error": result["error"]}
+        print(f"   📄 解析 {len(shas)} 個檔案，耗時 {time.time() - t0:.1f} 秒")
+
+    # 3. 輸出：只保留目前資料庫還引用得到的網址與檔案
+    live_shas = {links[u]["sha256"] for u in urls if links.get(u, {}).get("sha256")}
+    for c in children:
+        c["sha256"] = (links.get(c["url"]) or {}).get("sha256")
+    output = {
+        "extractor_version": EXTRACTOR_VERSION,
+        "files": {sha: files[sha] for sha in sorted(live_shas) if sha in files},
+        "links": {u: links[u] for u in urls if u in links},
+        "children": [c for c in children if c["sha256"] in live_shas],
+    }
+    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(output, f, ensure_ascii=False, indent=2)
+
+    segments = sum(len(f["segments"]) for f in output["files"].values())
+    kinds = {}
+    for f in output["files"].values(): kinds[f["kind"]] = kinds.get(f["kind"], 0) + 1
+    print(f"✅ 附件文字：{len(output['files'])} 個檔案 {kinds}，{segments} 段，子資料 {len(output['children'])} 筆")
+    print(f"⏱️ 總耗時 {time.time() - start:.1f} 秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下載公告附件並抽出文字")
+    parser.add_argument("--revalidate", action="store_true", help="已下載的附件也以條件請求重新驗證")
+    parser.add_argument("--limit", type=int, default=0, help="本次最多下載幾個 (0 = 不限)")
+    args = parser.parse_args()
+    extract_attachments(revalidate=args.revalidate, limit=args.limit)
+
+
+if __name__ == "__main__":
+    main()
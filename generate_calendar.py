@@ -1,185 +1,597 @@
-import os
-import json
-import requests
-import pdfplumber
-import google.generativeai as genai
-import re
-from datetime import datetime
-
-# ==========================================
-# 🔑 設定區
-# ==========================================
-# 統一使用 2.0-flash 確保邏輯與年份判斷最準確
-MODEL_NAME = 'gemini-2.0-flash' 
-
-GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
-
-INPUT_FILE = 'nihs_knowledge_full.json'
-OUTPUT_FILE = 'nihs_calendar.json'
-TEMP_PDF = 'temp_calendar.pdf'
-
-def find_official_calendar():
-    """ 
-    邏輯優化：精準鎖定標題符合「XX學年度第X學期行事曆」的 PDF
-    """
-    if not os.path.exists(INPUT_FILE):
-        print("❌ 找不到資料庫檔案")
-        return None, None, None
-
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    # 用正則表達式匹配：XX學年度(第X學期)行事曆
-    pattern = re.compile(r"(\d{3})學年度(第[一二12]學期)?行事曆")
-
-    candidates = []
-    for item in data:
-        title = item.get('title', '')
-        match = pattern.search(title)
-        
-        if match and item.get('attachments'):
-            for att in item['attachments']:
-                url = att.get('url', '')
-                if url.lower().endswith('.pdf'):
-                    candidates.append({
-                        "weight": int(match.group(1)),
-                        "date": item.get('date', '1900/01/01'),
-                        "title": title,
-                        "url": url
-                    })
-    
-    if not candidates:
-        print("⚠️ 找不到符合格式的行事曆 PDF")
-        return None, None, None
-
-    candidates.sort(key=lambda x: (x['weight'], x['date']), reverse=True)
-    latest = candidates[0]
-    
-    print(f"✅ 成功鎖定正式行事曆：{latest['title']}")
-    return latest['url'], latest['title'], latest['date']
-
-def download_pdf(url):
-    try:
-        headers = {"User-Agent": "Mozilla/5.0"}
-        # verify=False 處理學校網站可能的 SSL 問題
-        response = requests.get(url, headers=headers, stream=True, timeout=15, verify=False)
-        if response.status_code == 200:
-            with open(TEMP_PDF, 'wb') as f:
-                f.write(response.content)
-            return True
-    except Exception as e:
-        print(f"❌ 下載錯誤: {e}")
-    return False
-
-def extract_text_from_pdf():
-    full_text = ""
-    try:
-        with pdfplumber.open(TEMP_PDF) as pdf:
-            for page in pdf.pages:
-                tables = page.extract_tables()
-                if tables:
-                    for table in tables:
-                        for row in table:
-                            clean_row = [str(cell).strip().replace('\n', '') for cell in row if cell]
-                            full_text += " | ".join(clean_row) + "\n"
-                full_text += page.extract_text() or ""
-        return full_text
-    except Exception as e:
-        print(f"❌ PDF 解析失敗: {e}")
-        return ""
-
-def generate_calendar_json(pdf_text, doc_title, doc_date):
-    print(f"🧠 使用 {MODEL_NAME} 解析行事曆 (年份校正模式)...")
-    
-    academic_year_match = re.search(r'(\d{3})', doc_title)
-    academic_year = int(academic_year_match.group(1)) if academic_year_match else 114
-    
-    is_second_semester = "二" in doc_title or "2" in doc_title
-    base_year_start = academic_year + 1911
-    
-    if is_second_semester:
-        target_year = base_year_start + 1
-        year_instruction = f"此為第2學期，所有月份（2月至7月）的年份皆為 {target_year} 年。"
-        year_limit = f"嚴禁出現 {target_year + 1} 年 (如 2027)。"
-    else:
-        target_year = base_year_start
-        year_instruction = f"此為第1學期，8月至12月為 {target_year} 年，隔年1月為 {target_year + 1} 年。"
-        year_limit = f"嚴禁在 12 月之前出現 {target_year + 1} 年。"
-
-    prompt = f"""
-    你是校務資料處理專家。請根據下方行事曆 PDF 內容，整理出完整的活動清單。
-
-    【背景資訊】:
-    - 文件標題: "{doc_title}"
-    - 年份判定邏輯: {year_instruction}
-    - 限制: {year_limit}
-
-    【任務】:
-    1. 將所有活動轉為標準 JSON 格式。
-    2. 日期格式必須為: "YYYY/MM/DD"。
-    3. 如果活動有多個日期(如 6/29-6/30)，請拆分為兩筆或使用該範圍的第一天。
-    4. **重要**：如果內容很多，請精簡描述活動名稱，確保 JSON 結構完整。
-
-    【輸出格式】:
-    [
-      {{ "date": "YYYY/MM/DD", "event": "活動名稱", "category": "分類" }}
-    ]
-
-    【PDF 內容】:
-    {pdf_text[:35000]}
-    """
-
-    # 🛠️ 關鍵設定優化
-    generation_config = genai.types.GenerationConfig(
-        response_mime_type="application/json",
-        max_output_tokens=8192, # 確保空間足夠
-        temperature=0
-    )
-
-    try:
-        model = genai.GenerativeModel(MODEL_NAME)
-        response = model.generate_content(prompt, generation_config=generation_config)
-        
-        # 取得原始文字
-        res_text = response.text.strip()
-        
-        # 🛠️ 修復機制：檢查 JSON 是否被截斷 (漏掉結尾的 ])
-        if not res_text.endswith(']'):
-            print("⚠️ 偵測到 JSON 截斷，嘗試自動修復結尾...")
-            # 找到最後一個完整的物件結束位置
-            last_obj_end = res_text.rfind('}')
-            if last_obj_end != -1:
-                res_text = res_text[:last_obj_end+1] + ']'
-        
-        return json.loads(res_text)
-
-    except json.JSONDecodeError as je:
-        print(f"❌ JSON 解析失敗: {je}")
-        # 除錯用：印出出錯位置附近的文字
-        start_pos = max(0, je.pos - 50)
-        end_pos = min(len(response.text), je.pos + 50)
-        print(f"🔍 錯誤附近文字: ...{response.text[start_pos:end_pos]}...")
-        return []
-    except Exception as e:
-        print(f"❌ AI 解析出錯: {e}")
-        return []
-
-if __name__ == "__main__":
-    pdf_url, title, date_str = find_official_calendar()
-    
-    if pdf_url:
-        if download_pdf(pdf_url):
-            raw_text = extract_text_from_pdf()
-            if raw_text:
-                events = generate_calendar_json(raw_text, title, date_str)
-                if events:
-                    # 排序確保 JSON 產出按日期排列
-                    events.sort(key=lambda x: x['date'])
-                    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-                        json.dump(events, f, ensure_ascii=False, indent=4)
-                    print(f"✅ 成功生成行事曆資料庫 ({len(events)} 筆活動)")
-            
-            if os.path.exists(TEMP_PDF):
-                os.remove(TEMP_PDF)
\ No newline at end of file
+import os
+import json
+import hashlib
+import requests
+import pdfplumber
+import google.generativeai as genai
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from knowledge_model import load_records, attachment_list
+
+# ==========================================
+# 🔑 設定區
+# ==========================================
+# 統一使用 2.0-flash 確保邏輯與年份判斷最準確
+MODEL_NAME = 'gemini-2.0-flash' 
+
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+
+INPUT_FILE = 'nihs_knowledge_full.json'
+OUTPUT_FILE = 'nihs_calendar.json'
+TEMP_PDF = 'temp_calendar.pdf'
+# 內容定址快取：以 PDF 網址 + SHA-256 為鍵，存放抽出的文字與解析後的活動，PDF 沒變就跳過解析與 AI
+CACHE_FILE = 'nihs_calendar_cache.json'
+DOWNLOAD_CHUNK = 64 * 1024
+
+# ⚡ AI 分段平行解析：依頁面切段、限速併發，避免單次 35000 字截斷與 8192 token 輸出上限
+LLM_CHUNK_CHARS = int(os.environ.get("CALENDAR_CHUNK_CHARS", "6000"))
+LLM_CONCURRENCY = int(os.environ.get("CALENDAR_LLM_CONCURRENCY", "4"))
+LLM_MIN_INTERVAL = float(os.environ.get("CALENDAR_LLM_INTERVAL", "1.0")) # 兩次呼叫的最小間隔 (秒)
+LLM_MAX_SPLITS = 3 # 輸出被截斷時，同一段最多再對半切幾次
+# 設定 CALENDAR_COMPARE=1 會額外跑一次舊的單次呼叫版本，比較耗時與完整度
+COMPARE_SINGLE_SHOT = os.environ.get("CALENDAR_COMPARE", "0") == "1"
+
+def load_cache():
+    if not os.path.exists(CACHE_FILE):
+        return {}
+    try:
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"⚠️ 快取讀取失敗，將重新解析: {e}")
+        return {}
+
+def save_cache(cache):
+    with open(CACHE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=4)
+
+def find_official_calendar():
+    """ 
+    邏輯優化：精準鎖定標題符合「XX學年度第X學期行事曆」的 PDF
+    """
+    if not os.path.exists(INPUT_FILE):
+        print("❌ 找不到資料庫檔案")
+        return None, None, None
+
+    data = load_records(INPUT_FILE)
+
+    # 用正則表達式匹配：XX學年度(第X學期)行事曆
+    pattern = re.compile(r"(\d{3})學年度(第[一二12]學期)?行事曆")
+
+    candidates = []
+    for item in data:
+        title = item.get('title', '')
+        match = pattern.search(title)
+        
+        if match and item.get('attachments'):
+            for att in attachment_list(item['attachments']):
+                url = att.get('url', '')
+                if url.lower().endswith('.pdf'):
+                    candidates.append({
+                        "weight": int(match.group(1)),
+                        "date": item.get('date', '1900/01/01'),
+                        "title": title,
+                        "url": url
+                    })
+    
+    if not candidates:
+        print("⚠️ 找不到符合格式的行事曆 PDF")
+        return None, None, None
+
+    candidates.sort(key=lambda x: (x['weight'], x['date']), reverse=True)
+    latest = candidates[0]
+    
+    print(f"✅ 成功鎖定正式行事曆：{latest['title']}")
+    return latest['url'], latest['title'], latest['date']
+
+def download_pdf(url, cached=None):
+    """
+    串流下載 PDF 並同時計算 SHA-256。
+    若有快取則帶上 If-None-Match / If-Modified-Since，伺服器回 304 就不下載。
+    回傳 {"status": "ok" | "not_modified" | "error", "sha256", "etag", "last_modified"}
+    """
+    result = {"status": "error", "sha256": None, "etag": None, "last_modified": None}
+    try:
+        headers = {"User-Agent": "Mozilla/5.0"}
+        if cached:
+            if cached.get("etag"): headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"): headers["If-Modified-Since"] = cached["last_modified"]
+        # verify=False 處理學校網站可能的 SSL 問題
+        with requests.get(url, headers=headers, stream=True, timeout=15, verify=False) as response:
+            result["etag"] = response.headers.get("ETag")
+            result["last_modified"] = response.headers.get("Last-Modified")
+            if response.status_code == 304 and cached:
+                result.update(status="not_modified", sha256=cached.get("sha256"),
+                              etag=result["etag"] or cached.get("etag"),
+                              last_modified=result["last_modified"] or cached.get("last_modified"))
+                return result
+            if response.status_code == 200:
+                digest = hashlib.sha256()
+                with open(TEMP_PDF, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                        if chunk:
+                            f.write(chunk)
+                            digest.update(chunk)
+                result.update(status="ok", sha256=digest.hexdigest())
+    except Exception as e:
+        print(f"❌ 下載錯誤: {e}")
+    return result
+
+def _extract_page(args):
+    """ (子行程) 抽出單一頁面的表格與文字 """
+    path, index = args
+    with pdfplumber.open(path) as pdf:
+        page = pdf.pages[index]
+        return {"page": index + 1, "tables": page.extract_tables() or [], "text": page.extract_text() or ""}
+
+def extract_pages(path=TEMP_PDF):
+    """ 以多個行程平行抽出每一頁的表格與文字，回傳依頁碼排序的清單 """
+    try:
+        with pdfplumber.open(path) as pdf:
+            page_count = len(pdf.pages)
+        if page_count <= 1:
+            return [_extract_page((path, i)) for i in range(page_count)]
+        with ProcessPoolExecutor(max_workers=min(4, page_count)) as pool:
+            return list(pool.map(_extract_page, [(path, i) for i in range(page_count)]))
+    except Exception as e:
+        print(f"❌ PDF 解析失敗: {e}")
+        return []
+
+def pages_to_text(pages):
+    """ 把表格與文字攤平成給 AI 看的純文字 (與舊版 extract_text_from_pdf 格式相同) """
+    full_text = ""
+    for page in pages:
+        for table in page["tables"]:
+            for row in table:
+                clean_row = [str(cell).strip().replace('\n', '') for cell in row if cell]
+                full_text += " | ".join(clean_row) + "\n"
+        full_text += page["text"]
+    return full_text
+
+def extract_text_from_pdf():
+    return pages_to_text(extract_pages())
+
+# ==========================================
+# 📐 規則式表格解析 (不需 AI)
+# 行事曆表格：週次 | 月 | 日 一 二 三 四 五 六 | 各處室行事欄
+# ==========================================
+WEEKDAYS = "日一二三四五六"
+CN_NUM = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10, "十一": 11, "十二": 12}
+RE_MONTH_DAY = re.compile(r'^(\d{1,2})\s*[/／.]\s*(\d{1,2})')
+RE_CN_MONTH_DAY = re.compile(r'^(\d{1,2})\s*月\s*(\d{1,2})\s*[日號]?')
+RE_DAY_ONLY = re.compile(r'^(\d{1,2})\s*[日號]?\s*(?=[（(][一二三四五六日][)）])')
+RE_WEEKDAY = re.compile(r'^[（(]([一二三四五六日])[)）]')
+RE_RANGE_TAIL = re.compile(r'^\s*[-~～至]\s*(\d{1,2}\s*[/／]\s*)?\d{1,2}')
+RE_WEEKDAY_TAIL = re.compile(r'^\s*[（(][一二三四五六日][)）]')
+
+def academic_context(doc_title):
+    """ 由標題判斷學年度與學期，回傳 (學年度, 是否第二學期, 學年起始西元年) """
+    academic_year_match = re.search(r'(\d{3})', doc_title)
+    academic_year = int(academic_year_match.group(1)) if academic_year_match else 114
+    semester_match = re.search(r'第([一二12])學期', doc_title)
+    if semester_match:
+        is_second_semester = semester_match.group(1) in ("二", "2")
+    else:
+        # 沒寫第幾學期時沿用舊規則，但先去掉學年度數字避免 "112" 被誤判
+        rest = re.sub(r'\d{3}', '', doc_title)
+        is_second_semester = "二" in rest or "2" in rest
+    return academic_year, is_second_semester, academic_year + 1911
+
+def resolve_year(month, doc_title):
+    """ 依學期決定月份所屬的西元年 (與 AI 提示中的年份判定邏輯一致) """
+    _, is_second_semester, base_year_start = academic_context(doc_title)
+    if is_second_semester or month < 8:
+        return base_year_start + 1
+    return base_year_start
+
+def _parse_month(cell):
+    if not cell: return None
+    text = str(cell).replace("\n", "").replace(" ", "").replace("月份", "").replace("月", "")
+    if text.isdigit() and 1 <= int(text) <= 12: return int(text)
+    return CN_NUM.get(text)
+
+def _parse_day(cell):
+    if not cell: return None
+    text = str(cell).strip().split("\n")[0]
+    return int(text) if text.isdigit() and 1 <= int(text) <= 31 else None
+
+def _find_header(table):
+    """ 找出含「日一二三四五六」的表頭列，回傳 (列索引, {欄: 星期}, 月欄, [(欄, 處室)]) """
+    for r, row in enumerate(table):
+        cells = [str(c or "").replace("\n", "").replace(" ", "") for c in row]
+        day_cols = {c: WEEKDAYS.index(t) for c, t in enumerate(cells) if len(t) == 1 and t in WEEKDAYS}
+        if len(day_cols) < 5: continue
+        month_col = next((c for c, t in enumerate(cells) if t in ("月", "月份")), None)
+        last_day_col = max(day_cols)
+        office_cols = [(c, t) for c, t in enumerate(cells) if c > last_day_col and t]
+        return r, day_cols, month_col, office_cols
+    return None
+
+def _week_dates(row, day_cols, month_col, current_month):
+    """ 算出這一列每個星期欄對應的 (月, 日)，日數變小代表跨月 """
+    days = [(col, _parse_day(row[col])) for col in sorted(day_cols)]
+    days = [(col, d) for col, d in days if d]
+    if not days: return {}, current_month
+    rollover = next((i for i in range(1, len(days)) if days[i][1] < days[i - 1][1]), None)
+
+    label = _parse_month(row[month_col]) if month_col is not None and month_col < len(row) else None
+    if label:
+        # 月份標籤落在跨月的列時，標籤指的是新月份 (含 1 號的那個月)
+        month = (label - 2) % 12 + 1 if rollover is not None else label
+    else:
+        month = current_month
+
+    dates = {}
+    for i, (col, d) in enumerate(days):
+        if i == rollover: month = month % 12 + 1
+        dates[day_cols[col]] = (month, d)
+    return dates, month
+
+def _make_date(month, day, doc_title):
+    try:
+        return datetime(resolve_year(month, doc_title), month, day).strftime("%Y/%m/%d")
+    except ValueError:
+        return None
+
+def _parse_event_line(line, week, doc_title):
+    """ 解析一行行事文字開頭的日期，回傳 (YYYY/MM/DD, 活動) 或 (None, 原文) """
+    month = day = None
+    m = RE_MONTH_DAY.match(line) or RE_CN_MONTH_DAY.match(line)
+    if m:
+        month, day = int(m.group(1)), int(m.group(2))
+    else:
+        m = RE_DAY_ONLY.match(line)
+        if m:
+            day = int(m.group(1))
+            month = next((mo for mo, d in week.values() if d == day), None)
+        else:
+            m = RE_WEEKDAY.match(line)
+            if m and WEEKDAYS.index(m.group(1)) in week:
+                month, day = week[WEEKDAYS.index(m.group(1))]
+    if not m or not month or not day:
+        return None, line
+
+    rest = line[m.end():]
+    # 去掉範圍結尾 (例如 6/29-6/30 取第一天) 與星期註記
+    rest = RE_RANGE_TAIL.sub("", rest, count=1)
+    while RE_WEEKDAY_TAIL.match(rest):
+        rest = RE_WEEKDAY_TAIL.sub("", rest, count=1)
+    event = rest.strip(" 　:：、,，.-")
+    date = _make_date(month, day, doc_title)
+    if not date or not event:
+        return None, line
+    return date, event
+
+def parse_calendar_tables(pages, doc_title):
+    """
+    規則式解析：把週曆表格直接轉成 {date, event, category}。
+    回傳 (events, unresolved)；unresolved 為無法判定日期的儲存格，交給 AI 補解析
+    """
+    _, is_second_semester, _ = academic_context(doc_title)
+    events, unresolved = [], []
+    for page in pages:
+        for table in page["tables"]:
+            header = _find_header(table)
+            if not header: continue
+            header_row, day_cols, month_col, office_cols = header
+            current_month = 2 if is_second_semester else 8
+            for row in table[header_row + 1:]:
+                week, current_month = _week_dates(row, day_cols, month_col, current_month)
+                if not week: continue
+                for col, office in office_cols:
+                    if col >= len(row) or not row[col]: continue
+                    last = None
+                    for line in str(row[col]).split("\n"):
+                        line = line.strip()
+                        if not line: continue
+                        date, event = _parse_event_line(line, week, doc_title)
+                        if date:
+                            last = {"date": date, "event": event, "category": office}
+                            events.append(last)
+                        elif last is not None and not RE_MONTH_DAY.match(line):
+                            # 沒有日期的行視為上一則活動的換行
+                            last["event"] += line
+                        else:
+                            span = sorted(week.values())
+                            unresolved.append({
+                                "page": page["page"], "category": office, "text": line,
+                                "week": f"{span[0][0]}/{span[0][1]}~{span[-1][0]}/{span[-1][1]}",
+                            })
+    return events, unresolved
+
+def merge_events(*event_lists):
+    """ 合併多份活動清單，依 (日期, 活動) 去重 """
+    seen, merged = set(), []
+    for events in event_lists:
+        for e in events or []:
+            key = (e.get("date"), e.get("event"))
+            if key in seen or not all(key): continue
+            seen.add(key)
+            merged.append(e)
+    return merged
+
+def parse_calendar(pages, doc_title, doc_date):
+    """ 規則式解析為主；解析不了的儲存格 (或整份表格格式不符) 才交給 AI """
+    events, unresolved = parse_calendar_tables(pages, doc_title)
+    print(f"📐 規則式解析: {len(events)} 筆活動，{len(unresolved)} 個儲存格無法判定日期")
+    if not events:
+        print("⚠️ 表格格式無法辨識，改用 AI 分段解析全文")
+        llm_events, _ = generate_calendar_chunked([pages_to_text([p]) for p in pages], doc_title, doc_date)
+        return llm_events
+    if unresolved:
+        lines = [f"【{u['category']}】(該週 {u['week']}) {u['text']}" for u in unresolved]
+        llm_events, _ = generate_calendar_chunked(lines, doc_title, doc_date)
+        events = merge_events(events, llm_events)
+    return events
+
+# ==========================================
+# 🧠 AI 分段平行解析
+# ==========================================
+class RateLimiter:
+    """ 執行緒安全的限速器：最多 max_concurrency 個同時呼叫，且兩次呼叫開始間隔至少 min_interval 秒 """
+    def __init__(self, max_concurrency=LLM_CONCURRENCY, min_interval=LLM_MIN_INTERVAL):
+        self.semaphore = threading.Semaphore(max_concurrency)
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.last = 0.0
+
+    def __enter__(self):
+        self.semaphore.acquire()
+        with self.lock:
+            wait = self.last + self.min_interval - time.monotonic()
+            if wait > 0: time.sleep(wait)
+            self.last = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.semaphore.release()
+        return False
+
+class TruncatedOutput(Exception):
+    """ AI 輸出被截斷或不是完整的 JSON """
+
+def _wrap_line(line, width):
+    """ 過長的行切成不超過 width 的片段 (盡量在空白處切開)，內容不丟失 """
+    while len(line) > width:
+        cut = line.rfind(" ", width // 2, width)
+        if cut <= 0: cut = width
+        yield line[:cut]
+        line = line[cut:].lstrip(" ")
+    yield line
+
+def split_into_chunks(units, max_chars=LLM_CHUNK_CHARS):
+    """ 依頁面 (或行) 為單位打包成不超過 max_chars 的段落；過長的單位再依行切開，過長的行再切成多段 """
+    pieces = []
+    for unit in units:
+        if len(unit) <= max_chars:
+            pieces.append(unit)
+            continue
+        buf = ""
+        for line in unit.split("\n"):
+            for segment in _wrap_line(line, max_chars - 1):
+                if buf and len(buf) + len(segment) + 1 > max_chars:
+                    pieces.append(buf)
+                    buf = ""
+                buf += segment + "\n"
+        if buf: pieces.append(buf)
+
+    chunks, buf = [], ""
+    for piece in pieces:
+        if buf and len(buf) + len(piece) + 1 > max_chars:
+            chunks.append(buf)
+            buf = ""
+        buf += piece + "\n"
+    if buf.strip(): chunks.append(buf)
+    return chunks
+
+def _llm_parse(text, doc_title, limiter):
+    generation_config = genai.types.GenerationConfig(
+        response_mime_type="application/json",
+        max_output_tokens=8192,
+        temperature=0
+    )
+    with limiter:
+        model = genai.GenerativeModel(MODEL_NAME)
+        response = model.generate_content(build_calendar_prompt(text, doc_title), generation_config=generation_config)
+    try:
+        result = json.loads(response.text.strip())
+    except json.JSONDecodeError as je:
+        raise TruncatedOutput(str(je))
+    if not isinstance(result, list):
+        raise TruncatedOutput("輸出不是 JSON 陣列")
+    return result
+
+def _parse_chunk(text, doc_title, limiter, depth=0):
+    """ 解析一段；輸出被截斷就把該段對半切開重試，而不是切掉結尾 """
+    try:
+        return _llm_parse(text, doc_title, limiter)
+    except TruncatedOutput:
+        lines = text.split("\n")
+        if depth >= LLM_MAX_SPLITS or len(lines) < 2:
+            raise
+        mid = len(lines) // 2
+        print(f"   ✂️ 輸出截斷，將此段切成兩半重試 (第 {depth + 1} 次)")
+        return (_parse_chunk("\n".join(lines[:mid]), doc_title, limiter, depth + 1)
+                + _parse_chunk("\n".join(lines[mid:]), doc_title, limiter, depth + 1))
+
+def generate_calendar_chunked(units, doc_title, doc_date):
+    """
+    把文字依頁面切段，在限速下平行請 AI 解析，合併並依 (日期, 活動) 去重。
+    回傳 (events, report)；report 含每段狀態與涵蓋率
+    """
+    started = time.monotonic()
+    chunks = split_into_chunks(units)
+    limiter = RateLimiter()
+    print(f"🧠 使用 {MODEL_NAME} 分段解析行事曆：{len(chunks)} 段，併發 {LLM_CONCURRENCY}")
+
+    results = [None] * len(chunks)
+    with ThreadPoolExecutor(max_workers=max(1, LLM_CONCURRENCY)) as pool:
+        futures = {pool.submit(_parse_chunk, c, doc_title, limiter): i for i, c in enumerate(chunks)}
+        for future, i in futures.items():
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                print(f"   ⚠️ 第 {i + 1} 段解析失敗: {e}")
+
+    # 失敗的段落再循序重試一次
+    for i, chunk in enumerate(chunks):
+        if results[i] is None:
+            try:
+                results[i] = _parse_chunk(chunk, doc_title, limiter)
+            except Exception as e:
+                print(f"   ❌ 第 {i + 1} 段重試仍失敗: {e}")
+
+    # 涵蓋率檢查：成功解析的段落字數 / 總字數
+    total_chars = sum(len(c) for c in chunks) or 1
+    ok_chars = sum(len(c) for c, r in zip(chunks, results) if r is not None)
+    events = merge_events(*[r for r in results if r])
+    report = {
+        "chunks": len(chunks),
+        "chunks_ok": sum(1 for r in results if r is not None),
+        "coverage": round(ok_chars / total_chars, 4),
+        "events": len(events),
+        "elapsed_sec": round(time.monotonic() - started, 2),
+    }
+    print(f"   ✅ 分段解析完成：{report['chunks_ok']}/{report['chunks']} 段成功，涵蓋率 {report['coverage']:.0%}，"
+          f"{report['events']} 筆活動，耗時 {report['elapsed_sec']} 秒")
+    return events, report
+
+def compare_with_single_shot(pages, doc_title, doc_date):
+    """ 與舊版單次呼叫比較耗時與完整度 (CALENDAR_COMPARE=1 時執行) """
+    full_text = pages_to_text(pages)
+    started = time.monotonic()
+    single = generate_calendar_json(full_text, doc_title, doc_date)
+    single_sec = time.monotonic() - started
+    chunked, report = generate_calendar_chunked([pages_to_text([p]) for p in pages], doc_title, doc_date)
+    dropped = max(0, len(full_text) - 35000)
+    print("📊 單次呼叫 vs 分段平行：")
+    print(f"   單次：{single_sec:.1f} 秒，{len(single)} 筆活動，輸入涵蓋 {min(len(full_text), 35000)}/{len(full_text)} 字 (截掉 {dropped} 字)")
+    print(f"   分段：{report['elapsed_sec']:.1f} 秒，{len(chunked)} 筆活動，涵蓋率 {report['coverage']:.0%}")
+    missing = {(e.get('date'), e.get('event')) for e in chunked} - {(e.get('date'), e.get('event')) for e in single}
+    print(f"   單次呼叫缺少的活動：{len(missing)} 筆")
+
+def build_calendar_prompt(pdf_text, doc_title):
+    """ 行事曆解析提示 (單次呼叫與分段解析共用) """
+    academic_year, is_second_semester, base_year_start = academic_context(doc_title)
+    
+    if is_second_semester:
+        target_year = base_year_start + 1
+        year_instruction = f"此為第2學期，所有月份（2月至7月）的年份皆為 {target_year} 年。"
+        year_limit = f"嚴禁出現 {target_year + 1} 年 (如 2027)。"
+    else:
+        target_year = base_year_start
+        year_instruction = f"此為第1學期，8月至12月為 {target_year} 年，隔年1月為 {target_year + 1} 年。"
+        year_limit = f"嚴禁在 12 月之前出現 {target_year + 1} 年。"
+
+    prompt = f"""
+    你是校務資料處理專家。請根據下方行事曆 PDF 內容，整理出完整的活動清單。
+
+    【背景資訊】:
+    - 文件標題: "{doc_title}"
+    - 年份判定邏輯: {year_instruction}
+    - 限制: {year_limit}
+
+    【任務】:
+    1. 將所有活動轉為標準 JSON 格式。
+    2. 日期格式必須為: "YYYY/MM/DD"。
+    3. 如果活動有多個日期(如 6/29-6/30)，請拆分為兩筆或使用該範圍的第一天。
+    4. **重要**：如果內容很多，請精簡描述活動名稱，確保 JSON 結構完整。
+
+    【輸出格式】:
+    [
+      {{ "date": "YYYY/MM/DD", "event": "活動名稱", "category": "分類" }}
+    ]
+
+    【PDF 內容】:
+    {pdf_text}
+    """
+    return prompt
+
+def generate_calendar_json(pdf_text, doc_title, doc_date):
+    """ 舊版單次呼叫 (只送前 35000 字)；保留作為比較基準 """
+    print(f"🧠 使用 {MODEL_NAME} 解析行事曆 (年份校正模式)...")
+    prompt = build_calendar_prompt(pdf_text[:35000], doc_title)
+
+    # 🛠️ 關鍵設定優化
+    generation_config = genai.types.GenerationConfig(
+        response_mime_type="application/json",
+        max_output_tokens=8192, # 確保空間足夠
+        temperature=0
+    )
+
+    try:
+        model = genai.GenerativeModel(MODEL_NAME)
+        response = model.generate_content(prompt, generation_config=generation_config)
+        
+        # 取得原始文字
+        res_text = response.text.strip()
+        
+        # 🛠️ 修復機制：檢查 JSON 是否被截斷 (漏掉結尾的 ])
+        if not res_text.endswith(']'):
+            print("⚠️ 偵測到 JSON 截斷，嘗試自動修復結尾...")
+            # 找到最後一個完整的物件結束位置
+            last_obj_end = res_text.rfind('}')
+            if last_obj_end != -1:
+                res_text = res_text[:last_obj_end+1] + ']'
+        
+        return json.loads(res_text)
+
+    except json.JSONDecodeError as je:
+        print(f"❌ JSON 解析失敗: {je}")
+        # 除錯用：印出出錯位置附近的文字
+        start_pos = max(0, je.pos - 50)
+        end_pos = min(len(response.text), je.pos + 50)
+        print(f"🔍 錯誤附近文字: ...{response.text[start_pos:end_pos]}...")
+        return []
+    except Exception as e:
+        print(f"❌ AI 解析出錯: {e}")
+        return []
+
+def save_events(events):
+    # 排序確保 JSON 產出按日期排列
+    events.sort(key=lambda x: x['date'])
+    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(events, f, ensure_ascii=False, indent=4)
+    print(f"✅ 成功生成行事曆資料庫 ({len(events)} 筆活動)")
+
+if __name__ == "__main__":
+    pdf_url, title, date_str = find_official_calendar()
+    
+    if pdf_url:
+        cache = load_cache()
+        cached = cache.get(pdf_url)
+        dl = download_pdf(pdf_url, cached)
+
+        if dl["status"] == "not_modified":
+            # 伺服器確認 PDF 未變動 (304)：沿用快取的活動清單
+            print(f"💾 PDF 未變動 (HTTP 304)，沿用快取 ({len(cached.get('events', []))} 筆活動)")
+            if cached.get("events"): save_events(cached["events"])
+        elif dl["status"] == "ok":
+            if cached and cached.get("sha256") == dl["sha256"] and cached.get("events") and cached.get("title") == title:
+                # 內容雜湊相同：跳過 PDF 解析與 AI
+                print(f"💾 PDF 雜湊相同 ({dl['sha256'][:12]})，跳過解析與 AI，沿用快取")
+                events = cached["events"]
+                raw_text = cached.get("text", "")
+            else:
+                pages = extract_pages()
+                raw_text = pages_to_text(pages)
+                events = parse_calendar(pages, title, date_str) if raw_text else []
+                if COMPARE_SINGLE_SHOT and raw_text:
+                    compare_with_single_shot(pages, title, date_str)
+
+            if events:
+                save_events(events)
+                # 只保留目前這份 PDF 的快取
+                cache = {pdf_url: {
+                    "sha256": dl["sha256"], "etag": dl["etag"], "last_modified": dl["last_modified"],
+                    "title": title, "text": raw_text, "events": events,
+                }}
+                save_cache(cache)
+            
+        if os.path.exists(TEMP_PDF):
+            os.remove(TEMP_PDF)
\ No newline at end of file
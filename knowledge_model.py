@@ -0,0 +1,327 @@
+# ====================================================
+# 🗃️ 精簡知識資料模型 (Compact Knowledge Records)
+# 各腳本原本都把全知資料庫讀成 list[dict]，重複的字串 ("校園靜態資訊"、處室名稱、
+# 網域網址、"無") 每筆各存一份，bot 再整份複製進 SQLite。
+# 1. KnowledgeRecord 使用 __slots__，分類 / 單位 / 網址前綴以 sys.intern 共用同一份字串
+# 2. 長內文以 zlib 壓縮保存，讀取 .content 時才解壓 (延遲解碼)
+# 3. 介面相容 dict (get / [] / in / items)，既有腳本不必改寫比對邏輯
+# 4. load_records 分塊讀檔、逐筆解析並轉換，不會先把整個檔案解碼成一個大字串
+# 量測：python knowledge_model.py --bench (合成 100 倍語料，比較載入時間與記憶體高峰)
+# ====================================================
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from collections.abc import MutableMapping
+
+# 超過此長度 (字元) 的內文才壓縮；短字串壓縮反而更大
+COMPRESS_MIN_CHARS = int(os.environ.get("KNOWLEDGE_COMPRESS_MIN", "256"))
+COMPRESSED_FIELDS = ("content", "content_enriched")
+INTERNED_FIELDS = ("category", "unit", "date", "crawled_at")
+READ_CHUNK = 1 << 20
+
+# 常見欄位順序共用同一個 tuple
+_KEY_ORDERS = {}
+
+
+def _keys_tuple(keys):
+    keys = tuple(sys.intern(k) for k in keys)
+    return _KEY_ORDERS.setdefault(keys, keys)
+
+
+class _Packed:
+    """ 壓縮後的字串 (與一般 bytes 區分) """
+    __slots__ = ("data",)
+
+    def __init__(self, text):
+        self.data = zlib.compress(text.encode("utf-8"), 1)
+
+    def unpack(self):
+        return zlib.decompress(self.data).decode("utf-8")
+
+
+def _pack(value):
+    if isinstance(value, str) and len(value) >= COMPRESS_MIN_CHARS:
+        return _Packed(value)
+    return value
+
+
+def _split_url(url):
+    """ 網址拆成「前綴 (到最後一個 /)」與尾段，前綴 intern 後由所有同路徑的資料共用 """
+    cut = url.rfind("/") + 1
+    return sys.intern(url[:cut]), url[cut:]
+
+
+class KnowledgeRecord(MutableMapping):
+    """
+    一筆知識資料。欄位與原本 JSON 完全相同 (含欄位順序)，to_dict() 可原樣寫回。
+    常用欄位放在 slots，其餘 (duplicates、categories...) 放在 extra。
+    """
+    __slots__ = ("_keys", "title", "category", "unit", "date", "_url_prefix", "_url_tail",
+                 "_content", "_content_enriched", "attachments", "tags", "summary",
+                 "crawled_at", "content_fingerprint", "extra")
+
+    _SLOT_FIELDS = frozenset(("title", "category", "unit", "date", "url", "content", "content_enriched",
+                              "attachments", "tags", "summary", "crawled_at", "content_fingerprint"))
+
+    def __init__(self, data=()):
+        self._keys = ()
+        self.title = self.category = self.unit = self.date = None
+        self._url_prefix = self._url_tail = None
+        self._content = self._content_enriched = None
+        self.attachments = self.tags = self.summary = None
+        self.crawled_at = self.content_fingerprint = self.extra = None
+        items = data.items() if hasattr(data, "items") else data
+        keys = []
+        for key, value in items:
+            self._store(key, value)
+            keys.append(key)
+        self._keys = _keys_tuple(keys)
+
+    # --- 欄位存取 ---
+    def _store(self, key, value):
+        if key in INTERNED_FIELDS and isinstance(value, str):
+            setattr(self, key, sys.intern(value))
+        elif key == "url" and isinstance(value, str):
+            self._url_prefix, self._url_tail = _split_url(value)
+        elif key == "url":
+            self._url_prefix, self._url_tail = value, None
+        elif key in COMPRESSED_FIELDS:
+            setattr(self, "_" + key, _pack(value))
+        elif key in self._SLOT_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None: self.extra = {}
+            self.extra[key] = value
+
+    def _load(self, key):
+        if key == "url":
+            return self._url_prefix if self._url_tail is None else self._url_prefix + self._url_tail
+        if key in COMPRESSED_FIELDS:
+            value = getattr(self, "_" + key)
+            return value.unpack() if isinstance(value, _Packed) else value
+        if key in self._SLOT_FIELDS:
+            return getattr(self, key)
+        return self.extra[key]
+
+    @property
+    def url(self):
+        return self.get("url")
+
+    @property
+    def content(self):
+        return self.get("content")
+
+    def __getitem__(self, key):
+        if key not in self._keys: raise KeyError(key)
+        return self._load(key)
+
+    def __setitem__(self, key, value):
+        self._store(key, value)
+        if key not in self._keys:
+            self._keys = _keys_tuple(self._keys + (key,))
+
+    def __delitem__(self, key):
+        if key not in self._keys: raise KeyError(key)
+        self._store(key, None)
+        if self.extra and key in self.extra: del self.extra[key]
+        self._keys = _keys_tuple(k for k in self._keys if k != key)
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return f"KnowledgeRecord(title={self.title!r}, url={self.url!r})"
+
+    def attachment_list(self):
+        return attachment_list(self.attachments)
+
+    def to_dict(self):
+        return {k: self._load(k) for k in self._keys}
+
+
+def record_id(item):
+    """ 與 merge_data.py 相同的去重鍵 (url，沒有就用 title) 的短雜湊，作為穩定 id """
+    key = item.get("url") or item.get("title", "")
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+def knowledge_version(paths):
+    """ 資料檔內容的短雜湊；資料更新後版本就會改變 (快取與預先生成的答案以此失效) """
+    h = hashlib.sha256()
+    for path in paths:
+        if not os.path.exists(path): continue
+        h.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(READ_CHUNK), b""):
+                h.update(block)
+    return h.hexdigest()[:12]
+
+
+def attachment_list(value):
+    """ 附件欄位可能是 list 或 JSON 字串 (靜態爬蟲)，統一轉成 list """
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return []
+    return [a for a in value or [] if isinstance(a, dict)]
+
+
+def is_record(obj):
+    return isinstance(obj, (dict, KnowledgeRecord))
+
+
+def _hook(d):
+    # 公告與靜態頁面有 content、行事曆有 event；附件與 duplicates 等巢狀物件維持 dict
+    if "content" in d or "event" in d:
+        return KnowledgeRecord(d)
+    return d
+
+
+def iter_records(path):
+    """
+    逐筆讀出 JSON 陣列的元素 (分塊讀檔 + raw_decode)。
+    json.load 會先把整個檔案解碼成一個字串，高峰記憶體是檔案大小的好幾倍。
+    """
+    decoder = json.JSONDecoder(object_hook=_hook)
+    with open(path, "r", encoding="utf-8") as f:
+        buf, pos, started, eof = "", 0, False, False
+        while True:
+            # 跳過空白、陣列開頭與逗號
+            while pos < len(buf) and (buf[pos] in " \t\r\n," or (not started and buf[pos] == "[")):
+                started = started or buf[pos] == "["
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf) and started:
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof:
+                        yield item
+                        pos = end
+                        continue
+                except json.JSONDecodeError:
+                    if eof: raise
+            elif pos < len(buf):
+                # 不是 JSON 陣列 (例如 FAQ 的物件格式)：交給一般解析
+                f.seek(0)
+                yield from _as_list(json.load(f, object_hook=_hook))
+                return
+            if eof:
+                return
+            chunk = f.read(READ_CHUNK)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+
+def _as_list(data):
+    if isinstance(data, list): return data
+    return [data]
+
+
+def load_records(path, default=None):
+    """ 讀取 JSON 清單並轉成 KnowledgeRecord；檔案不存在回傳 default (預設空清單) """
+    if not os.path.exists(path):
+        return [] if default is None else default
+    return list(iter_records(path))
+
+
+def to_plain(obj):
+    """ 轉回可 json.dump 的原生結構 """
+    if isinstance(obj, KnowledgeRecord):
+        return {k: to_plain(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [to_plain(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: to_plain(v) for k, v in obj.items()}
+    return obj
+
+
+def dump_records(records, path, indent=4):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(to_plain(records), f, ensure_ascii=False, indent=indent)
+
+
+# ==========================================
+# 📈 量測：合成 100 倍語料
+# ==========================================
+def _synthetic_file(sources, factor):
+    base = []
+    for path in sources:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, list): base.extend(data)
+    out = []
+    for n in range(factor):
+        for item in base:
+            copy = dict(item)
+            if copy.get("url"): copy["url"] = f"{copy['url']}?copy={n}"
+            if copy.get("content"): copy["content"] = f"{copy['content']}\n({n})"
+            out.append(copy)
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False)
+    return path, len(out)
+
+
+def _measure(loader, path):
+    # 計時與記憶體分開量 (tracemalloc 本身會拖慢載入)
+    t0 = time.perf_counter()
+    data = loader(path)
+    elapsed = time.perf_counter() - t0
+    del data
+    tracemalloc.start()
+    data = loader(path)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # 模擬下游至少讀一次內文
+    t1 = time.perf_counter()
+    chars = sum(len(str(item.get("content") or "")) for item in data)
+    scan = time.perf_counter() - t1
+    return {"load_sec": elapsed, "scan_sec": scan, "retained_mb": current / 2**20, "peak_mb": peak / 2**20, "chars": chars}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比較 dict 與 KnowledgeRecord 的載入時間與記憶體")
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--factor", type=int, default=100)
+    parser.add_argument("files", nargs="*", default=["nihs_knowledge_full.json", "nihs_static_data_v43.json", "nihs_calendar.json"])
+    args = parser.parse_args()
+    if not args.bench:
+        parser.print_help()
+        return
+
+    path, n = _synthetic_file(args.files, args.factor)
+    try:
+        print(f"📈 合成語料 {args.factor} 倍：{n} 筆，{os.path.getsize(path) / 2**20:.1f} MB")
+
+        def load_dicts(p):
+            with open(p, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        before = _measure(load_dicts, path)
+        after = _measure(load_records, path)
+        assert before["chars"] == after["chars"]
+        for label, r in (("list[dict]", before), ("KnowledgeRecord", after)):
+            print(f"   {label:<16} 載入 {r['load_sec']:.2f}s | 掃描內文 {r['scan_sec']:.2f}s | "
+                  f"常駐 {r['retained_mb']:.1f} MB | 高峰 {r['peak_mb']:.1f} MB")
+        print(f"   📉 常駐記憶體 {after['retained_mb'] / before['retained_mb']:.0%}，高峰 {after['peak_mb'] / before['peak_mb']:.0%}")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
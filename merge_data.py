@@ -1,89 +1,141 @@
-import json
-import os
-import datetime
-
-# 定義檔案路徑
-FILES = {
-    'static': 'nihs_static_data_v43.json',
-    'dynamic': 'nihs_final_v40.json', # 這是動態爬蟲剛抓下來的"當日增量"
-    'calendar': 'nihs_calendar.json',
-    'faq': 'nihs_faq.json',
-    'master': 'nihs_knowledge_full.json' # 這是我們的主資料庫 (含 AI 標籤)
-}
-
-def load_json(filepath):
-    if os.path.exists(filepath):
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return [] # 若檔案不存在回傳空陣列
-
-def merge_data():
-    print("🔄 啟動智慧合併 (Smart Merge)...")
-
-    # 1. 讀取主資料庫 (Master DB) - 這是我們的「資產」，裡面有珍貴的 AI 標籤
-    master_data = load_json(FILES['master'])
-    print(f"   📖 主資料庫現有: {len(master_data)} 筆")
-
-    # 建立一個用 URL 或 Title 當 Key 的字典，方便快速比對
-    # 邏輯：key = url (若無 url 則用 title)
-    master_map = {item.get('url', item.get('title')): item for item in master_data}
-
-    # 2. 讀取新資料 (New Inputs)
-    new_data_sources = [
-        load_json(FILES['static']),
-        load_json(FILES['dynamic']),
-        load_json(FILES['calendar'])
-        # FAQ 結構不同，通常不直接 merge 進 list，而是獨立讀取，這裡視您的架構而定
-        # 如果您的 bot 是分開讀 FAQ 的，這裡就不用 merge FAQ
-    ]
-
-    updates_count = 0
-    new_entry_count = 0
-
-    for source in new_data_sources:
-        if not isinstance(source, list): continue # 防呆
-
-        for new_item in source:
-            key = new_item.get('url', new_item.get('title'))
-            
-            if key in master_map:
-                # 狀況 A：資料已存在 -> 更新內容，但保留 AI 標籤
-                existing_item = master_map[key]
-                
-                # 保留珍貴的 AI 欄位 (tags, summary, content_enriched)
-                if 'tags' in existing_item: new_item['tags'] = existing_item['tags']
-                if 'summary' in existing_item: new_item['summary'] = existing_item['summary']
-                if 'content_enriched' in existing_item: 
-                    # 這裡有個策略：如果原文變了，enriched 其實要重做。
-                    # 但通常公告不會改原文。我們先假設保留。
-                    new_item['content_enriched'] = existing_item['content_enriched']
-                
-                # 更新 master_map (這樣新的內容會蓋過舊的，但標籤被我們上面那幾行救回來了)
-                master_map[key] = new_item
-                updates_count += 1
-            else:
-                # 狀況 B：新資料 -> 直接加入
-                master_map[key] = new_item
-                new_entry_count += 1
-
-    # 3. 轉回 List 並存檔
-    final_list = list(master_map.values())
-    
-    # 根據日期排序 (新的在上面)
-    # 嘗試解析日期，若無日期則排在最後
-    def sort_key(x):
-        d = x.get('date', '1900/01/01')
-        return d if d else '1900/01/01'
-
-    final_list.sort(key=sort_key, reverse=True)
-
-    with open(FILES['master'], 'w', encoding='utf-8') as f:
-        json.dump(final_list, f, ensure_ascii=False, indent=4)
-
-    print(f"✅ 合併完成！")
-    print(f"   ➕ 新增資料: {new_entry_count} 筆")
-    print(f"   🔄 更新資料: {updates_count} 筆 (保留 AI 標籤)")
-    print(f"   📊 目前總數: {len(final_list)} 筆")
-
-if __name__ == "__main__":
-    merge_data()
+import json
+import os
+import datetime
+from crawl_common import content_fingerprint
+from dedup import deduplicate, carry_over, item_key
+from knowledge_model import load_records, dump_records, to_plain
+
+# 定義檔案路徑
+FILES = {
+    'static': 'nihs_static_data_v43.json',
+    'static_delta': 'nihs_static_delta.json', # 靜態爬蟲輸出的「有變動頁面」，存在時優先使用
+    'dynamic': 'nihs_final_v40.json', # 這是動態爬蟲剛抓下來的"當日增量"
+    'calendar': 'nihs_calendar.json',
+    'faq': 'nihs_faq.json',
+    'master': 'nihs_knowledge_full.json' # 這是我們的主資料庫 (含 AI 標籤)
+}
+
+def load_json(filepath):
+    # 以精簡資料模型 (KnowledgeRecord) 讀取；若檔案不存在回傳空陣列
+    return load_records(filepath)
+
+# 比對「內容是否相同」時忽略的欄位 (爬取時間與 AI 加工欄位)
+VOLATILE_FIELDS = {'crawled_at', 'tags', 'summary', 'content_enriched', 'content_fingerprint'}
+
+def same_item(new_item, existing_item):
+    strip = lambda d: {k: v for k, v in d.items() if k not in VOLATILE_FIELDS}
+    return strip(new_item) == strip(existing_item)
+
+def merge_data():
+    print("🔄 啟動智慧合併 (Smart Merge)...")
+
+    # 1. 讀取主資料庫 (Master DB) - 這是我們的「資產」，裡面有珍貴的 AI 標籤
+    master_data = load_json(FILES['master'])
+    master_snapshot = json.dumps(to_plain(master_data), ensure_ascii=False, sort_keys=True)
+    print(f"   📖 主資料庫現有: {len(master_data)} 筆")
+
+    # 建立一個用 URL 或 Title 當 Key 的字典，方便快速比對
+    # 邏輯：key = url (若無 url 則用 title)
+    master_map = {item.get('url', item.get('title')): item for item in master_data}
+
+    # 2. 讀取新資料 (New Inputs)
+    # 靜態資料：有增量檔就只合併變動頁面，否則讀全檔 (未變動頁面會被指紋比對略過)
+    static_file = FILES['static_delta'] if os.path.exists(FILES['static_delta']) else FILES['static']
+    print(f"   📥 靜態資料來源: {static_file}")
+    new_data_sources = [
+        load_json(static_file),
+        load_json(FILES['dynamic']),
+        load_json(FILES['calendar'])
+        # FAQ 結構不同，通常不直接 merge 進 list，而是獨立讀取，這裡視您的架構而定
+        # 如果您的 bot 是分開讀 FAQ 的，這裡就不用 merge FAQ
+    ]
+
+    updates_count = 0
+    new_keys = set()
+    unchanged_count = 0
+
+    for source in new_data_sources:
+        if not isinstance(source, list): continue # 防呆
+
+        for new_item in source:
+            key = new_item.get('url', new_item.get('title'))
+            
+            if key in master_map:
+                # 狀況 A：資料已存在 -> 更新內容，但保留 AI 標籤
+                existing_item = master_map[key]
+
+                # 有內容指紋的資料 (靜態頁面)：內容沒變就完全不動，保留原本的日期與順序
+                if 'content_fingerprint' in new_item:
+                    old_fp = existing_item.get('content_fingerprint') or content_fingerprint(existing_item)
+                    if old_fp == new_item['content_fingerprint']:
+                        if 'content_fingerprint' not in existing_item:
+                            existing_item['content_fingerprint'] = old_fp
+                            updates_count += 1
+                        else:
+                            unchanged_count += 1
+                        continue
+                    # 內容真的變了：不沿用舊的 AI 標籤，讓 enrich_data.py 重新產生
+                    master_map[key] = carry_over(new_item, existing_item)
+                    updates_count += 1
+                    continue
+
+                # 舊資料若是近似重複群組的代表，先把合併過的附件與分類帶過來再比對
+                carry_over(new_item, existing_item)
+
+                # 其他資料：除了爬取時間外完全相同就略過
+                if same_item(new_item, existing_item):
+                    unchanged_count += 1
+                    continue
+                
+                # 保留珍貴的 AI 欄位 (tags, summary, content_enriched)
+                if 'tags' in existing_item: new_item['tags'] = existing_item['tags']
+                if 'summary' in existing_item: new_item['summary'] = existing_item['summary']
+                if 'content_enriched' in existing_item: 
+                    # 這裡有個策略：如果原文變了，enriched 其實要重做。
+                    # 但通常公告不會改原文。我們先假設保留。
+                    new_item['content_enriched'] = existing_item['content_enriched']
+                
+                # 更新 master_map (這樣新的內容會蓋過舊的，但標籤被我們上面那幾行救回來了)
+                master_map[key] = new_item
+                updates_count += 1
+            else:
+                # 狀況 B：新資料 -> 直接加入 (上次去重併入的複本也會走到這裡，去重後才知道是否真的新增)
+                master_map[key] = new_item
+                new_keys.add(key)
+
+    # 3. 轉回 List 並存檔
+    final_list = list(master_map.values())
+
+    # 近似重複去重：同一則公告在多個頁籤 / 靜態頁面的複本只保留一筆代表資料
+    final_list, dedup_stats = deduplicate(final_list)
+    print(f"   🪞 近似重複: {dedup_stats['clusters']} 群，移除 {dedup_stats['removed']} 筆 "
+          f"(去重率 {dedup_stats['ratio']:.1%}，耗時 {dedup_stats['elapsed_sec']:.2f} 秒)")
+    # 只有去重後仍留著的才算新增；其餘是併入既有資料的複本 (例如其他頁籤的同一則公告)
+    new_entry_count = sum(1 for item in final_list if item_key(item) in new_keys)
+    absorbed_count = len(new_keys) - new_entry_count
+    
+    # 根據日期排序 (新的在上面)
+    # 嘗試解析日期，若無日期則排在最後
+    def sort_key(x):
+        d = x.get('date', '1900/01/01')
+        return d if d else '1900/01/01'
+
+    final_list.sort(key=sort_key, reverse=True)
+
+    # 結果與原本完全相同就不重寫主資料庫，下游 (enrich / bot 重新載入) 也不必重做
+    if json.dumps(to_plain(final_list), ensure_ascii=False, sort_keys=True) == master_snapshot:
+        print(f"✅ 無任何變動 (未變動 {unchanged_count} 筆)，主資料庫保持原樣。")
+        return
+
+    dump_records(final_list, FILES['master'])
+
+    print(f"✅ 合併完成！")
+    print(f"   ➕ 新增資料: {new_entry_count} 筆")
+    if absorbed_count:
+        print(f"   🪞 併入既有資料的複本: {absorbed_count} 筆 (不算新增)")
+    print(f"   🔄 更新資料: {updates_count} 筆 (保留 AI 標籤)")
+    print(f"   💤 內容未變: {unchanged_count} 筆 (略過)")
+    print(f"   📊 目前總數: {len(final_list)} 筆")
+
+if __name__ == "__main__":
+    merge_data()
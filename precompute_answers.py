@@ -0,0 +1,191 @@
+# ====================================================
+# 🌙 熱門問題答案預先生成 (Nightly Precomputed Answers)
+# 每天的管線會更新知識庫，但每個答案仍在使用者提問時才即時生成。
+# 1. 在 enrich_data.py (及詞庫、附件) 之後執行，挑出常見問題：
+#    人工整理的題目 + 熱門問題 (nihs_hot_queries.json；沒有時讀本機的 .query_logs/)
+#    ⚠️ 問答紀錄只存在 bot 主機上：在 GitHub Actions 執行時，必須先在 bot 主機以
+#    `python query_log.py export` 匯出並 commit nihs_hot_queries.json，否則只會預先生成人工題目
+# 2. 以 bot 相同的檢索 + 生成流程產生答案，存成 nihs_precomputed_answers.json，標記資料版本
+#    生成時使用不含「今天日期」的 prompt (答案會重複回覆多天)；仍出現相對日期的答案不採用，
+#    問題本身含相對日期 (明天、下週…) 的也不預先生成
+# 3. 每個答案記錄「依據」(當時用的檢索關鍵字與是否查過行事曆) 的內容雜湊；
+#    依據的資料沒變就沿用舊答案，變了才重新生成 (行事曆依當月內容，換月即重新生成)
+# 4. bot 載入時只採用版本相符的答案表，以正規化後的問題直接回覆 (零 LLM 延遲)
+# 管線中每天都執行 (run_pipeline.py 的 always)，讓月份與答案年齡的檢查天天生效
+# 用法：python precompute_answers.py [--top 30] [--force]
+# ====================================================
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+
+# 預先生成不算使用者提問，不寫入問答紀錄
+os.environ.setdefault("QUERY_LOG", "0")
+
+import query_trace
+from query_log import LOG_DIR, HOT_QUERIES_FILE, HOT_MIN_COUNT, hot_query_counts
+from thesaurus import normalize_query
+
+OUTPUT_FILE = "nihs_precomputed_answers.json"
+TOP_N = 30
+MAX_AGE_DAYS = 7           # 即使依據沒變也定期重新生成 (模型與 prompt 的調整能逐步生效)
+# 意思會隨日期改變的字眼：問題含這些字不預先生成，答案含這些字不採用
+RELATIVE_DATE = re.compile(r"今天|今日|明天|明日|後天|昨天|本週|這週|這禮拜|下週|下禮拜|上週|本月|這個月|下個月|上個月")
+
+# 人工整理的常見問題 (家長與學生最常問的)
+CURATED_QUESTIONS = [
+    "這學期什麼時候開學？",
+    "段考是什麼時候？",
+    "學費可以申請減免嗎？",
+    "有哪些獎學金可以申請？",
+    "學生要怎麼請假？",
+    "想轉學要找哪個單位？",
+    "泡麵在哪裡買？",
+    "社團活動要找誰？",
+    "統測相關資訊在哪裡？",
+    "畢業典禮是哪一天？",
+    "營養午餐怎麼訂？",
+    "制服在哪裡買？",
+]
+
+
+def load_hot_counts(hot_file=HOT_QUERIES_FILE, log_dir=LOG_DIR):
+    """ 熱門問題次數：優先讀匯出檔 (CI 上唯一的來源)，沒有時讀本機紀錄 (在 bot 主機上執行) """
+    if os.path.exists(hot_file):
+        with open(hot_file, "r", encoding="utf-8") as f:
+            return {r["q"]: r["count"] for r in json.load(f).get("queries", [])}, hot_file
+    if os.path.isdir(log_dir):
+        return hot_query_counts(log_dir), log_dir
+    return {}, None
+
+
+def collect_questions(hot_file=HOT_QUERIES_FILE, log_dir=LOG_DIR, top=TOP_N):
+    """ 人工題目優先，再補上最常見、會用到 LLM 的問題；以正規化問題去重 """
+    questions = {normalize_query(q): q for q in CURATED_QUESTIONS}
+    counts, source = load_hot_counts(hot_file, log_dir)
+    if source is None:
+        print(f"⚠️ 沒有 {hot_file} 也沒有 {log_dir}：只預先生成人工整理的題目。")
+    for q, n in sorted(counts.items(), key=lambda x: -x[1]):
+        if len(questions) >= top: break
+        if q and n >= HOT_MIN_COUNT and q not in questions and not RELATIVE_DATE.search(q):
+            questions[q] = q
+    return list(questions.values())
+
+
+def support_hash(brain, question, keyword_sets, calendar):
+    """ 依據的內容雜湊：重新執行相同關鍵字的檢索 (不呼叫 LLM)，連同行事曆背景一起雜湊 """
+    h = hashlib.sha256()
+    for keywords in keyword_sets:
+        h.update(json.dumps(keywords, ensure_ascii=False).encode("utf-8"))
+        for row in brain.search_rows(keywords):
+            # 資料列 id 會隨載入順序改變，只比對內容 (date, unit, title, url, content, attachments)
+            h.update(json.dumps(list(row[:6]), ensure_ascii=False).encode("utf-8"))
+    if calendar:
+        cal_bg, month, _ = brain.get_monthly_calendar(question)
+        h.update(f"{month}|{cal_bg}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def generate(brain, question, failed_replies):
+    """ 以 bot 的完整流程生成一題；回傳 (答案或 None, 依據關鍵字, 是否注入行事曆) """
+    trace = query_trace.Trace(question)
+    with query_trace.activate(trace):
+        answer = brain.answer(question)
+    keyword_sets = [r["keywords"] for r in trace.info.get("retrievals", [])]
+    if answer in failed_replies or not trace.info.get("llm") or RELATIVE_DATE.search(answer):
+        return None, keyword_sets, False
+    return answer, keyword_sets, bool(trace.info.get("calendar_checked"))
+
+
+def load_previous(path, version):
+    """ 上次的答案表；格式版本不同 (例如舊版含今天日期) 就全部重新生成 """
+    if not os.path.exists(path): return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            table = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return table.get("answers", {}) if table.get("version") == version else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以最新資料預先生成熱門問題的答案")
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--top", type=int, default=TOP_N)
+    parser.add_argument("--hot-queries", default=HOT_QUERIES_FILE, help="query_log.py export 匯出的熱門問題")
+    parser.add_argument("--log-dir", default=LOG_DIR, help="沒有匯出檔時讀取的本機問答紀錄")
+    parser.add_argument("--force", action="store_true", help="忽略依據雜湊，全部重新生成")
+    args = parser.parse_args()
+
+    import bot_v5_sqlite_fts as bot
+    brain = bot.get_brain()
+    if brain is None:
+        print("❌ bot 資料載入失敗，略過預先生成。")
+        return
+    # 生成時不能回覆舊的預先生成答案；prompt 不帶今天日期
+    brain.precomputed = {}
+    brain.dated_prompt = False
+    can_generate = bool(bot.GEMINI_API_KEY)
+    if not can_generate:
+        print("⚠️ 未設定 GEMINI_API_KEY：只沿用依據未變的舊答案，不生成新答案。")
+
+    previous = load_previous(args.output, bot.PRECOMPUTED_VERSION)
+    questions = collect_questions(args.hot_queries, args.log_dir, args.top)
+    failed = {bot.BUSY_REPLY, bot.NOT_FOUND_REPLY}
+    now = datetime.now()
+    answers, stats = {}, {"reused": 0, "generated": 0, "skipped": 0, "dropped": 0}
+    start = time.time()
+
+    for question in questions:
+        key = normalize_query(question)
+        if brain.fast_answer(question):
+            stats["skipped"] += 1      # 交通 / 電話 / 行事曆模板本來就不需要 LLM
+            continue
+
+        prev = previous.get(key)
+        if prev and not args.force:
+            fresh = now - datetime.strptime(prev["generated_at"], "%Y-%m-%d %H:%M:%S") < timedelta(days=MAX_AGE_DAYS)
+            if fresh and support_hash(brain, question, prev["keywords"], prev["calendar"]) == prev["support_hash"]:
+                answers[key] = dict(prev, knowledge_version=brain.knowledge_version)
+                stats["reused"] += 1
+                continue
+        if not can_generate:
+            stats["dropped"] += 1
+            continue
+
+        answer, keyword_sets, calendar = generate(brain, question, failed)
+        time.sleep(1)  # 避免觸發 API Rate Limit
+        if answer is None:
+            stats["dropped"] += 1
+            print(f"   ⚠️ 生成失敗、查無資料或含相對日期，不預先生成：{question}")
+            continue
+        answers[key] = {
+            "question": question,
+            "answer": answer,
+            "keywords": keyword_sets,
+            "calendar": calendar,
+            "support_hash": support_hash(brain, question, keyword_sets, calendar),
+            "generated_at": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "knowledge_version": brain.knowledge_version,
+        }
+        stats["generated"] += 1
+        print(f"   ✍️ {question}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": bot.PRECOMPUTED_VERSION,
+            "knowledge_version": brain.knowledge_version,
+            "pipeline": brain.pipeline,
+            "model": bot.MODEL_NAME,
+            "generated_at": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "answers": answers,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"🌙 預先生成完成：{len(answers)} 題 (沿用 {stats['reused']}、新生成 {stats['generated']}、"
+          f"快速路徑略過 {stats['skipped']}、捨棄 {stats['dropped']})，耗時 {time.time() - start:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+# ====================================================
+# 📝 結構化問答紀錄 (Non-Blocking Query Log)
+# bot 從不記錄使用者問了什麼，無法依資料決定快取大小或要新增哪些快速路徑。
+# 1. 請求執行緒只把紀錄丟進有上限的佇列 (滿了就丟棄並計數)，不做任何檔案 I/O
+# 2. 背景執行緒批次寫入 JSONL (每個 gunicorn worker 一個檔，不互相穿插)
+# 3. 依檔案大小或時間輪替，只保留最近 QUERY_LOG_KEEP 個檔
+# 4. 紀錄內容：正規化問題 (不含使用者 id)、路線、檢索到的資料列、各階段耗時、快取命中
+# 報告：python query_log.py report [--dir .query_logs] [--top 20]
+# 匯出熱門問題 (供 GitHub Actions 上的 precompute_answers.py 使用，紀錄只存在 bot 主機上)：
+#   python query_log.py export [--dir .query_logs] [--output nihs_hot_queries.json]，再把匯出檔 commit 進 repo
+# ====================================================
+import argparse
+import atexit
+import glob
+import json
+import os
+import queue
+import statistics
+import threading
+import time
+from datetime import datetime
+from thesaurus import normalize_query
+
+LOG_DIR = os.environ.get("QUERY_LOG_DIR", ".query_logs")
+MAX_BYTES = int(os.environ.get("QUERY_LOG_MAX_BYTES", str(20 * 2**20)))
+MAX_AGE_SEC = int(os.environ.get("QUERY_LOG_MAX_AGE", "86400"))
+KEEP_FILES = int(os.environ.get("QUERY_LOG_KEEP", "30"))
+HOT_QUERIES_FILE = "nihs_hot_queries.json"
+HOT_MIN_COUNT = 3          # 至少被問過幾次才匯出 (少見的問題可能含個人資訊)
+BATCH_SIZE = 200
+FLUSH_INTERVAL = 2.0
+MAX_PENDING = 10000
+
+
+def record_from_trace(trace, **extra):
+    """ 把 query_trace.Trace 轉成一行紀錄 """
+    info = trace.info
+    retrievals = info.get("retrievals", [])
+    return {
+        "ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "q": normalize_query(trace.query),
+        "route": info.get("route", "unknown"),
+        "expansion": info.get("expansion_source"),
+        "cache_hit": info.get("expansion_source") == "cache" or info.get("route") in ("coalesced", "precomputed"),
+        "ids": [i for r in retrievals for i in r.get("ids", [])],
+        "llm_calls": len(info.get("llm", [])),
+        "llm_ms": round(info.get("llm_ms", 0.0), 2),
+        "stages_ms": {k: round(v, 2) for k, v in trace.stages.items()},
+        "total_ms": round(trace.total_ms(), 2),
+        **extra,
+    }
+
+
+class QueryLogWriter:
+    """
+    用法：
+        log = QueryLogWriter()
+        log.log({...})      # 不阻塞
+    """
+
+    def __init__(self, directory=LOG_DIR, max_bytes=MAX_BYTES, max_age=MAX_AGE_SEC, keep=KEEP_FILES,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = keep
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self.counters = {"logged": 0, "written": 0, "dropped": 0, "rotations": 0, "write_errors": 0}
+        self._file = None
+        self._opened_at = 0.0
+        self._thread = threading.Thread(target=self._run, name="query-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, f"queries-{os.getpid()}.jsonl")
+
+    def log(self, record):
+        try:
+            self._queue.put_nowait(record)
+            self.counters["logged"] += 1
+        except queue.Full:
+            self.counters["dropped"] += 1
+
+    # --- 背景寫入 ---
+    def _run(self):
+        while not (self._stop.is_set() and self._queue.empty()):
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        try:
+            self._maybe_rotate()
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+                self._opened_at = time.time()
+            self._file.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch))
+            self._file.flush()
+            self.counters["written"] += len(batch)
+        except (OSError, TypeError, ValueError) as e:
+            self.counters["write_errors"] += 1
+            print(f"⚠️ 問答紀錄寫入失敗: {e}")
+
+    def _maybe_rotate(self):
+        if self._file is None:
+            return
+        too_big = self._file.tell() >= self.max_bytes
+        too_old = time.time() - self._opened_at >= self.max_age
+        if not (too_big or too_old):
+            return
+        self._file.close()
+        self._file = None
+        # 同一秒內可能輪替多次，檔名加上序號避免覆蓋
+        self.counters["rotations"] += 1
+        os.replace(self.path, self.path[:-len(".jsonl")] + f"-{datetime.now():%Y%m%d-%H%M%S}-{self.counters['rotations']:04d}.jsonl")
+        rotated = sorted(glob.glob(os.path.join(self.directory, "queries-*-*.jsonl")), key=os.path.getmtime)
+        for old in rotated[:-self.keep] if self.keep else []:
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+
+    def close(self, timeout=5):
+        """ 結束前把佇列中的紀錄寫完 """
+        self._stop.set()
+        self._thread.join(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# ==========================================
+# 📊 離線報告
+# ==========================================
+def iter_log(directory=LOG_DIR):
+    for path in sorted(glob.glob(os.path.join(directory, "queries-*.jsonl"))):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue    # 寫到一半的最後一行
+
+
+def hot_query_counts(directory=LOG_DIR):
+    """ {正規化問題: 次數}；只算需要 LLM 的問題 (交通、電話等快速路徑本來就不必預先生成) """
+    counts = {}
+    for r in iter_log(directory):
+        if r.get("route") in ("fast_path", None) or not r.get("q"): continue
+        counts[r["q"]] = counts.get(r["q"], 0) + 1
+    return counts
+
+
+def export_hot(directory=LOG_DIR, output=HOT_QUERIES_FILE, top=200, min_count=HOT_MIN_COUNT):
+    counts = hot_query_counts(directory)
+    hot = [{"q": q, "count": n} for q, n in sorted(counts.items(), key=lambda x: -x[1]) if n >= min_count][:top]
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({"generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "queries": hot},
+                  f, ensure_ascii=False, indent=2)
+    print(f"📤 匯出 {len(hot)} 題熱門問題 (至少 {min_count} 次) 到 {output}")
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def report(directory=LOG_DIR, top=20):
+    queries, routes, stages, llm_ms = {}, {}, {}, []
+    total = 0
+    for r in iter_log(directory):
+        total += 1
+        q = queries.setdefault(r.get("q", ""), {"count": 0, "ms": [], "cache_hits": 0, "routes": {}})
+        q["count"] += 1
+        q["ms"].append(r.get("total_ms", 0))
+        q["cache_hits"] += bool(r.get("cache_hit"))
+        q["routes"][r.get("route")] = q["routes"].get(r.get("route"), 0) + 1
+        routes.setdefault(r.get("route", "unknown"), []).append(r.get("total_ms", 0))
+        for name, ms in (r.get("stages_ms") or {}).items():
+            stages.setdefault(name, []).append(ms)
+        if r.get("llm_calls"):
+            llm_ms.append(r.get("llm_ms", 0))
+    if not total:
+        print(f"⚠️ {directory} 沒有問答紀錄。")
+        return
+
+    hot = sorted(queries.items(), key=lambda x: -x[1]["count"])[:top]
+    covered = sum(v["count"] for _, v in hot)
+    print(f"📝 共 {total} 筆紀錄、{len(queries)} 種不同問題；前 {len(hot)} 名佔 {covered / total:.1%} (快取大小參考)")
+    print("🔥 熱門問題：")
+    for q, v in hot:
+        main_route = max(v["routes"].items(), key=lambda x: x[1])[0]
+        print(f"   {v['count']:>6}  {v['count'] / total:>6.1%}  P50 {statistics.median(v['ms']):>8.1f} ms  "
+              f"快取 {v['cache_hits'] / v['count']:>5.0%}  {main_route:<11} {q[:40]}")
+    print("🐢 各路線耗時 (依 P95 排序)：")
+    for route, ms in sorted(routes.items(), key=lambda x: -_pct(x[1], 0.95)):
+        print(f"   {route:<12} {len(ms):>6} 筆  P50 {_pct(ms, 0.5):>8.1f} ms  P95 {_pct(ms, 0.95):>8.1f} ms  最慢 {max(ms):>8.1f} ms")
+    print("⏱️ 各階段平均耗時：")
+    for name, ms in sorted(stages.items(), key=lambda x: -statistics.mean(x[1])):
+        print(f"   {name:<12} {statistics.mean(ms):>8.2f} ms ({len(ms)} 次)")
+    if llm_ms:
+        # 不是獨立階段：已包含在 expansion / generation 內
+        print(f"🤖 LLM 等待 (含於上列階段)：平均 {statistics.mean(llm_ms):.2f} ms，P95 {_pct(llm_ms, 0.95):.1f} ms ({len(llm_ms)} 筆)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="問答紀錄報告：熱門問題與最慢路線；export 匯出熱門問題")
+    parser.add_argument("command", choices=["report", "export"])
+    parser.add_argument("--dir", default=LOG_DIR)
+    parser.add_argument("--top", type=int, default=None, help="report 預設 20 題、export 預設 200 題")
+    parser.add_argument("--output", default=HOT_QUERIES_FILE)
+    parser.add_argument("--min-count", type=int, default=HOT_MIN_COUNT)
+    args = parser.parse_args()
+    if args.command == "export":
+        export_hot(args.dir, args.output, args.top or 200, args.min_count)
+    else:
+        report(args.dir, args.top or 20)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# ====================================================
+# 🔍 問答追蹤 (Query Trace)
+# 記錄一次 brain.ask 走過的路線、各階段耗時與檢索細節：
+# 1. 每個請求都有一份輕量 Trace (只記階段耗時與少量欄位)，放在執行緒區域變數
+# 2. detail=True 時 (/explain) 另外記錄候選資料列分數、行事曆注入列數、prompt token 數
+# 3. stub_llm=True 時不呼叫 Gemini，以固定回應代替 (調校檢索不耗 API 額度)
+# ====================================================
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+class Trace:
+    __slots__ = ("query", "detail", "stub_llm", "stages", "info", "started")
+
+    def __init__(self, query, detail=False, stub_llm=False):
+        self.query = query
+        self.detail = detail
+        self.stub_llm = stub_llm
+        self.stages = {}
+        self.info = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            # 同一階段可能執行多次 (例如補搜)，耗時累加
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t0) * 1000
+
+    def note(self, **info):
+        self.info.update(info)
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self):
+        return {
+            "query": self.query,
+            **self.info,
+            "stages_ms": {k: round(v, 3) for k, v in self.stages.items()},
+            "total_ms": round(self.total_ms(), 3),
+        }
+
+
+def current():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def activate(trace):
+    previous = current()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def stage(name):
+    """ 沒有追蹤中的請求時不做任何事 """
+    trace = current()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def note(**info):
+    trace = current()
+    if trace is not None:
+        trace.info.update(info)
+
+
+def estimate_tokens(text):
+    """ 粗估 token 數：中日韓字元約一字一 token，其餘約 4 字元一 token (不需呼叫 API) """
+    text = str(text or "")
+    cjk = len(_CJK.findall(text))
+    return cjk + -(-(len(text) - cjk) // 4)
@@ -0,0 +1,174 @@
+# ====================================================
+# 🩺 按需效能剖析 (On-Demand Request Profiling)
+# 線上延遲飆高時，無從得知 ask / load_data / search_db 的 CPU 時間與記憶體花在哪裡。
+# 1. 抽樣：PROFILE_SAMPLE_RATE (0~1) 比例的請求自動剖析
+# 2. 指定：帶 X-Profile: 1 與正確 X-Admin-Token (= ADMIN_TOKEN) 的管理請求必定剖析
+# 3. 每次剖析存一份 cProfile 統計 (.prof) 與 tracemalloc 配置差異摘要 (.json)
+#    於環狀目錄 (超過 PROFILE_MAX_SESSIONS 份時刪除最舊的)
+# 4. cProfile / tracemalloc 是全行程共用的，同一時間只剖析一個請求，其餘略過
+# 彙整：python request_profiler.py [--dir .profiles] [--top 20] [--name ask]
+# ====================================================
+import argparse
+import cProfile
+import glob
+import hmac
+import io
+import itertools
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR", ".profiles")
+SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+MAX_SESSIONS = int(os.environ.get("PROFILE_MAX_SESSIONS", "50"))
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+PROFILE_LOAD_DATA = os.environ.get("PROFILE_LOAD_DATA") == "1"   # 啟動時剖析 load_data
+TOP_N = 15
+
+
+class RequestProfiler:
+    """
+    用法：
+        profiler = RequestProfiler()
+        with profiler.profile("ask", enabled=profiler.sampled(), query=q):
+            brain.ask(q)
+    """
+
+    def __init__(self, directory=PROFILE_DIR, sample_rate=SAMPLE_RATE, max_sessions=MAX_SESSIONS,
+                 admin_token=ADMIN_TOKEN):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_sessions = max_sessions
+        self.admin_token = admin_token
+        self._busy = threading.Lock()
+        self._seq = itertools.count()
+        self.counters = {"profiled": 0, "skipped_busy": 0}
+
+    # --- 是否剖析 ---
+    def sampled(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def authorized(self, headers):
+        """ X-Admin-Token 正確 (未設定 ADMIN_TOKEN 時一律拒絕)；/explain?llm=live 也用這個檢查 """
+        if not self.admin_token:
+            return False
+        return hmac.compare_digest(headers.get("X-Admin-Token", ""), self.admin_token)
+
+    def requested(self, headers):
+        """ 管理請求：X-Profile 開啟且 X-Admin-Token 正確 """
+        return headers.get("X-Profile") in ("1", "true") and self.authorized(headers)
+
+    # --- 剖析 ---
+    @contextmanager
+    def profile(self, name, enabled=True, **meta):
+        if not enabled:
+            yield None
+            return
+        if not self._busy.acquire(blocking=False):
+            self.counters["skipped_busy"] += 1
+            yield None
+            return
+        session = {"name": name, "started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), **meta}
+        profile = cProfile.Profile()
+        started_tracing = not tracemalloc.is_tracing()
+        try:
+            if started_tracing: tracemalloc.start()
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+            t0 = time.perf_counter()
+            profile.enable()
+            try:
+                yield session
+            finally:
+                profile.disable()
+                session["wall_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+                after = tracemalloc.take_snapshot()
+                session["peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+                if started_tracing: tracemalloc.stop()
+                self._save(profile, session, before, after)
+        finally:
+            self._busy.release()
+
+    def _save(self, profile, session, before, after):
+        os.makedirs(self.directory, exist_ok=True)
+        # 多個 gunicorn worker 共用目錄，檔名加上 pid 避免衝突
+        stem = os.path.join(self.directory, f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{next(self._seq):04d}-{session['name']}")
+
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        stats.dump_stats(stem + ".prof")
+        session["top_functions"] = [
+            {"function": pstats.func_std_string(func), "calls": nc, "tottime_ms": round(tt * 1000, 3), "cumtime_ms": round(ct * 1000, 3)}
+            for func, (cc, nc, tt, ct, callers) in sorted(stats.stats.items(), key=lambda x: -x[1][3])[:TOP_N]
+        ]
+        diff = after.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)]).compare_to(before, "lineno")
+        session["top_allocations"] = [
+            {"where": str(d.traceback), "size_kb": round(d.size_diff / 1024, 1), "count": d.count_diff}
+            for d in diff[:TOP_N] if d.size_diff > 0
+        ]
+        with open(stem + ".json", "w", encoding="utf-8") as f:
+            json.dump(session, f, ensure_ascii=False, indent=2)
+        self.counters["profiled"] += 1
+        self._trim()
+
+    def _trim(self):
+        """ 環狀目錄：只保留最新的 max_sessions 份 """
+        sessions = sorted(glob.glob(os.path.join(self.directory, "*.json")))
+        for path in sessions[:-self.max_sessions] if self.max_sessions else []:
+            for p in (path, path[:-5] + ".prof"):
+                try:
+                    os.remove(p)
+                except FileNotFoundError:
+                    pass    # 其他 worker 已經刪掉
+
+
+# ==========================================
+# 📊 彙整 CLI
+# ==========================================
+def aggregate(directory=PROFILE_DIR, name=None, top=20, sort="cumulative"):
+    pattern = f"*-{name}.prof" if name else "*.prof"
+    files = sorted(glob.glob(os.path.join(directory, pattern)))
+    if not files:
+        print(f"⚠️ {directory} 沒有符合的剖析檔。")
+        return
+    out = io.StringIO()
+    stats = pstats.Stats(*files, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+    walls, allocations = [], {}
+    for path in files:
+        meta_path = path[:-5] + ".json"
+        if not os.path.exists(meta_path): continue
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        walls.append(meta.get("wall_ms", 0))
+        for a in meta.get("top_allocations", []):
+            allocations[a["where"]] = allocations.get(a["where"], 0) + a["size_kb"]
+
+    print(f"🩺 {len(files)} 份剖析 ({name or '全部'})，平均耗時 {sum(walls) / max(len(walls), 1):.1f} ms，"
+          f"最慢 {max(walls, default=0):.1f} ms")
+    print(f"🔥 熱點函式 (依 {sort} 排序，前 {top} 名)：")
+    print(out.getvalue())
+    if allocations:
+        print("🧠 記憶體配置熱點 (累計增加 KB)：")
+        for where, kb in sorted(allocations.items(), key=lambda x: -x[1])[:top]:
+            print(f"   {kb:>10.1f} KB  {where}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="彙整 bot 的剖析結果，列出熱點函式與記憶體配置")
+    parser.add_argument("--dir", default=PROFILE_DIR)
+    parser.add_argument("--name", help="只看某種剖析 (ask / load_data / explain)")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--sort", default="cumulative", choices=["cumulative", "tottime", "calls"])
+    args = parser.parse_args()
+    aggregate(args.dir, args.name, args.top, args.sort)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# ====================================================
+# 🚦 請求排程器 (Priority Scheduler + Backpressure)
+# 原本每則訊息直接在 webhook 執行緒呼叫 brain.ask：一位使用者連貼十個問題就能佔滿所有 worker，
+# 問學校電話的家長只能排在後面。
+# 1. 快速路徑：不需 LLM 的回覆 (交通、電話、行事曆模板、預先生成的答案) 不排隊，直接回覆
+# 2. 需要 LLM 的請求進入有上限的優先佇列，由固定數量的 worker 執行緒處理
+# 3. 每位使用者一個 token bucket：額度用完的請求仍會處理，但優先權降到最低 (公平性)
+# 4. 過載 (佇列已滿或等候逾時) 時立即回覆降級答案 (只列相關公告連結)，不讓 LINE 逾時
+#    webhook 用 submit_async：快速路徑當場回覆，需要 LLM 的請求在背景等結果，webhook 執行緒立即返回
+# 5. 請求合併 (single-flight)：進佇列之前先 brain.open_flight(q) (正規化問題 + 資料版本)，
+#    同一問題正在排隊或計算中時，後到者直接等它的結果，不佔佇列位置也不扣額度；
+#    合併表在 brain 內，/explain、預先生成與直接呼叫 brain.ask 的相同問題也會合併
+# ====================================================
+import heapq
+import itertools
+import os
+import threading
+import time
+
+WORKERS = int(os.environ.get("SCHED_WORKERS", "4"))
+MAX_QUEUE = int(os.environ.get("SCHED_MAX_QUEUE", "32"))
+USER_RATE = float(os.environ.get("SCHED_USER_RATE", "0.2"))      # 每秒補充幾個額度 (0.2 = 每 5 秒一題)
+USER_BURST = float(os.environ.get("SCHED_USER_BURST", "3"))      # 連續提問的額度上限
+WAIT_TIMEOUT = float(os.environ.get("SCHED_TIMEOUT", "25"))      # LINE reply token 約一分鐘失效，保留餘裕
+MAX_BUCKETS = 10000
+
+PRIORITY_NORMAL = 0
+PRIORITY_OVER_QUOTA = 1
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate=USER_RATE, burst=USER_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def idle(self, now):
+        """ 額度已補滿 (可以丟掉，下次重建結果相同) """
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class _Job:
+    __slots__ = ("query", "flight", "done", "result", "cancelled")
+
+    def __init__(self, query, flight=None):
+        self.query = query
+        self.flight = flight
+        self.done = threading.Event()
+        self.result = None
+        self.cancelled = False
+
+
+class RequestScheduler:
+    """
+    用法：
+        scheduler = RequestScheduler(brain)
+        reply = scheduler.submit(user_id, "段考是幾號？")
+        scheduler.submit_async(user_id, "段考是幾號？", deliver)   # 不阻塞，結果交給 deliver(reply)
+    brain 需提供 try_fast_path(q)、ask(q, flight=, fast_path=)、degraded_answer(q)、log_coalesced(q, started)
+    以及請求合併的 open_flight(q)、leave_flight(f)、abandon_flight(f)、finish_flight(f, result)
+    """
+
+    def __init__(self, brain, workers=WORKERS, max_queue=MAX_QUEUE, timeout=WAIT_TIMEOUT,
+                 user_rate=USER_RATE, user_burst=USER_BURST):
+        self.brain = brain
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = {"fast_path": 0, "queued": 0, "coalesced": 0, "completed": 0, "over_quota": 0,
+                         "rejected_full": 0, "timed_out": 0, "errors": 0}
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"scheduler-{i}", daemon=True).start()
+
+    # --- 使用者額度 ---
+    def _take(self, user_id):
+        """ 扣一個額度；回傳是否仍在額度內 """
+        with self._buckets_lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                if len(self._buckets) >= MAX_BUCKETS:
+                    now = time.monotonic()
+                    for uid in [u for u, b in self._buckets.items() if b.idle(now)]:
+                        del self._buckets[uid]
+                bucket = self._buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            return bucket.take()
+
+    def _count(self, name):
+        with self._cond:
+            self.counters[name] += 1
+
+    # --- 對外介面 ---
+    def submit(self, user_id, query):
+        fast = self.brain.try_fast_path(query)
+        if fast:
+            self._count("fast_path")
+            return fast
+        return self._schedule(user_id, query)
+
+    def submit_async(self, user_id, query, deliver):
+        """
+        不阻塞呼叫端 (webhook 執行緒)：快速路徑直接在呼叫端 deliver(reply)，
+        需要 LLM 的請求由背景執行緒等結果 (排隊、合併與逾時規則同 submit) 後 deliver
+        """
+        fast = self.brain.try_fast_path(query)
+        if fast:
+            self._count("fast_path")
+            deliver(fast)
+            return
+        threading.Thread(target=self._deliver_later, args=(user_id, query, deliver),
+                         name="scheduler-reply", daemon=True).start()
+
+    def _deliver_later(self, user_id, query, deliver):
+        try:
+            deliver(self._schedule(user_id, query))
+        except Exception as e:
+            # webhook 早已回應，失敗只能記錄
+            print(f"⚠️ 背景回覆失敗: {e}")
+
+    def _schedule(self, user_id, query):
+        """ 已確認不走快速路徑：合併、排隊並等候結果 (逾時回覆降級答案) """
+        started = time.perf_counter()
+        flight, leader = self.brain.open_flight(query)
+        if not leader:
+            # 同一問題已在排隊或計算中：跟著等結果
+            self._count("coalesced")
+            if not flight.done.wait(self.timeout):
+                self.brain.leave_flight(flight)
+                self._count("timed_out")
+                return self.brain.degraded_answer(query)
+            if flight.error is not None or flight.result is None:
+                return self.brain.degraded_answer(query)
+            self.brain.log_coalesced(query, started)
+            return flight.result
+
+        job = None
+        with self._cond:
+            if len(self._heap) >= self.max_queue:
+                self.counters["rejected_full"] += 1
+            else:
+                in_quota = self._take(user_id)
+                job = _Job(query, flight)
+                heapq.heappush(self._heap, (PRIORITY_NORMAL if in_quota else PRIORITY_OVER_QUOTA, next(self._seq), job))
+                self.counters["queued"] += 1
+                if not in_quota: self.counters["over_quota"] += 1
+                self._cond.notify()
+        if job is None:
+            reply = self.brain.degraded_answer(query)
+            # 這段期間跟上的相同問題一起收到降級答案
+            self.brain.finish_flight(flight, reply)
+            return reply
+
+        if not job.done.wait(self.timeout):
+            # 最後一位等待者放棄時才撤銷：已開始執行的工作仍會完成 (結果丟棄)，還在佇列中的會被 worker 略過
+            if flight is not None:
+                self.brain.leave_flight(flight)
+            else:
+                job.cancelled = True
+            self._count("timed_out")
+            return self.brain.degraded_answer(query)
+        return job.result
+
+    def _abandoned(self, job):
+        if job.flight is not None:
+            return self.brain.abandon_flight(job.flight)
+        return job.cancelled
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+            if self._abandoned(job): continue
+            with self._cond:
+                self.in_flight += 1
+            try:
+                # 快速路徑已在 submit 時檢查過
+                job.result = self.brain.ask(job.query, flight=job.flight, fast_path=False)
+                self._count("completed")
+            except Exception as e:
+                print(f"⚠️ 排程工作失敗: {e}")
+                job.result = self.brain.degraded_answer(job.query)
+                self._count("errors")
+            finally:
+                with self._cond:
+                    self.in_flight -= 1
+                # ask 失敗時 flight 已帶著錯誤結束 (跟上的請求改回降級答案)；這裡只補上沒結束的情況
+                if job.flight is not None and not job.flight.done.is_set():
+                    self.brain.finish_flight(job.flight, job.result)
+                job.done.set()
+
+    def stats(self):
+        with self._cond:
+            return dict(self.counters, queue_depth=len(self._heap), in_flight=self.in_flight,
+                        coalescing=len(self.brain.flights))
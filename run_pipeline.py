@@ -0,0 +1,284 @@
+# ====================================================
+# 🏭 每日資料管線執行器 (Pipeline Runner)
+# 取代 daily_crawl.yml 裡寫死順序的 shell 腳本：
+# 1. 每個階段宣告輸入 / 輸出檔與前置階段
+# 2. 類似 make：輸入檔內容雜湊沒變且輸出存在，就跳過該階段
+# 3. 互不相依的階段平行執行 (例如 FAQ 與行事曆)
+# 4. 每個階段的耗時與狀態寫入 JSON 執行報告
+# 用法：python run_pipeline.py [--skip static_crawl] [--only faq,calendar] [--force] [--jobs 3]
+# ====================================================
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(BASE_DIR, ".pipeline_state.json")
+REPORT_FILE = os.path.join(BASE_DIR, "pipeline_report.json")
+
+# ==========================================
+# 📋 階段定義
+# script: 要執行的腳本；inputs / outputs: 檔案 (腳本本身自動算入輸入)
+# after: 必須先完成的階段；always: 依賴外部網站或今天日期，每次都執行
+# lock: 同一個 lock 的階段不會同時執行 (避免同時對學校網站發請求)
+# ==========================================
+STAGES = [
+    {
+        "name": "static_crawl",
+        "script": "static_crawler_v43_recursive.py",
+        "inputs": [],
+        "outputs": ["nihs_static_data_v43.json"],
+        "after": [],
+        "always": True,
+        "lock": "school_site",
+    },
+    {
+        "name": "dynamic_crawl",
+        "script": "ultimate_bot_builder_v40_printHere.py",
+        "inputs": [],
+        "outputs": ["nihs_final_v40.json"],
+        "after": [],
+        "always": True,
+        "lock": "school_site",
+    },
+    {
+        "name": "faq",
+        "script": "generate_faq.py",
+        "inputs": ["nihs_knowledge_full.json"],
+        "outputs": ["nihs_faq.json", "nihs_faq_index.json"],
+        "after": [],
+    },
+    {
+        # 行事曆 PDF 來自學校網站；下載時以 304 / SHA 比對，PDF 沒變會直接沿用快取
+        "name": "calendar",
+        "script": "generate_calendar.py",
+        "inputs": ["nihs_knowledge_full.json"],
+        "outputs": ["nihs_calendar.json"],
+        "after": [],
+        "always": True,
+    },
+    {
+        "name": "merge",
+        "script": "merge_data.py",
+        "inputs": ["nihs_static_data_v43.json", "nihs_static_delta.json", "nihs_final_v40.json", "nihs_calendar.json"],
+        "outputs": ["nihs_knowledge_full.json"],
+        # faq / calendar 讀取的是合併前的主資料庫，合併必須等它們讀完
+        "after": ["static_crawl", "dynamic_crawl", "faq", "calendar"],
+    },
+    {
+        "name": "enrich",
+        "script": "enrich_data.py",
+        "inputs": ["nihs_knowledge_full.json"],
+        "outputs": ["nihs_knowledge_full.json"],
+        "after": ["merge"],
+    },
+    {
+        "name": "chunks",
+        "script": "build_chunks.py",
+        "inputs": ["nihs_knowledge_full.json"],
+        "outputs": ["nihs_chunks.bin"],
+        # enrich 會改寫主資料庫，等它寫完再讀，避免讀到寫一半的檔案
+        # 分段庫尚無讀取端，輸出不 commit (見 .gitignore)
+        "after": ["enrich"],
+    },
+    {
+        "name": "thesaurus",
+        "script": "thesaurus.py",
+        "inputs": ["nihs_knowledge_full.json"],
+        "outputs": ["nihs_thesaurus.json"],
+        # 詞庫來自 enrich 產生的 tags
+        "after": ["enrich"],
+    },
+    {
+        # 附件依賴外部網站，但只會下載新網址；主資料庫沒變時整個階段跳過
+        "name": "attachments",
+        "script": "extract_attachments.py",
+        "inputs": ["nihs_knowledge_full.json"],
+        "outputs": ["nihs_attachment_text.json"],
+        "after": ["enrich"],
+        "lock": "school_site",
+    },
+    {
+        # 以 bot 的完整檢索 + 生成流程預先產生熱門問題的答案；依據的資料沒變的答案直接沿用
+        # 每天執行：行事曆背景依當月內容、答案有年齡上限，輸入沒變也可能需要重新生成
+        "name": "precompute",
+        "script": "precompute_answers.py",
+        "inputs": ["nihs_knowledge_full.json", "nihs_attachment_text.json", "nihs_faq.json",
+                   "nihs_calendar.json", "nihs_thesaurus.json", "nihs_hot_queries.json"],
+        "outputs": ["nihs_precomputed_answers.json"],
+        "after": ["enrich", "thesaurus", "attachments"],
+        "always": True,
+    },
+]
+
+
+def file_hash(path):
+    """ 檔案內容 SHA-256；檔案不存在回傳 None """
+    full = os.path.join(BASE_DIR, path)
+    if not os.path.exists(full):
+        return None
+    digest = hashlib.sha256()
+    with open(full, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def input_hashes(stage):
+    return {path: file_hash(path) for path in [stage["script"]] + stage["inputs"]}
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def save_state(state):
+    with open(STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+
+
+def up_to_date(stage, state):
+    """ 判斷是否可跳過：非外部階段、輸出都存在、且輸入雜湊與上次成功執行後相同 """
+    if stage.get("always"):
+        return False, "外部資料來源或與日期相關，每次執行"
+    missing = [p for p in stage["outputs"] if not os.path.exists(os.path.join(BASE_DIR, p))]
+    if missing:
+        return False, f"缺少輸出 {missing}"
+    previous = state.get(stage["name"], {}).get("inputs")
+    if previous != input_hashes(stage):
+        return False, "輸入已變動"
+    return True, "輸入未變動"
+
+
+class PipelineRunner:
+    def __init__(self, stages, jobs=3, force=False, skip=(), dry_run=False):
+        self.stages = {s["name"]: s for s in stages}
+        self.order = [s["name"] for s in stages]
+        self.jobs = jobs
+        self.force = force
+        self.skip = set(skip)
+        self.dry_run = dry_run
+        self.state = load_state()
+        self.results = {}
+        self.locks = {}
+        self.print_lock = threading.Lock()
+
+    def _run_stage(self, name):
+        stage = self.stages[name]
+        started = time.monotonic()
+        result = {"started_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
+        if name in self.skip:
+            result.update(status="skipped", reason="使用者指定跳過")
+        else:
+            fresh, reason = up_to_date(stage, self.state)
+            if fresh and not self.force:
+                result.update(status="up-to-date", reason=reason)
+            elif self.dry_run:
+                result.update(status="would-run", reason=reason)
+            else:
+                lock = self.locks.setdefault(stage["lock"], threading.Lock()) if stage.get("lock") else None
+                if lock: lock.acquire()
+                try:
+                    proc = subprocess.run(
+                        [sys.executable, stage["script"]], cwd=BASE_DIR,
+                        capture_output=True, text=True, encoding="utf-8", errors="replace",
+                    )
+                finally:
+                    if lock: lock.release()
+                result.update(status="ok" if proc.returncode == 0 else "failed",
+                              returncode=proc.returncode, reason=reason)
+                with self.print_lock:
+                    print(f"\n----- [{name}] 輸出 -----")
+                    print(proc.stdout.rstrip())
+                    if proc.stderr.strip():
+                        print(proc.stderr.rstrip())
+                if proc.returncode == 0:
+                    # 記錄「執行後」的輸入雜湊，輸出檔同時也是輸入檔時下次才不會誤判為變動
+                    self.state[name] = {"inputs": input_hashes(stage), "finished_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
+        result["elapsed_sec"] = round(time.monotonic() - started, 2)
+        icon = {"ok": "✅", "failed": "❌", "skipped": "⏭️", "up-to-date": "💤", "would-run": "📝"}[result["status"]]
+        with self.print_lock:
+            print(f"{icon} [{name}] {result['status']} ({result['elapsed_sec']}s) - {result.get('reason', '')}")
+        return result
+
+    def run(self):
+        """ 依相依關係排程：前置階段都結束 (不論成敗，與舊腳本的 || echo 相同) 就可開始 """
+        started = time.monotonic()
+        started_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        pending = list(self.order)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending or running:
+                for name in list(pending):
+                    if all(dep in self.results for dep in self.stages[name]["after"]):
+                        pending.remove(name)
+                        running[pool.submit(self._run_stage, name)] = name
+                if not running:
+                    raise RuntimeError(f"相依關係無法滿足: {pending}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        self.results[name] = {"status": "failed", "reason": str(e), "elapsed_sec": 0}
+
+        if not self.dry_run:
+            save_state(self.state)
+        report = {
+            "started_at": started_at,
+            "elapsed_sec": round(time.monotonic() - started, 2),
+            "stages": {name: self.results[name] for name in self.order},
+        }
+        with open(REPORT_FILE, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="依相依關係執行每日資料管線")
+    parser.add_argument("--skip", default="", help="要跳過的階段，逗號分隔 (例如 static_crawl)")
+    parser.add_argument("--only", default="", help="只執行這些階段，逗號分隔")
+    parser.add_argument("--force", action="store_true", help="忽略雜湊檢查，全部重跑")
+    parser.add_argument("--jobs", type=int, default=3, help="最多同時執行幾個階段")
+    parser.add_argument("--dry-run", action="store_true", help="只列出會執行的階段")
+    parser.add_argument("--strict", action="store_true", help="有階段失敗時以非零狀態結束")
+    args = parser.parse_args()
+
+    names = [s["name"] for s in STAGES]
+    skip = [n for n in args.skip.split(",") if n]
+    if args.only:
+        only = set(n for n in args.only.split(",") if n)
+        skip += [n for n in names if n not in only]
+    unknown = [n for n in skip if n not in names]
+    if unknown:
+        parser.error(f"未知的階段: {unknown} (可用: {names})")
+
+    print(f"🏭 管線啟動：{len(STAGES)} 個階段，最多 {args.jobs} 個平行")
+    report = PipelineRunner(STAGES, jobs=args.jobs, force=args.force, skip=skip, dry_run=args.dry_run).run()
+
+    print("\n" + "=" * 30)
+    for name, r in report["stages"].items():
+        print(f"   {name:<14} {r['status']:<11} {r['elapsed_sec']:>7}s")
+    print(f"⏱️ 總耗時 {report['elapsed_sec']} 秒，報告: {os.path.basename(REPORT_FILE)}")
+
+    if args.strict and any(r["status"] == "failed" for r in report["stages"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# ====================================================
+# ⏱️ 冷啟動時間報告 (Startup-Time Report)
+# 在全新的子行程 import bot_v5_sqlite_fts (python -X importtime)，記錄：
+# 1. 模組 import 耗時 (不含背景載入的大腦) 與 import 時間最多的套件
+# 2. 大腦 (load_data) 載入耗時、可開始服務 (/ready) 的時間
+# 3. 延遲載入的 Gemini / LINE SDK 在第一次使用時的 import 耗時
+# 輸出 JSON 供 CI 追蹤；超過 --budget-sec 時以非零結束碼結束
+# 用法：python startup_report.py [--runs 3] [--output startup_report.json] [--budget-sec 10]
+# ====================================================
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+BOT_MODULE = "bot_v5_sqlite_fts"
+MARKER = "__STARTUP__"
+PROBE = (
+    "import json, {mod} as bot\n"
+    "bot.get_brain()\n"
+    "bot.get_genai(); bot.get_line()\n"
+    "print({marker!r} + json.dumps(bot.STARTUP))\n"
+)
+
+
+def parse_importtime(stderr):
+    """ 取出最上層 import 的累計耗時 (微秒)，同一個頂層套件合併 """
+    totals = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line: continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit(): continue
+        name = parts[2].rstrip()
+        if name.startswith(" " * 3):    # 巢狀 import 已含在上層的累計時間裡
+            continue
+        top = name.strip().split(".")[0]
+        totals[top] = totals.get(top, 0) + int(parts[1])
+    return totals
+
+
+def run_once(python, cwd):
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run([python, "-X", "importtime", "-c", PROBE.format(mod=BOT_MODULE, marker=MARKER)],
+                          cwd=cwd, env=env, capture_output=True, text=True, timeout=600)
+    line = next((l for l in proc.stdout.splitlines() if l.startswith(MARKER)), None)
+    if proc.returncode != 0 or line is None:
+        raise RuntimeError(f"啟動失敗 (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+    return json.loads(line[len(MARKER):]), parse_importtime(proc.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="量測 bot 冷啟動時間 (import 細項 + 資料載入)")
+    parser.add_argument("--runs", type=int, default=3, help="重複次數，取中位數")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", default="startup_report.json")
+    parser.add_argument("--budget-sec", type=float, default=0, help="ready_sec 超過此值即失敗 (0 = 不檢查)")
+    args = parser.parse_args()
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings, imports = [], {}
+    for _ in range(args.runs):
+        startup, totals = run_once(sys.executable, cwd)
+        timings.append(startup)
+        for name, us in totals.items():
+            imports.setdefault(name, []).append(us)
+
+    summary = {k: round(statistics.median(t[k] for t in timings if k in t), 3)
+               for k in sorted({k for t in timings for k in t})}
+    top = sorted(((n, statistics.median(v)) for n, v in imports.items()), key=lambda x: -x[1])[:args.top]
+    report = {
+        "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "runs": args.runs,
+        **summary,
+        "top_imports_ms": [{"module": n, "cumulative_ms": round(us / 1000, 1)} for n, us in top],
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print(f"⏱️ 冷啟動 (中位數，{args.runs} 次)：")
+    for key, value in summary.items():
+        print(f"   {key:<20} {value:.3f}s")
+    print("   import 耗時前幾名：")
+    for item in report["top_imports_ms"]:
+        print(f"     {item['module']:<24} {item['cumulative_ms']:>8.1f} ms")
+    print(f"📄 報告已寫入 {args.output}")
+
+    if args.budget_sec and summary.get("ready_sec", 0) > args.budget_sec:
+        print(f"❌ ready_sec {summary['ready_sec']:.3f}s 超過預算 {args.budget_sec}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
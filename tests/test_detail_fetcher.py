@@ -0,0 +1,112 @@
+# ====================================================
+# 🧪 DetailFetcher 測試 (HTTP 直連模式)
+# 以 http.server 在隨機埠提供 tests/fixtures/detail/ 下存檔的公告頁，
+# 實際走 aiohttp 抓取 + BeautifulSoup 解析，驗證內文、Permalink、附件與各種回退情況
+# 執行：python -m pytest tests (或 python -m unittest discover tests)
+# ====================================================
+import asyncio
+import functools
+import os
+import threading
+import time
+import unittest
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from crawl_common import HostRateLimiter
+from detail_fetcher import DetailFetcher, derive_permalink, permalink_prefixes
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "detail")
+PERMALINK = ("https://www.nihs.tp.edu.tw/nss/main/freeze/5a9759adef37531ea27bf1b0/LjC8M1F5035/"
+             "64def78f9ef5e565b1348c2d?vector=private&static=false")
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class DetailFetcherTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        handler = functools.partial(_QuietHandler, directory=FIXTURE_DIR)
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        cls.base = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def fetch_many(self, names, **kwargs):
+        urls = [f"{self.base}/{name}" for name in names]
+
+        async def run():
+            async with DetailFetcher(**kwargs) as fetcher:
+                return await fetcher.fetch_many(urls), fetcher
+
+        results, fetcher = asyncio.run(run())
+        return [results[u] for u in urls], fetcher
+
+    def test_announcement_body_permalink_and_attachments(self):
+        (data,), fetcher = self.fetch_many(["announcement.html"])
+        self.assertEqual(fetcher.requests, 1)
+        # 與 extract_details 相同：mailto 中的網址取到第一個 & 為止
+        self.assertEqual(data["real_url"], PERMALINK.split("&")[0])
+        self.assertEqual(data["body"], "一、申請期間：即日起至10月31日止。\n二、請檢附成績單與申請表，送至學務處生輔組。")
+        # #printHere 與 modal 內重複的附件只留一次，一般連結不算附件
+        self.assertEqual(data["attachments"], [
+            {"name": "申請表", "url": "https://www.nihs.tp.edu.tw/nss/main/feeder/5a9759adef37531ea27bf1b0/LjC8M1F5035/att-1"},
+            {"name": "獎學金辦法.pdf", "url": "https://www.nihs.tp.edu.tw/uploads/scholarship_rules.pdf"},
+            {"name": "家長通知單", "url": "https://www.nihs.tp.edu.tw/files/notice.doc"},
+        ])
+
+    def test_legacy_page_uses_modal_body(self):
+        (data,), _ = self.fetch_many(["legacy_modal_body.html"])
+        self.assertEqual(data["body"], "本週五第七節全校大掃除。\n請各班衛生股長至總務處領取清潔用具。")
+        self.assertEqual(data["attachments"], [])
+        self.assertEqual(data["real_url"], f"{self.base}/legacy_modal_body.html")
+
+    def test_page_without_body_triggers_modal_fallback(self):
+        # 爬蟲以 body 為空判斷要回退點擊視窗
+        (data,), _ = self.fetch_many(["no_body.html"])
+        self.assertIsNotNone(data)
+        self.assertEqual(data["body"], "")
+        self.assertEqual(data["attachments"], [])
+
+    def test_missing_page_returns_none(self):
+        (missing, found), _ = self.fetch_many(["does_not_exist.html", "announcement.html"])
+        self.assertIsNone(missing)
+        self.assertTrue(found["body"])
+
+    def test_requests_respect_host_interval(self):
+        limiter = HostRateLimiter(max_concurrency=4, min_interval=0.1)
+        started = time.monotonic()
+        results, fetcher = self.fetch_many(["announcement.html", "legacy_modal_body.html", "no_body.html"],
+                                           limiter=limiter)
+        # 三個請求同一主機：至少間隔兩次 min_interval
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        self.assertEqual(fetcher.requests, 3)
+        self.assertTrue(all(r is not None for r in results))
+
+
+class DerivePermalinkTest(unittest.TestCase):
+
+    def test_freeze_url_in_attributes(self):
+        attrs = ["#", "openDetail('/nss/main/freeze/5a9759adef37531ea27bf1b0/LjC8M1F5035/64def78f9ef5e565b1348c2d')"]
+        self.assertEqual(derive_permalink(attrs), PERMALINK)
+
+    def test_announcement_id_with_known_prefix(self):
+        prefixes = permalink_prefixes([{"category": "學務處", "url": PERMALINK}])
+        attrs = ["javascript:void(0)", "68b7f8402739867e175bfe7d"]
+        self.assertEqual(derive_permalink(attrs, prefixes["學務處"]), PERMALINK.replace(
+            "64def78f9ef5e565b1348c2d", "68b7f8402739867e175bfe7d"))
+
+    def test_no_id_returns_none(self):
+        self.assertIsNone(derive_permalink(["#", "javascript:void(0)"], "/nss/main/freeze/x/y/"))
+        self.assertIsNone(derive_permalink(["68b7f8402739867e175bfe7d"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+# ====================================================
+# 🧪 附件文字抽取測試 (舊版 OLE 格式)
+# tests/fixtures/attachments/ 下的 legacy.doc (Word 97，含 UTF-16 與壓縮片段、功能變數)
+# 與 legacy.xls (Excel 97，兩個工作表)，驗證檔頭判斷與文字抽取
+# 執行：python -m pytest tests (或 python -m unittest discover tests)
+# ====================================================
+import os
+import unittest
+
+from extract_attachments import extract_file, sniff_kind, to_segments
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "attachments")
+
+
+def fixture(name):
+    return os.path.join(FIXTURE_DIR, name)
+
+
+class LegacyOfficeTest(unittest.TestCase):
+
+    def test_sniff_ole_streams(self):
+        self.assertEqual(sniff_kind(fixture("legacy.doc")), "doc")
+        self.assertEqual(sniff_kind(fixture("legacy.xls")), "xls")
+
+    def test_doc_piece_table(self):
+        result = extract_file((fixture("legacy.doc"), "doc"))
+        self.assertIsNone(result["error"])
+        # 功能變數只留顯示文字，表格儲存格標記轉成 tab，壓縮 (cp1252) 片段也要讀到
+        self.assertEqual(result["pages"], ["家長通知單", "一、本週五停課。\t學校網站", "Room 101"])
+
+    def test_xls_sheets(self):
+        result = extract_file((fixture("legacy.xls"), "xls"))
+        self.assertIsNone(result["error"])
+        self.assertEqual(result["pages"], [
+            "班級\t姓名\t項目\n301\t王小明\t大隊接力\n302\t李小華\t拔河",
+            "報名截止：10月31日\n2",
+        ])
+        self.assertEqual(len(to_segments(result["pages"])), 1)
+
+    def test_corrupt_doc_reports_error(self):
+        result = extract_file((fixture("legacy.xls"), "doc"))
+        self.assertEqual(result["pages"], [])
+        self.assertTrue(result["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
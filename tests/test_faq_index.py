@@ -0,0 +1,51 @@
+# ====================================================
+# 🧪 FAQ 關鍵字倒排索引測試
+# 驗證互相重疊 / 互為前綴的關鍵字都會命中，以及索引檔的增量更新
+# 執行：python -m pytest tests (或 python -m unittest discover tests)
+# ====================================================
+import unittest
+
+from generate_faq import select_candidates, update_keyword_index
+
+KEYWORDS = ["主任", "主任教官", "任教", "分機", "總機"]
+
+
+class KeywordIndexTest(unittest.TestCase):
+
+    def test_overlapping_and_prefix_keywords_all_hit(self):
+        # 「主任教官」同時包含「主任」(前綴) 與「任教」(重疊)；正規式交替只會取到最左邊的一個
+        texts = {"a": "主任教官：王老師", "b": "總機轉分機 123", "c": "本週無活動"}
+        index_data, rescanned = update_keyword_index(texts, KEYWORDS)
+        index = index_data["index"]
+        self.assertEqual(rescanned, 3)
+        self.assertEqual(index["主任"], ["a"])
+        self.assertEqual(index["主任教官"], ["a"])
+        self.assertEqual(index["任教"], ["a"])
+        self.assertEqual(index["分機"], ["b"])
+        self.assertEqual(index["總機"], ["b"])
+        self.assertEqual(select_candidates(index, ["任教"], list(texts)), ["a"])
+        self.assertEqual(select_candidates(index, KEYWORDS, ["c", "b", "a"]), ["b", "a"])
+
+    def test_incremental_update_only_rescans_changed_records(self):
+        texts = {"a": "教務主任 分機 311", "b": "捷運港墘站", "c": "總機"}
+        first, _ = update_keyword_index(texts, KEYWORDS)
+
+        # b 內容改變、c 刪除、d 新增；a 沿用舊結果
+        texts = {"a": "教務主任 分機 311", "b": "學務主任", "d": "校安分機"}
+        second, rescanned = update_keyword_index(texts, KEYWORDS, first)
+        self.assertEqual(rescanned, 2)
+        self.assertEqual(sorted(second["index"]["主任"]), ["a", "b"])
+        self.assertEqual(sorted(second["index"]["分機"]), ["a", "d"])
+        self.assertEqual(second["index"]["總機"], [])
+        self.assertEqual(set(second["hashes"]), {"a", "b", "d"})
+
+    def test_keyword_change_rebuilds_index(self):
+        texts = {"a": "地址：內湖路一段520號"}
+        first, _ = update_keyword_index(texts, KEYWORDS)
+        second, rescanned = update_keyword_index(texts, KEYWORDS + ["地址"], first)
+        self.assertEqual(rescanned, 1)
+        self.assertEqual(second["index"]["地址"], ["a"])
+
+
+if __name__ == "__main__":
+    unittest.main()
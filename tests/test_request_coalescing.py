@@ -0,0 +1,136 @@
+# ====================================================
+# 🧪 請求合併 (single-flight) 測試
+# 同一問題同時湧入 (措辭略有不同)：brain.ask 直接呼叫或經過排程器，都只呼叫 LLM 一輪
+# (擴展 + 回答 = 2 次)；另驗證 webhook 用的 submit_async 不等 LLM、快速路徑只檢查一次
+# Gemini 以固定延遲的模擬回應代替
+# 執行：python -m pytest tests (或 python -m unittest discover tests)
+# ====================================================
+import json
+import os
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+os.environ.setdefault("QUERY_LOG", "0")
+import bot_v5_sqlite_fts as bot
+from request_scheduler import RequestScheduler
+
+QUESTION = "颱風停課了嗎？"
+VARIANTS = [QUESTION, "颱風停課了嗎?", " 颱風停課了嗎？", "颱風停課了嗎"]
+LLM_LATENCY = 0.2
+
+
+class CoalescingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.brain = bot.get_brain(60)
+        with cls.brain.db_lock:
+            cls.brain.cursor.execute(
+                "INSERT INTO knowledge (title, content, category, date, unit, url, attachments) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ("颱風停課公告", "因颱風來襲，明日停課一天。", "公告", "2099/01/01", "學務處", "https://example.com/typhoon", "無"))
+
+    def setUp(self):
+        brain = self.brain
+        self.calls = 0
+        self.lock = threading.Lock()
+
+        def fake_generate(prompt, config, purpose="answer"):
+            time.sleep(LLM_LATENCY)
+            with self.lock:
+                self.calls += 1
+            if purpose == "expansion":
+                return SimpleNamespace(text=json.dumps(["颱風", "停課"], ensure_ascii=False))
+            if config.get("response_mime_type") == "application/json":
+                return SimpleNamespace(text=json.dumps({"action": "answer", "answer": "明日停課"}, ensure_ascii=False))
+            return SimpleNamespace(text="明日停課")
+
+        brain._generate = fake_generate
+        brain.expansion_cache.clear()
+        self.coalesce = brain.coalesce
+
+    def tearDown(self):
+        del self.brain._generate
+        self.brain.coalesce = self.coalesce
+
+    def run_concurrently(self, n, call):
+        barrier = threading.Barrier(n)
+        results = [None] * n
+
+        def one(i):
+            barrier.wait()
+            results[i] = call(i)
+
+        threads = [threading.Thread(target=one, args=(i,)) for i in range(n)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+        return results
+
+    def test_direct_ask_calls_llm_once_per_stage(self):
+        results = self.run_concurrently(20, lambda i: self.brain.ask(VARIANTS[i % len(VARIANTS)]))
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(set(results), {"明日停課"})
+        self.assertEqual(self.brain.flights, {})
+
+    def test_without_coalescing_every_request_calls_llm(self):
+        self.brain.coalesce = False
+        self.run_concurrently(10, lambda i: self.brain.ask(VARIANTS[i % len(VARIANTS)]))
+        self.assertGreaterEqual(self.calls, 10)
+
+    def test_scheduler_shares_brain_flights(self):
+        scheduler = RequestScheduler(self.brain, timeout=10)
+        results = self.run_concurrently(30, lambda i: scheduler.submit(f"user-{i}", VARIANTS[i % len(VARIANTS)]))
+        stats = scheduler.stats()
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(set(results), {"明日停課"})
+        self.assertEqual(stats["queued"], 1)
+        self.assertEqual(stats["coalesced"], 29)
+        self.assertEqual(stats["coalescing"], 0)
+
+    def test_submit_async_returns_before_llm(self):
+        scheduler = RequestScheduler(self.brain, timeout=10)
+        fast_checks = []
+        fast_answer = self.brain.fast_answer
+        self.brain.fast_answer = lambda q: fast_checks.append(q) or fast_answer(q)
+        try:
+            delivered = threading.Event()
+            replies = []
+            started = time.perf_counter()
+            scheduler.submit_async("user-1", QUESTION, lambda r: (replies.append(r), delivered.set()))
+            # webhook 執行緒不等 LLM
+            self.assertLess(time.perf_counter() - started, LLM_LATENCY)
+            self.assertEqual(replies, [])
+            self.assertTrue(delivered.wait(10))
+        finally:
+            del self.brain.fast_answer
+        self.assertEqual(replies, ["明日停課"])
+        # 快速路徑只在 submit 時檢查一次，worker 不再重跑
+        self.assertEqual(fast_checks, [QUESTION])
+
+    def test_submit_async_fast_path_delivers_inline(self):
+        scheduler = RequestScheduler(self.brain, timeout=10)
+        replies = []
+        scheduler.submit_async("user-1", "學校電話", replies.append)
+        self.assertEqual(len(replies), 1)
+        self.assertIn("常用電話表", replies[0])
+        self.assertEqual(self.calls, 0)
+
+    def test_stub_explain_does_not_join_live_flight(self):
+        # /explain 模擬模式的答案不是真的：不能等正式請求，也不能讓正式請求拿到模擬答案
+        self.brain._generate = bot.HumanLikeBrain._generate.__get__(self.brain)
+        flight, leader = self.brain.open_flight(QUESTION)
+        self.assertTrue(leader)
+        results = []
+        worker = threading.Thread(target=lambda: results.append(self.brain.explain(QUESTION)))
+        worker.start()
+        worker.join(5)
+        self.brain.finish_flight(flight, "明日停課")
+        # 沒有等正式請求 (5 秒內就回來)，也沒有拿到它的答案
+        self.assertEqual(len(results), 1)
+        self.assertNotEqual(results[0]["answer"], "明日停課")
+        self.assertEqual(flight.result, "明日停課")
+
+
+if __name__ == "__main__":
+    unittest.main()
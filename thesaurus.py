@@ -0,0 +1,228 @@
+# ====================================================
+# 📚 本地查詢擴展詞庫 (Query-Expansion Thesaurus)
+# bot 原本每個問題都請 Gemini 想 3-5 個搜尋關鍵字，多一次往返與 token。
+# 1. 離線建置：從 enrich_data.py 產生的 tags、標題與處室 (unit) 統計共現關係，
+#    再加上人工種子同義詞 (泡麵 → 員生社 / 合作社、轉學 → 註冊組 ...)
+# 2. 輸出精簡的查表檔 nihs_thesaurus.json
+# 3. Thesaurus.expand()：以子字串查表在數十微秒內擴展問題，並回傳信心分數；
+#    信心不足時 bot 才呼叫 LLM
+# 建置：python thesaurus.py [--query 泡麵在哪買]
+# ====================================================
+import argparse
+import json
+import math
+import os
+import re
+import time
+import unicodedata
+from datetime import datetime
+from knowledge_model import load_records
+
+SOURCE_FILE = "nihs_knowledge_full.json"
+OUTPUT_FILE = "nihs_thesaurus.json"
+VERSION = 1
+
+MIN_DOC_FREQ = 2        # 出現少於此篇數的詞不建關聯
+MIN_CO_COUNT = 2        # 共同出現少於此篇數的配對忽略
+MIN_SCORE = 0.25        # Ochiai 相似度門檻
+MAX_NEIGHBORS = 6
+MIN_TERM_CHARS = 2
+MAX_KEYWORDS = 5
+MIN_CONFIDENCE = float(os.environ.get("THESAURUS_MIN_CONFIDENCE", "0.6"))
+
+# 人工種子：口語 → 資料庫用語 (單向)，與原本 LLM 提示詞中的範例一致並補上常見問題
+SEED_SYNONYMS = {
+    "泡麵": ["員生社", "合作社", "熱食", "販售"],
+    "福利社": ["員生社", "合作社"],
+    "轉學": ["教務處", "註冊組", "轉學考"],
+    "開學": ["行事曆", "開學", "註冊"],
+    "放假": ["行事曆", "放假", "補假"],
+    "考試": ["段考", "期中考", "期末考", "行事曆"],
+    "段考": ["段考", "期中考", "期末考"],
+    "補助": ["學費補助", "減免", "清寒", "獎助學金"],
+    "學費": ["學費", "減免", "補助", "繳費"],
+    "獎學金": ["獎學金", "獎助學金", "申請"],
+    "請假": ["學務處", "生輔組", "請假"],
+    "社團": ["學務處", "課外活動組", "社團"],
+    "升學": ["升學", "統測", "輔導室", "甄選"],
+    "午餐": ["午餐", "營養午餐", "衛生組"],
+    "制服": ["制服", "學務處", "服儀"],
+    "畢業": ["畢業典禮", "畢業", "教務處"],
+}
+
+# 計算信心時不算在內的疑問詞與虛詞
+QUESTION_WORDS = ["請問", "什麼時候", "什麼", "何時", "怎麼辦", "怎麼", "如何", "哪裡", "哪個", "哪些",
+                  "幾點", "幾號", "可以", "需要", "要", "有", "嗎", "呢", "的", "是", "在", "我", "你", "學校"]
+_PUNCT = re.compile(r"[\s\W_]+", re.UNICODE)
+
+
+def normalize_query(query):
+    """ 比對用的問題正規化：全形轉半形、小寫、去掉空白與標點 (合併請求、快取、記錄共用) """
+    return _PUNCT.sub("", unicodedata.normalize("NFKC", str(query)).lower())
+
+
+def _clean_tag(tag):
+    return str(tag).strip().lstrip("#").strip()
+
+
+# ==========================================
+# 🏗️ 離線建置
+# ==========================================
+def record_terms(item, vocabulary):
+    """ 一筆資料的詞彙集合：tags + 處室 + 標題中出現的已知詞 """
+    terms = {_clean_tag(t) for t in item.get("tags") or [] if isinstance(t, str)}
+    if item.get("unit"): terms.add(str(item["unit"]).strip())
+    title = str(item.get("title", ""))
+    terms.update(v for v in vocabulary if v in title)
+    return {t for t in terms if len(t) >= MIN_TERM_CHARS}
+
+
+def build_thesaurus(records):
+    # 1. 詞彙表：所有 tags 與處室名稱
+    vocabulary = set()
+    for item in records:
+        vocabulary.update(_clean_tag(t) for t in item.get("tags") or [] if isinstance(t, str))
+        if item.get("unit"): vocabulary.add(str(item["unit"]).strip())
+    vocabulary = {v for v in vocabulary if len(v) >= MIN_TERM_CHARS}
+
+    # 2. 文件頻率與共現次數
+    df, co = {}, {}
+    for item in records:
+        terms = sorted(record_terms(item, vocabulary))
+        for t in terms:
+            df[t] = df.get(t, 0) + 1
+        for i, a in enumerate(terms):
+            for b in terms[i + 1:]:
+                co[(a, b)] = co.get((a, b), 0) + 1
+
+    # 3. Ochiai 相似度 c(a,b) / sqrt(df(a) df(b))：常見詞 (例如 #教務處) 不會與所有詞都相關
+    neighbors = {}
+    for (a, b), c in co.items():
+        if c < MIN_CO_COUNT or df[a] < MIN_DOC_FREQ or df[b] < MIN_DOC_FREQ: continue
+        score = c / math.sqrt(df[a] * df[b])
+        if score < MIN_SCORE: continue
+        neighbors.setdefault(a, []).append((b, score))
+        neighbors.setdefault(b, []).append((a, score))
+
+    terms = {}
+    for t, ns in neighbors.items():
+        ns.sort(key=lambda x: (-x[1], x[0]))
+        terms[t] = [[n, round(s, 3)] for n, s in ns[:MAX_NEIGHBORS]]
+    # 4. 種子同義詞優先 (分數 1.0)，再接上統計出的關聯
+    for word, targets in SEED_SYNONYMS.items():
+        mined = [x for x in terms.get(word, []) if x[0] not in targets]
+        terms[word] = [[t, 1.0] for t in targets] + mined[:MAX_NEIGHBORS]
+    # 只出現在詞彙表、沒有鄰居的詞也保留 (能命中就代表問題用到資料庫用語)
+    for v in vocabulary:
+        terms.setdefault(v, [])
+
+    return {
+        "version": VERSION,
+        "built_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "records": len(records),
+        "terms": dict(sorted(terms.items())),
+    }
+
+
+# ==========================================
+# ⚡ 查詢擴展 (bot 端)
+# ==========================================
+class Thesaurus:
+    """
+    用法：
+        thesaurus = Thesaurus.load()
+        keywords, confidence = thesaurus.expand("泡麵在哪裡買")
+    """
+
+    def __init__(self, terms=None):
+        self.terms = terms or {}
+        self.max_len = max((len(t) for t in self.terms), default=0)
+
+    @classmethod
+    def load(cls, path=OUTPUT_FILE):
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return cls(data.get("terms", {}))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 詞庫讀取失敗: {e}")
+            return cls()
+
+    def __len__(self):
+        return len(self.terms)
+
+    def _matches(self, text):
+        """ 由左至右取最長命中的詞 (枚舉子字串查 dict，比逐一比對所有詞快) """
+        found, i = [], 0
+        while i < len(text):
+            for size in range(min(self.max_len, len(text) - i), MIN_TERM_CHARS - 1, -1):
+                word = text[i:i + size]
+                if word in self.terms:
+                    found.append((i, word))
+                    i += size
+                    break
+            else:
+                i += 1
+        return found
+
+    def expand(self, query, max_keywords=MAX_KEYWORDS):
+        """
+        回傳 (關鍵字清單, 信心 0~1)。
+        信心 = 問題中 (去掉疑問詞與標點後) 被詞庫涵蓋的字元比例
+        """
+        if not self.terms:
+            return [query], 0.0
+        text = _PUNCT.sub("", query)
+        matches = self._matches(text)
+        if not matches:
+            return [query], 0.0
+
+        keywords = []
+        for _, word in matches:
+            if word not in keywords: keywords.append(word)
+        for _, word in matches:
+            for neighbor, _score in self.terms[word]:
+                if len(keywords) >= max_keywords: break
+                if neighbor not in keywords: keywords.append(neighbor)
+
+        covered = sum(len(w) for _, w in matches)
+        content = text
+        for w in QUESTION_WORDS:
+            content = content.replace(w, "")
+        meaningful = max(len(content), 1)
+        # 命中的詞本身可能包含疑問詞以外的字，上限 1.0
+        confidence = min(covered / meaningful, 1.0)
+        return keywords[:max_keywords], round(confidence, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="從全知資料庫建置本地查詢擴展詞庫")
+    parser.add_argument("--source", default=SOURCE_FILE)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--query", action="append", default=[], help="建置後測試擴展 (可重複)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.source):
+        start = time.time()
+        thesaurus = build_thesaurus(load_records(args.source))
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(thesaurus, f, ensure_ascii=False, separators=(",", ":"))
+        linked = sum(1 for v in thesaurus["terms"].values() if v)
+        print(f"📚 詞庫完成：{len(thesaurus['terms'])} 個詞 (有關聯 {linked} 個)，"
+              f"{os.path.getsize(args.output) / 1024:.0f} KB，耗時 {time.time() - start:.2f} 秒")
+    else:
+        print(f"⚠️ 找不到 {args.source}，略過建置。")
+
+    if args.query:
+        thesaurus = Thesaurus.load(args.output)
+        for q in args.query:
+            t0 = time.perf_counter()
+            keywords, confidence = thesaurus.expand(q)
+            us = (time.perf_counter() - t0) * 1e6
+            print(f"   🔎 {q} → {keywords} (信心 {confidence:.2f}, {us:.0f} µs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,266 +1,408 @@
-# ====================================================
-# 🧠 終極大腦建構者 V40 (Target Locked / printHere 精確鎖定版)
-# 目標：
-# 1. 根據使用者提供的 HTML，鎖定 id="printHere" 抓取內文
-# 2. 鎖定 .htmldisplay class 提取純文字
-# 3. 完整保留內文與附件，與真實網址一併存檔
-# ====================================================
-import asyncio
-import json
-import re
-import os
-from datetime import datetime
-from playwright.async_api import async_playwright, expect
-
-# 📂 設定
-TARGET_URL = "https://www.nihs.tp.edu.tw/nss/s/main/index"
-MAX_PAGES = 10      # 每個處室抓 5 頁
-OUTPUT_FILENAME = "nihs_final_v40.json"
-
-TARGET_TABS = [
-    "重要訊息 頁籤",
-    "學務處 頁籤",
-    "教務處 頁籤",
-    "實習處 頁籤",
-    "輔導室 頁籤",
-    "圖書館 頁籤",
-    "政令宣導 頁籤",
-    "合作社 頁籤",
-    "學生活動 頁籤",
-    "新生專區 頁籤",
-    "升學資訊 頁籤",
-    "考試資訊 頁籤",
-    "教師研習 頁籤",
-    "政令宣導 頁籤",
-]
-
-all_data = []
-
-async def force_close_modal(page):
-    """暴力關閉視窗"""
-    await page.keyboard.press("Escape")
-    try:
-        # 嘗試點擊右上角關閉鈕
-        close_btn = page.locator("button.close, button[data-dismiss='modal'], #closeCross").first
-        if await close_btn.is_visible():
-            await close_btn.click()
-    except: pass
-    
-    # 點擊背景 (座標 0,0)
-    await page.mouse.click(0, 0)
-    await page.wait_for_timeout(500)
-
-async def extract_details(page):
-    """
-    提取資料 (基於 HTML id="printHere")
-    """
-    data = {"body": "", "attachments": [], "real_url": "無法取得"}
-    
-    try:
-        # 等待視窗載入 (以 mailto 按鈕或 printHere 出現為準)
-        try:
-            await page.wait_for_selector("#printHere, a[href^='mailto:']", state="visible", timeout=5000)
-        except:
-            return data # 逾時返回空資料
-
-        # 1. 提取 Permalink (這部分之前已驗證成功)
-        try:
-            mailto = page.locator("a[href^='mailto:']").first
-            if await mailto.count() > 0:
-                href = await mailto.get_attribute("href")
-                match = re.search(r'(https?://[^\s&]+)', href)
-                if match: data["real_url"] = match.group(1).replace("&amp;", "&")
-        except: pass
-        
-        # 2. 提取內文 (Body) - 【核心修正點】
-        # 根據您的 HTML，內容在 #printHere 下面的 .htmldisplay
-        # 如果沒有 .htmldisplay，就直接抓 #printHere 的文字
-        print_here = page.locator("#printHere").first
-        
-        if await print_here.count() > 0:
-            # 優先找 .htmldisplay (通常包含排版好的內文)
-            html_display = print_here.locator(".htmldisplay")
-            if await html_display.count() > 0:
-                data["body"] = await html_display.inner_text()
-            else:
-                # 備案：直接抓 printHere 容器文字
-                data["body"] = await print_here.inner_text()
-        else:
-            # 備案：如果這篇剛好沒有 printHere (舊版公告)，回退到通用選擇器
-            fallback = page.locator(".modal-body, .module-detail").first
-            if await fallback.count() > 0:
-                data["body"] = await fallback.inner_text()
-
-        # 3. 提取附件 (Attachments)
-        # 掃描 #printHere 內部以及整個 modal
-        modal_content = page.locator(".modal-content, div[role='dialog']").first
-        
-        # 收集候選區域
-        candidates = []
-        if await print_here.count() > 0: candidates.append(print_here)
-        if await modal_content.count() > 0: candidates.append(modal_content)
-        
-        seen_urls = set() # 防止重複
-        
-        for container in candidates:
-            links = await container.locator("a").all()
-            for link in links:
-                href = await link.get_attribute("href")
-                text = await link.inner_text()
-                text = text.strip()
-                
-                if not href: continue
-                href_lower = href.lower()
-                
-                # 判斷是否為檔案
-                is_file = False
-                # 特徵 A: 包含 feeder
-                if "feeder" in href_lower: is_file = True
-                # 特徵 B: 副檔名
-                elif any(ext in href_lower for ext in ['.pdf', '.doc', '.xls', '.ppt', '.zip', '.jpg', '.png']): is_file = True
-                
-                # 排除
-                if "mailto:" in href_lower: is_file = False
-                if not text: is_file = False 
-                
-                if is_file:
-                    if href.startswith("/"): href = "https://www.nihs.tp.edu.tw" + href
-                    
-                    if href not in seen_urls:
-                        data["attachments"].append({"name": text, "url": href})
-                        seen_urls.add(href)
-
-    except Exception as e:
-        print(f"      ⚠️ 解析細節微誤: {e}")
-        
-    return data
-
-async def harvest_tab(page, tab_label):
-    print(f"\n🔵 準備切換至: {tab_label} ...")
-    
-    # 1. 頁籤切換
-    tab_link = page.locator(f"a[aria-label='{tab_label}']")
-    tab_li = page.locator(f"//li[contains(@class, 'nav-item') and .//a[@aria-label='{tab_label}']]")
-    
-    if await tab_link.count() == 0:
-        print(f"❌ 找不到頁籤: {tab_label}")
-        return
-
-    is_active = await tab_li.get_attribute("class")
-    if "active" not in str(is_active):
-        await tab_link.click()
-        try:
-            await expect(tab_li).to_have_class(re.compile(r"active"), timeout=5000)
-            print("   ✅ 頁籤切換成功")
-        except:
-            print("   ⚠️ 頁籤切換超時，嘗試繼續...")
-    else:
-        print("   ✅ 已經在目標頁籤")
-
-    container = tab_li
-    try:
-        await container.locator("table").wait_for(state="visible", timeout=5000)
-    except: return
-
-    # 2. 分頁迴圈
-    for current_page in range(1, MAX_PAGES + 1):
-        print(f"   📄 [第 {current_page} 頁] ...")
-
-        # 翻頁
-        if current_page > 1:
-            page_btn = container.locator(f"button[title='第{current_page}頁']")
-            if await page_btn.count() == 0: page_btn = container.locator("button[title='下一頁']")
-            if await page_btn.count() > 0:
-                try:
-                    await page_btn.click()
-                    await page.wait_for_timeout(3000)
-                except: break
-            else:
-                print("      🏁 無下一頁")
-                break
-
-        # 逐行處理
-        rows = await container.locator("table tbody tr").all()
-        total_rows = len(rows)
-        print(f"      📊 發現 {total_rows} 行...")
-
-        for i in range(total_rows):
-            row = container.locator("table tbody tr").nth(i)
-            if await row.locator("td").count() < 3: continue
-
-            title_el = row.locator("td:nth-child(1) a").first
-            if await title_el.count() == 0: continue
-
-            title = await title_el.inner_text()
-            unit = await row.locator("td:nth-child(2)").inner_text()
-            date = await row.locator("td:nth-child(3)").inner_text()
-            
-            await title_el.scroll_into_view_if_needed()
-            print(f"      [{i+1:02d}] {title[:10]}...", end="", flush=True)
-
-            try:
-                # 點擊開啟
-                await title_el.click()
-                
-                # 抓取詳細資料
-                details = await extract_details(page)
-                
-                # 狀態顯示
-                status = []
-                if details["real_url"] != "無法取得": status.append("🔗")
-                if len(details["body"]) > 10: status.append(f"📝{len(details['body'])}字")
-                if len(details["attachments"]) > 0: status.append(f"📎{len(details['attachments'])}")
-                
-                if status:
-                    print(f" -> ✅ {' '.join(status)}", end="", flush=True)
-                else:
-                    print(f" -> ⚠️ 空資料", end="", flush=True)
-
-                # 存檔
-                all_data.append({
-                    "category": tab_label.replace(" 頁籤", ""),
-                    "date": date.strip(),
-                    "unit": unit.strip(),
-                    "title": title.strip(),
-                    "url": details["real_url"],
-                    "content": details["body"].strip(),
-                    "attachments": details["attachments"],
-                    "crawled_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                })
-
-            except Exception as e:
-                print(f" -> ❌ {e}", end="", flush=True)
-
-            # 關閉視窗
-            await force_close_modal(page)
-            print(" -> ⏹️", flush=True)
-            await page.wait_for_timeout(500)
-
-async def main():
-    print("🚀 V40 (printHere 精確鎖定版) 啟動...")
-    async with async_playwright() as p:
-        # 改成 True，代表在背景執行 (無頭模式)
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page()
-        
-        await page.goto(TARGET_URL)
-        await page.wait_for_load_state("networkidle")
-        
-        for tab in TARGET_TABS:
-            await harvest_tab(page, tab)
-            await page.wait_for_timeout(1000)
-        
-        await browser.close()
-
-    print("\n" + "="*30)
-    if all_data:
-        with open(OUTPUT_FILENAME, 'w', encoding='utf-8') as f:
-            json.dump(all_data, f, ensure_ascii=False, indent=4)
-        print(f"✅ 全部完成！共 {len(all_data)} 筆。")
-        print(f"👉 檔案: {os.path.abspath(OUTPUT_FILENAME)}")
-    else:
-        print("⚠️ 無資料")
-
-if __name__ == "__main__":
-
-    asyncio.run(main())
+# ====================================================
+# 🧠 終極大腦建構者 V40 (Target Locked / printHere 精確鎖定版)
+# 目標：
+# 1. 根據使用者提供的 HTML，鎖定 id="printHere" 抓取內文
+# 2. 鎖定 .htmldisplay class 提取純文字
+# 3. 完整保留內文與附件，與真實網址一併存檔
+# ====================================================
+import asyncio
+import json
+import re
+import os
+from datetime import datetime
+from playwright.async_api import async_playwright, expect
+from crawl_common import HostRateLimiter, CrawlStats, is_attachment_link, absolute_url
+from crawl_profile import apply_crawl_profile
+from knowledge_model import load_records, is_record
+
+# 📂 設定
+TARGET_URL = "https://www.nihs.tp.edu.tw/nss/s/main/index"
+MAX_PAGES = 10      # 每個處室抓 5 頁
+OUTPUT_FILENAME = "nihs_final_v40.json"
+
+TARGET_TABS = [
+    "重要訊息 頁籤",
+    "學務處 頁籤",
+    "教務處 頁籤",
+    "實習處 頁籤",
+    "輔導室 頁籤",
+    "圖書館 頁籤",
+    "政令宣導 頁籤",
+    "合作社 頁籤",
+    "學生活動 頁籤",
+    "新生專區 頁籤",
+    "升學資訊 頁籤",
+    "考試資訊 頁籤",
+    "教師研習 頁籤",
+]
+
+# ⚡ 平行設定：同時開幾個分頁 (各自獨立的 browser context)，以及對同一主機的最小請求間隔
+CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", "4"))
+HOST_MIN_INTERVAL = float(os.environ.get("CRAWL_HOST_INTERVAL", "0.3"))
+
+# 🔁 增量模式：已在主資料庫中的公告不再開啟視窗；連續遇到 N 筆舊公告就停止翻頁
+# 設定 CRAWL_FULL_REFRESH=1 可強制全量重抓
+# 🌐 內文抓取模式：modal = 點擊視窗 (預設)；http = 有 Permalink 者改以 HTTP 平行直連抓取，失敗再回退視窗
+DETAIL_MODE = os.environ.get("CRAWL_DETAIL_MODE", "modal")
+KNOWLEDGE_FILE = "nihs_knowledge_full.json"
+FULL_REFRESH = os.environ.get("CRAWL_FULL_REFRESH", "0") == "1"
+EARLY_STOP_KNOWN = int(os.environ.get("CRAWL_EARLY_STOP", "10"))
+# HTTP 模式：標題連結與所在列上可能帶有公告 id 的屬性值 (href / onclick / data-*)
+ROW_ATTRS_JS = """el => [el, el.closest('tr'), ...el.closest('tr').querySelectorAll('[onclick], [href], [data-id], [data-url], [data-href]')]
+    .flatMap(node => Array.from(node.attributes, attr => attr.value))"""
+
+def row_key(title, unit, date):
+    """ 公告列的比對鍵 (標題, 單位, 日期) """
+    return (title.strip(), unit.strip(), date.strip())
+
+def load_known_keys(path=KNOWLEDGE_FILE):
+    """ 讀取主資料庫，回傳 {(標題, 單位, 日期): 網址} 與已知網址集合 """
+    keys, urls = {}, set()
+    if not os.path.exists(path):
+        return keys, urls
+    for item in load_records(path):
+        if not is_record(item) or not item.get('title'): continue
+        url = item.get('url', '')
+        if not url.startswith("http"): url = None
+        keys[row_key(item.get('title', ''), item.get('unit', ''), item.get('date', ''))] = url
+        if url: urls.add(url)
+        # merge_data.py 去重時併入代表資料的複本 (其他頁籤的同一則公告) 也視為已知
+        for dup in item.get('duplicates', []):
+            dup_url = dup.get('key') if str(dup.get('key', '')).startswith("http") else None
+            keys[row_key(dup.get('title', ''), dup.get('unit', ''), dup.get('date', ''))] = dup_url
+            if dup_url: urls.add(dup_url)
+    return keys, urls
+
+async def force_close_modal(page):
+    """暴力關閉視窗"""
+    await page.keyboard.press("Escape")
+    try:
+        # 嘗試點擊右上角關閉鈕
+        close_btn = page.locator("button.close, button[data-dismiss='modal'], #closeCross").first
+        if await close_btn.is_visible():
+            await close_btn.click()
+    except: pass
+    
+    # 點擊背景 (座標 0,0)
+    await page.mouse.click(0, 0)
+    # 等待視窗真正消失 (取代固定 500ms 等待)
+    try:
+        await page.locator("#printHere").first.wait_for(state="hidden", timeout=3000)
+    except: pass
+
+async def extract_details(page):
+    """
+    提取資料 (基於 HTML id="printHere")
+    """
+    data = {"body": "", "attachments": [], "real_url": "無法取得"}
+    
+    try:
+        # 等待視窗載入 (以 mailto 按鈕或 printHere 出現為準)
+        try:
+            await page.wait_for_selector("#printHere, a[href^='mailto:']", state="visible", timeout=5000)
+        except:
+            return data # 逾時返回空資料
+
+        # 1. 提取 Permalink (這部分之前已驗證成功)
+        try:
+            mailto = page.locator("a[href^='mailto:']").first
+            if await mailto.count() > 0:
+                href = await mailto.get_attribute("href")
+                match = re.search(r'(https?://[^\s&]+)', href)
+                if match: data["real_url"] = match.group(1).replace("&amp;", "&")
+        except: pass
+        
+        # 2. 提取內文 (Body) - 【核心修正點】
+        # 根據您的 HTML，內容在 #printHere 下面的 .htmldisplay
+        # 如果沒有 .htmldisplay，就直接抓 #printHere 的文字
+        print_here = page.locator("#printHere").first
+        
+        if await print_here.count() > 0:
+            # 優先找 .htmldisplay (通常包含排版好的內文)
+            html_display = print_here.locator(".htmldisplay")
+            if await html_display.count() > 0:
+                data["body"] = await html_display.inner_text()
+            else:
+                # 備案：直接抓 printHere 容器文字
+                data["body"] = await print_here.inner_text()
+        else:
+            # 備案：如果這篇剛好沒有 printHere (舊版公告)，回退到通用選擇器
+            fallback = page.locator(".modal-body, .module-detail").first
+            if await fallback.count() > 0:
+                data["body"] = await fallback.inner_text()
+
+        # 3. 提取附件 (Attachments)
+        # 掃描 #printHere 內部以及整個 modal
+        modal_content = page.locator(".modal-content, div[role='dialog']").first
+        
+        # 收集候選區域
+        candidates = []
+        if await print_here.count() > 0: candidates.append(print_here)
+        if await modal_content.count() > 0: candidates.append(modal_content)
+        
+        seen_urls = set() # 防止重複
+        
+        for container in candidates:
+            links = await container.locator("a").all()
+            for link in links:
+                href = await link.get_attribute("href")
+                text = await link.inner_text()
+                text = text.strip()
+                
+                # 判斷是否為檔案 (規則與 HTTP 模式共用，見 crawl_common.is_attachment_link)
+                if is_attachment_link(href, text):
+                    href = absolute_url(href)
+                    
+                    if href not in seen_urls:
+                        data["attachments"].append({"name": text, "url": href})
+                        seen_urls.add(href)
+
+    except Exception as e:
+        print(f"      ⚠️ 解析細節微誤: {e}")
+        
+    return data
+
+async def harvest_tab(page, tab_label, limiter, known_index, incremental=True, stats=None, fetcher=None):
+    """
+    抓取單一頁籤，回傳該頁籤的公告清單
+    known_index: load_known_keys() 的結果；incremental=False 代表全量模式
+    fetcher: DetailFetcher (HTTP 模式)；None 代表一律點擊視窗
+    """
+    known_map, known_urls = known_index
+    known = known_map if incremental else None
+    records = []
+    known_streak = 0
+    tag = tab_label.replace(" 頁籤", "")
+    print(f"🔵 [{tag}] 準備切換頁籤 ...")
+    
+    # 1. 頁籤切換
+    tab_link = page.locator(f"a[aria-label='{tab_label}']")
+    tab_li = page.locator(f"//li[contains(@class, 'nav-item') and .//a[@aria-label='{tab_label}']]")
+    
+    if await tab_link.count() == 0:
+        print(f"❌ [{tag}] 找不到頁籤")
+        return records
+
+    is_active = await tab_li.get_attribute("class")
+    if "active" not in str(is_active):
+        # 切換頁籤會載入清單：點擊與等待載入都佔用同一個主機名額
+        async with limiter.slot(TARGET_URL):
+            await tab_link.click()
+            try:
+                await expect(tab_li).to_have_class(re.compile(r"active"), timeout=5000)
+                print(f"   ✅ [{tag}] 頁籤切換成功")
+            except:
+                print(f"   ⚠️ [{tag}] 頁籤切換超時，嘗試繼續...")
+    else:
+        print(f"   ✅ [{tag}] 已經在目標頁籤")
+
+    container = tab_li
+    try:
+        await container.locator("table").wait_for(state="visible", timeout=5000)
+    except: return records
+
+    # 2. 分頁迴圈
+    for current_page in range(1, MAX_PAGES + 1):
+        if known is not None and known_streak >= EARLY_STOP_KNOWN:
+            print(f"      ⏹️ [{tag}] 連續 {known_streak} 筆已收錄，提前停止翻頁")
+            break
+
+        # 翻頁
+        if current_page > 1:
+            page_btn = container.locator(f"button[title='第{current_page}頁']")
+            if await page_btn.count() == 0: page_btn = container.locator("button[title='下一頁']")
+            if await page_btn.count() > 0:
+                first_row = container.locator("table tbody tr").first
+                old_text = await first_row.inner_text()
+                try:
+                    async with limiter.slot(TARGET_URL):
+                        await page_btn.click()
+                        # 等待表格第一列內容改變 (取代固定 3 秒等待)
+                        await expect(first_row).not_to_have_text(old_text, timeout=10000)
+                except: break
+            else:
+                print(f"      🏁 [{tag}] 無下一頁")
+                break
+
+        # 逐行處理：先收集本頁各列資訊
+        rows = await container.locator("table tbody tr").all()
+        total_rows = len(rows)
+        print(f"   📄 [{tag}] 第 {current_page} 頁，發現 {total_rows} 行...")
+
+        pending = []
+        for i in range(total_rows):
+            row = container.locator("table tbody tr").nth(i)
+            if await row.locator("td").count() < 3: continue
+
+            title_el = row.locator("td:nth-child(1) a").first
+            if await title_el.count() == 0: continue
+
+            title = await title_el.inner_text()
+            unit = await row.locator("td:nth-child(2)").inner_text()
+            date = await row.locator("td:nth-child(3)").inner_text()
+            href = await title_el.get_attribute("href") or ""
+            key = row_key(title, unit, date)
+
+            # 增量模式：已收錄的公告直接跳過，不開視窗
+            if known is not None:
+                if key in known or href in known_urls:
+                    known_streak += 1
+                    if stats: stats.skipped += 1
+                    if known_streak >= EARLY_STOP_KNOWN: break
+                    continue
+                known_streak = 0
+
+            # HTTP 模式：主資料庫中已還原的 Permalink (全量模式)，其次由列上的屬性推導
+            permalink = None
+            if fetcher is not None:
+                permalink = known_map.get(key) or fetcher.permalink_for(tag, await title_el.evaluate(ROW_ATTRS_JS))
+            pending.append((i, title, unit, date, permalink))
+
+        # HTTP 模式：本頁有 Permalink 的公告一次平行抓取
+        fetched = {}
+        if fetcher is not None:
+            urls = [p[4] for p in pending if p[4]]
+            if len(urls) < len(pending):
+                print(f"      ↩️ [{tag}] {len(pending) - len(urls)} 筆推導不出 Permalink，改點擊視窗")
+            if urls:
+                fetched = await fetcher.fetch_many(urls)
+
+        for i, title, unit, date, permalink in pending:
+            label = f"      [{tag} {i+1:02d}] {title[:10]}..."
+            details = fetched.get(permalink) if permalink else None
+            mode = "🌐"
+
+            if not details or not details["body"]:
+                # 視窗模式 (HTTP 取不到內文時的備案)
+                mode = ""
+                details = None
+                title_el = container.locator("table tbody tr").nth(i).locator("td:nth-child(1) a").first
+                try:
+                    await title_el.scroll_into_view_if_needed()
+                    # 點擊開啟
+                    async with limiter.slot(TARGET_URL):
+                        await title_el.click()
+                    # 抓取詳細資料
+                    details = await extract_details(page)
+                except Exception as e:
+                    print(f"{label} -> ❌ {e}", flush=True)
+
+                # 關閉視窗 (內含「等待視窗消失」的事件等待)
+                await force_close_modal(page)
+                if details is None: continue
+
+            # 狀態顯示
+            status = []
+            if details["real_url"] != "無法取得": status.append("🔗")
+            if len(details["body"]) > 10: status.append(f"📝{len(details['body'])}字")
+            if len(details["attachments"]) > 0: status.append(f"📎{len(details['attachments'])}")
+
+            if status:
+                print(f"{label} -> ✅{mode} {' '.join(status)}", flush=True)
+            else:
+                print(f"{label} -> ⚠️ 空資料", flush=True)
+
+            # 存檔
+            records.append({
+                "category": tag,
+                "date": date.strip(),
+                "unit": unit.strip(),
+                "title": title.strip(),
+                "url": details["real_url"],
+                "content": details["body"].strip(),
+                "attachments": details["attachments"],
+                "crawled_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+
+    return records
+
+async def tab_worker(browser, queue, results, limiter, stats, known_index, fetcher):
+    """ 工作者：開一個獨立 context，從佇列領取頁籤依序處理 """
+    context = await browser.new_context()
+    await apply_crawl_profile(context, stats)
+    page = await context.new_page()
+    stats.attach(page)
+    try:
+        # 導覽與等待頁面載入完成都在限速名額內 (載入期間仍持續對學校主機發請求)
+        async with limiter.slot(TARGET_URL):
+            await page.goto(TARGET_URL)
+            await page.wait_for_load_state("networkidle")
+
+        while True:
+            try:
+                tab = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            try:
+                results[tab] = await harvest_tab(page, tab, limiter, known_index, not FULL_REFRESH, stats, fetcher)
+            except Exception as e:
+                print(f"❌ [{tab}] 頁籤處理失敗: {e}")
+                results[tab] = []
+            finally:
+                queue.task_done()
+    finally:
+        await context.close()
+
+async def crawl_tabs(tabs, limiter, stats, known_index, fetcher):
+    """ 開啟瀏覽器，以多個分頁平行處理所有頁籤，回傳 {頁籤: 公告清單} """
+    results = {}
+    async with async_playwright() as p:
+        # 改成 True，代表在背景執行 (無頭模式)
+        browser = await p.chromium.launch(headless=True)
+
+        queue = asyncio.Queue()
+        for tab in tabs:
+            queue.put_nowait(tab)
+
+        workers = min(CONCURRENCY, len(tabs))
+        print(f"⚡ 平行處理 {len(tabs)} 個頁籤，使用 {workers} 個分頁")
+        await asyncio.gather(*[tab_worker(browser, queue, results, limiter, stats, known_index, fetcher) for _ in range(workers)])
+        
+        await browser.close()
+    return results
+
+async def main():
+    print("🚀 V40 (printHere 精確鎖定版) 啟動...")
+    tabs = TARGET_TABS
+    limiter = HostRateLimiter(max_concurrency=CONCURRENCY, min_interval=HOST_MIN_INTERVAL)
+    stats = CrawlStats()
+
+    known_index = load_known_keys()
+    if FULL_REFRESH:
+        print("🔄 強制全量模式 (CRAWL_FULL_REFRESH=1)")
+    else:
+        print(f"🔁 增量模式：已收錄 {len(known_index[0])} 筆公告，連續 {EARLY_STOP_KNOWN} 筆舊資料即停止翻頁")
+
+    if DETAIL_MODE == "http":
+        # aiohttp / bs4 只有 HTTP 模式需要，避免預設模式多一層依賴
+        from detail_fetcher import DetailFetcher, permalink_prefixes
+        print("🌐 內文抓取：HTTP 直連模式 (無 Permalink 者回退點擊視窗)")
+        records = [r for r in load_records(KNOWLEDGE_FILE) if is_record(r)] if os.path.exists(KNOWLEDGE_FILE) else []
+        # 與瀏覽器共用 limiter：HTTP 直連同樣遵守每個主機的最小請求間隔
+        async with DetailFetcher(limiter=limiter, prefixes=permalink_prefixes(records)) as fetcher:
+            results = await crawl_tabs(tabs, limiter, stats, known_index, fetcher)
+        stats.requests += fetcher.requests
+        print(f"🌐 Permalink 推導成功 {fetcher.derived} 筆，回退點擊視窗 {fetcher.fallbacks} 筆")
+    else:
+        results = await crawl_tabs(tabs, limiter, stats, known_index, None)
+
+    # 依 TARGET_TABS 順序組合結果，確保輸出穩定
+    all_data = [item for tab in tabs for item in results.get(tab, [])]
+    stats.items = len(all_data)
+
+    print("\n" + "="*30)
+    stats.report("動態公告爬取")
+    if not FULL_REFRESH:
+        print(f"⏭️ 增量模式略過已收錄公告: {stats.skipped} 筆")
+    if all_data or not FULL_REFRESH:
+        # 增量模式即使沒有新公告也寫出空檔，避免 merge_data 重複合併舊的增量檔
+        with open(OUTPUT_FILENAME, 'w', encoding='utf-8') as f:
+            json.dump(all_data, f, ensure_ascii=False, indent=4)
+        print(f"✅ 全部完成！共 {len(all_data)} 筆。")
+        print(f"👉 檔案: {os.path.abspath(OUTPUT_FILENAME)}")
+    else:
+        print("⚠️ 無資料")
+
+if __name__ == "__main__":
+
+    asyncio.run(main())
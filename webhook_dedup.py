@@ -0,0 +1,105 @@
+# ====================================================
+# 🔁 Webhook 重送去重 (Idempotent Webhook Processing)
+# /callback 回應太慢時 LINE 會重送同一個事件 (deliveryContext.isRedelivery = true)，
+# 每次重送都會再跑一次 brain.ask 與兩次 Gemini 呼叫。
+# 1. 以 webhookEventId 為鍵的「已處理集合」，存在本機 SQLite 檔 (gunicorn 多個 worker 共用)
+# 2. 有 TTL 與筆數上限，過期資料定期清除
+# 3. 重複事件直接回 200 不再計算，並累計計數器供 /metrics 顯示
+# ====================================================
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+DB_PATH = os.environ.get("WEBHOOK_DEDUP_DB", os.path.join(tempfile.gettempdir(), "nihs_webhook_events.db"))
+TTL_SECONDS = int(os.environ.get("WEBHOOK_DEDUP_TTL", "86400"))
+MAX_ENTRIES = int(os.environ.get("WEBHOOK_DEDUP_MAX", "50000"))
+PRUNE_EVERY = 200           # 每寫入幾筆清一次過期資料
+
+COUNTERS = ("events", "duplicates_suppressed", "redeliveries", "redeliveries_processed", "released")
+
+
+class EventDeduplicator:
+    """
+    用法：
+        dedup = EventDeduplicator()
+        if not dedup.claim(event_id, is_redelivery):
+            return  # 已處理過 (或正在處理)
+        try: ... except: dedup.release(event_id); raise
+    """
+
+    def __init__(self, path=DB_PATH, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes = 0
+        # 每個 worker 一條連線；WAL 讓多行程同時讀寫不互相阻塞
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen_events (event_id TEXT PRIMARY KEY, seen_at REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_at ON seen_events (seen_at)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self.conn.executemany("INSERT OR IGNORE INTO counters VALUES (?, 0)", [(c,) for c in COUNTERS])
+
+    def _bump(self, *names):
+        for name in names:
+            self.conn.execute("UPDATE counters SET value = value + 1 WHERE name = ?", (name,))
+
+    def claim(self, event_id, is_redelivery=False):
+        """ 第一次看到 (或已過期) 回傳 True；TTL 內重複的事件回傳 False """
+        if not event_id:
+            return True
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._bump("events")
+                if is_redelivery: self._bump("redeliveries")
+                cur = self.conn.execute(
+                    "INSERT INTO seen_events VALUES (?, ?) ON CONFLICT(event_id) DO UPDATE SET seen_at = excluded.seen_at "
+                    "WHERE seen_events.seen_at < ?", (event_id, now, now - self.ttl))
+                first = cur.rowcount > 0
+                if not first:
+                    self._bump("duplicates_suppressed")
+                elif is_redelivery:
+                    # 原本那次沒有留下紀錄 (worker 重啟或處理失敗)，照常處理
+                    self._bump("redeliveries_processed")
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+            if self._writes % PRUNE_EVERY == 0:
+                self.prune(now)
+        return first
+
+    def release(self, event_id):
+        """ 處理失敗時移除紀錄，讓 LINE 的下一次重送可以重新處理 """
+        if not event_id:
+            return
+        with self._lock:
+            self.conn.execute("DELETE FROM seen_events WHERE event_id = ?", (event_id,))
+            self._bump("released")
+
+    def prune(self, now=None):
+        """ 清除過期資料，並把筆數壓在上限內 (先刪最舊的) """
+        now = now or time.time()
+        self.conn.execute("DELETE FROM seen_events WHERE seen_at < ?", (now - self.ttl,))
+        self.conn.execute(
+            "DELETE FROM seen_events WHERE event_id IN (SELECT event_id FROM seen_events "
+            "ORDER BY seen_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def stats(self):
+        counters = dict(self.conn.execute("SELECT name, value FROM counters").fetchall())
+        counters["tracked_events"] = self.conn.execute("SELECT COUNT(*) FROM seen_events").fetchone()[0]
+        return counters
+
+
+def event_identity(event):
+    """ 從 LINE SDK 事件取出 (webhookEventId, isRedelivery)；舊版 SDK 沒有這兩個欄位時回傳 (None, False) """
+    event_id = getattr(event, "webhook_event_id", None)
+    context = getattr(event, "delivery_context", None)
+    return event_id, bool(getattr(context, "is_redelivery", False))